@@ -0,0 +1,86 @@
+import time
+
+from ds4_protocol import FLAG_SEQUENCE, FLAG_STATE, frame_size, state_frame_size
+from latency_trace import LatencyHistogram
+
+
+class AckTracker:
+    """
+    Delivery of the frames written to one peripheral, from the cumulative acks it notifies
+    (ACK_MODE = ACK_CUMULATIVE in peripheral/main.py). Only frames with a sequence number are tracked,
+    encode them with FrameEncoder(sequence=True).
+    Every ack tells how many frames the peripheral received so far and the sequence number of the last one,
+    the frames written up to that sequence number and not received count as lost. Frames replaced in the send
+    queue are never written and do not count. The round trip is measured from the write of the acknowledged
+    frame to the arrival of the ack, acks sent by the peripheral's timer add up to its ack interval to it.
+    Sequence numbers wrap at 256, the peripheral has to ack more often than that.
+    """
+    def __init__(self):
+        self.rtt = LatencyHistogram()  # us from the write to the ack
+        self.acks = 0
+        self.delivered = 0
+        self.lost = 0
+        self._written = 0              # frames with a sequence number written so far
+        self._written_at = [0] * 256   # _written after the frame with that sequence number
+        self._sent_at = [0] * 256      # monotonic ns of the write of that sequence number
+        self._acked_total = None
+        self._acked_written = 0
+
+    def reset(self):
+        """the link was (re)connected, the next ack only sets the baseline"""
+        self._acked_total = None
+
+    def on_write(self, data):
+        """record the frames of a write to the peripheral"""
+        now = time.monotonic_ns()
+        offset = 0
+        while offset < len(data):
+            header = data[offset]
+            if header & FLAG_STATE:
+                # state and motion frames are not acked, skip them
+                size = state_frame_size(data, offset)
+                if size == 0:
+                    return
+                offset += size
+                continue
+            size = frame_size(header)
+            if size == 0 or offset + size > len(data):
+                return
+            if header & FLAG_SEQUENCE:
+                sequence = data[offset + 4]
+                self._written += 1
+                self._written_at[sequence] = self._written
+                self._sent_at[sequence] = now
+            offset += size
+
+    def on_ack(self, total, sequence):
+        """
+        :param total: INT, frames the peripheral received so far, wrapping at 2^16
+        :param sequence: INT, sequence number of the last frame it received
+        """
+        self.acks += 1
+        written = self._written_at[sequence]
+        if self._acked_total is not None:
+            delivered = (total - self._acked_total) & 0xFFFF
+            self.delivered += delivered
+            expected = written - self._acked_written
+            if expected > delivered:
+                self.lost += expected - delivered
+        self._acked_total = total
+        self._acked_written = written
+        if self._sent_at[sequence]:
+            self.rtt.record((time.monotonic_ns() - self._sent_at[sequence]) // 1000)
+
+    def loss(self):
+        """fraction of the acknowledged range that was lost"""
+        total = self.delivered + self.lost
+        return self.lost / total if total else 0.0
+
+    def stats(self):
+        return {
+            "acks": self.acks,
+            "delivered": self.delivered,
+            "lost": self.lost,
+            "loss": round(self.loss(), 4),
+            "rtt us": (self.rtt.percentile(50), self.rtt.percentile(99)),
+        }
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of event dispatch: the per event mapping object + predicate chain
+against the precomputed dispatch table.
+usage: python3 bench_dispatch.py [events] [--ds4drv]
+"""
+
+import asyncio
+import random
+import struct
+import sys
+import time
+
+from ble_central import Controller
+
+
+def stick_heavy_events(count, seed=0):
+    """3Bh2b events, 90% analog sticks and triggers, 10% button edges"""
+    rnd = random.Random(seed)
+    events = []
+    for i in range(count):
+        if rnd.random() < 0.9:
+            events.append((2, rnd.choice((0, 1, 2, 3, 4, 5)), rnd.randint(-32767, 32767)))
+        else:
+            events.append((1, rnd.randint(0, 12), i & 1))
+    return [struct.unpack("3Bh2b", struct.pack("<IhBB", i, value, button_type, button_id))
+            for i, (button_type, button_id, value) in enumerate(events)]
+
+
+async def run(controller, events):
+    handle = controller._Controller__handle_event
+    start = time.perf_counter()
+    for event in events:
+        await handle(button_id=event[0], button_type=event[1], value=event[2], overflow=event[3:], debug=False)
+    return time.perf_counter() - start
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    count = int(args[0]) if args else 200000
+    ds4drv = "--ds4drv" in sys.argv
+    events = stick_heavy_events(count)
+
+    legacy = Controller(interface="/dev/null", connecting_using_ds4drv=ds4drv)
+    legacy._dispatch = None
+    table = Controller(interface="/dev/null", connecting_using_ds4drv=ds4drv)
+
+    for name, controller in (("predicate chain", legacy), ("dispatch table", table)):
+        elapsed = asyncio.run(run(controller, events))
+        print("{:16}: {:8.3f} s  {:10.0f} events/s  {:6.2f} us/event".format(
+            name, elapsed, count / elapsed, elapsed * 1e6 / count))
+
+
+if __name__ == '__main__':
+    main()
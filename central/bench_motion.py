@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+CPU cost and accuracy of the motion sensor path over the loopback peripheral, no controller needed.
+A synthetic motion sensor node (gravity on +Y plus noise, turning about yaw at a constant rate and swinging in
+pitch) is replayed in real time into a FIFO read by a MotionSensor, whose frames go through a paired Controller.
+usage: python3 bench_motion.py [seconds] [--sample_rate=1000] [--rate=50] [--cutoff=10] [--yaw_rate=90]
+"""
+
+import asyncio
+import contextlib
+import io
+import math
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+
+from ble_central import Controller
+from ble_transport import LoopbackPeripheral
+from evdev_reader import ABS_RX, ABS_X, EV_ABS, EV_MSC, EV_SYN, EVENT_FORMAT, MSC_TIMESTAMP, SYN_REPORT
+from js_record import Replayer
+from motion_sensor import ACCEL_PER_G, GYRO_PER_DEG_S, MotionSensor
+
+
+def motion_batches(seconds, sample_rate, yaw_rate, per_batch=4, seed=0):
+    """
+    input_event batches of a motion sensor node as hid-sony reports them, per_batch samples per batch
+    :param yaw_rate: FLOAT, degree/s the controller turns about yaw, it also swings +-30 degrees in pitch at 0.5 Hz
+    """
+    rnd = random.Random(seed)
+    packer = struct.Struct(EVENT_FORMAT)
+    period_us = 1000000 // sample_rate
+    batches = []
+    data = []
+    for n in range(int(seconds * sample_rate)):
+        t = n * period_us
+        pitch = math.radians(30.0 * math.sin(math.pi * t / 1e6))
+        pitch_rate = 30.0 * math.pi * math.cos(math.pi * t / 1e6)
+        accel = (rnd.gauss(0, 0.02), math.cos(pitch) + rnd.gauss(0, 0.02), math.sin(pitch) + rnd.gauss(0, 0.02))
+        gyro = (pitch_rate + rnd.gauss(0, 0.5), yaw_rate + rnd.gauss(0, 0.5), rnd.gauss(0, 0.5))
+        (sec, usec) = divmod(t, 1000000)
+        for axis in range(3):
+            data.append(packer.pack(sec, usec, EV_ABS, ABS_X + axis, int(accel[axis] * ACCEL_PER_G)))
+            data.append(packer.pack(sec, usec, EV_ABS, ABS_RX + axis, int(gyro[axis] * GYRO_PER_DEG_S)))
+        data.append(packer.pack(sec, usec, EV_MSC, MSC_TIMESTAMP, t & 0x7FFFFFFF))
+        data.append(packer.pack(sec, usec, EV_SYN, SYN_REPORT, 0))
+        if (n + 1) % per_batch == 0:
+            batches.append((t * 1000, b"".join(data)))
+            data = []
+    if data:
+        batches.append((int(seconds * 1e9), b"".join(data)))
+    return batches
+
+
+async def run(seconds, sample_rate, rate, cutoff, yaw_rate):
+    peripheral = LoopbackPeripheral(mtu=185)
+    with tempfile.TemporaryDirectory() as directory:
+        node = os.path.join(directory, "event0")
+        sensor = MotionSensor(node, rate=rate, cutoff=cutoff)
+        controller = Controller(interface=os.path.join(directory, "js0"), connecting_using_ds4drv=False,
+                                transport=peripheral.transport, motion=sensor)
+        replayer = Replayer(node, motion_batches(seconds, sample_rate, yaw_rate))
+        replayer.open()
+        cpu = time.process_time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            await controller.pair("loopback")
+            await controller.link.connected.wait()
+            await replayer.run()
+            await asyncio.sleep(2.0 / rate)
+            await controller.close()
+        cpu = time.process_time() - cpu
+    stats = controller.stats()
+    print("{} samples at {} Hz, {} frames at {} Hz, {} received".format(
+        stats["motion samples"], sample_rate, stats["motion frames"], rate, peripheral.motion.frames))
+    print("cpu {:.1f} % of one core, {:.2f} us per sample (replay included)".format(
+        cpu * 100 / seconds, cpu * 1e6 / max(1, stats["motion samples"])))
+    expected_pitch = 30.0 * math.sin(math.pi * seconds)
+    expected_yaw = (yaw_rate * seconds + 180.0) % 360.0 - 180.0
+    print("orientation pitch {:.1f} roll {:.1f} yaw {:.1f}, expected pitch {:.1f} roll 0.0 yaw {:.1f}".format(
+        *sensor.orientation, expected_pitch, expected_yaw))
+    print("peripheral orientation {} (0.01 degree)".format(peripheral.motion.orientation))
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    options = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+    seconds = float(args[0]) if args else 5.0
+    asyncio.run(run(seconds, int(options.get("sample_rate", 1000)), float(options.get("rate", 50)),
+                    float(options.get("cutoff", 10)), float(options.get("yaw_rate", 90))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the input pipeline read -> dispatch -> encode -> send over canned workloads or a js recording.
+Every stage is measured cumulatively on a Controller reading a replayed FIFO at full speed,
+the cost of a stage is the difference to the run before it.
+--pipeline=inline|thread runs the Controller with the staged pipeline, the reader on the event loop or a thread.
+usage: python3 bench_pipeline.py [events] [--workload=stick_heavy|button_mash] [--file=RECORDING] [--pipeline=MODE]
+"""
+
+import asyncio
+import contextlib
+import inspect
+import io
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from ble_central import Actions, Controller
+from bench_dispatch import stick_heavy_events
+from ble_transport import LoopbackPeripheral
+from ds4_protocol import EVENT_CODES, FrameEncoder
+from js_reader import JoystickReader
+from js_record import Replayer, load
+from pipeline import Pipeline
+
+EVENT_FORMAT = "3Bh2b"
+
+
+def button_mash_events(count, seed=0):
+    """3Bh2b events, press/release bursts on the face and shoulder buttons with some trigger travel"""
+    rnd = random.Random(seed)
+    events = []
+    pressed = set()
+    for i in range(count):
+        if rnd.random() < 0.2:
+            events.append((2, rnd.choice((2, 5)), rnd.randint(-32767, 32767)))
+            continue
+        button = rnd.randint(0, 12)
+        value = 0 if button in pressed else 1
+        (pressed.discard if value == 0 else pressed.add)(button)
+        events.append((1, button, value))
+    return [struct.unpack(EVENT_FORMAT, struct.pack("<IhBB", i, value, button_type, button_id))
+            for i, (button_type, button_id, value) in enumerate(events)]
+
+
+WORKLOADS = {
+    "stick_heavy": stick_heavy_events,
+    "button_mash": button_mash_events,
+}
+
+
+def batches_of(events, per_batch=64, period_ns=1000000):
+    """raw recording batches of the event tuples, timestamps period_ns apart"""
+    packer = struct.Struct(EVENT_FORMAT)
+    return [(index * period_ns, b"".join(packer.pack(*event) for event in events[first:first + per_batch]))
+            for index, first in enumerate(range(0, len(events), per_batch))]
+
+
+def _action(code, with_value):
+    if with_value:
+        async def action(self, value):
+            frame = self.encoder.encode(code, value)
+            if self.links and self.snapshot is None:
+                await self.send(frame)
+    else:
+        async def action(self):
+            frame = self.encoder.encode(code)
+            if self.links and self.snapshot is None:
+                await self.send(frame)
+    return action
+
+
+class EncodingController(Controller):
+    """
+    every action encodes its event as a frame, and sends it once a peripheral is paired,
+    unless the snapshot sync mode sends the state instead
+    """
+    encoder = FrameEncoder()
+
+
+for _name, _code in EVENT_CODES.items():
+    _with_value = "value" in inspect.signature(getattr(Actions, _name)).parameters
+    setattr(EncodingController, _name, _action(_code, _with_value))
+
+
+async def read_only(fifo):
+    reader = JoystickReader(fifo, EVENT_FORMAT)
+    reader.open()
+    count = 0
+    try:
+        while True:
+            events = await reader.read()
+            if events is None:
+                return count
+            for _ in events:
+                count += 1
+    finally:
+        reader.close()
+
+
+async def through_controller(fifo, stage, pipeline=None):
+    if pipeline is not None:
+        pipeline = Pipeline(reader_thread=pipeline == "thread")
+    if stage == "dispatch":
+        controller = Controller(interface=fifo, connecting_using_ds4drv=False, pipeline=pipeline)
+    else:
+        # the queue is only flushed when the reader waits, make room for everything read in between.
+        # The loopback peripheral is given a budget that never holds the writes back.
+        peripheral = LoopbackPeripheral(mtu=185, connection_interval=0.001, packets_per_interval=1 << 16)
+        controller = EncodingController(interface=fifo, connecting_using_ds4drv=False, send_buffer=1 << 20,
+                                        transport=peripheral.transport, pipeline=pipeline)
+    if stage == "send":
+        await controller.pair("bench")
+        await controller.link.connected.wait()
+    await controller.listen(timeout=1)
+    await controller.close()
+
+
+STAGES = ("read", "dispatch", "encode", "send")
+
+
+async def run_stage(stage, batches, directory, pipeline=None):
+    fifo = os.path.join(directory, "js")
+    replayer = Replayer(fifo, batches, speed=0)
+    replayer.open()
+    writer = asyncio.get_running_loop().create_task(replayer.run())
+    if stage == "read":
+        await read_only(fifo)
+    else:
+        with contextlib.redirect_stdout(io.StringIO()):
+            await through_controller(fifo, stage, pipeline)
+    await writer
+
+
+def measure(stage, batches, directory, pipeline=None):
+    """:return: (wall seconds, cpu seconds, peak traced bytes, bytes still allocated afterwards)"""
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    asyncio.run(run_stage(stage, batches, directory, pipeline))
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+    # a second run under tracemalloc, it slows everything down too much to be timed
+    tracemalloc.start()
+    asyncio.run(run_stage(stage, batches, directory, pipeline))
+    (current, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (wall, cpu, peak, current)
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    options = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+    count = int(args[0]) if args else 100000
+    if "file" in options:
+        (event_format, batches) = load(options["file"])
+        if event_format != EVENT_FORMAT:
+            print("only {} recordings are supported".format(EVENT_FORMAT))
+            sys.exit(1)
+        name = options["file"]
+        count = sum(len(data) for (_, data) in batches) // struct.calcsize(EVENT_FORMAT)
+    else:
+        name = options.get("workload", "stick_heavy")
+        batches = batches_of(WORKLOADS[name](count))
+
+    print("{}: {} events".format(name, count))
+    print("{:10} {:>12} {:>12} {:>12} {:>10} {:>10}".format(
+        "stage", "events/s", "cpu us/event", "stage us/ev", "peak KiB", "kept B/ev"))
+    previous = 0.0
+    with tempfile.TemporaryDirectory() as directory:
+        for stage in STAGES:
+            (wall, cpu, peak, current) = measure(stage, batches, directory, options.get("pipeline"))
+            per_event = cpu * 1e6 / count
+            print("{:10} {:12.0f} {:12.2f} {:12.2f} {:10.1f} {:10.2f}".format(
+                stage, count / wall, per_event, per_event - previous, peak / 1024, current / count))
+            previous = per_event
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Throughput and latency of the send path over the loopback peripheral, no radio needed.
+A workload is replayed in real time through a Controller paired with a LoopbackPeripheral,
+every frame carries a timestamp so the peripheral side can measure the delivery latency.
+usage: python3 bench_send.py [seconds] [--rate=1000] [--workload=stick_heavy|button_mash] [--mtu=23]
+                             [--interval=0.0075] [--packets=4] [--latency=0] [--drop=0] [--send_interval=0.015]
+                             [--links=1] [--slow=PACKETS] [--ack=FRAMES] [--snapshot=SECONDS] [--sweep]
+--links fans the controller out to several peripherals, --slow limits the packets per interval of the last one.
+--ack makes the peripherals ack every FRAMES frames, the links report delivery, loss and round trip from the acks.
+--snapshot sends the controller state every SECONDS instead of the events (snapshot sync mode, keyframe every 0.5 s),
+the peripheral reports whether its state matches the controller's at the end.
+--sweep compares the throughput and latency over MTUs and connection intervals, seconds each (default 2).
+"""
+
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+from ble_transport import LoopbackPeripheral
+from bench_pipeline import WORKLOADS, EncodingController, batches_of
+from ds4_protocol import FrameEncoder
+from js_record import Replayer
+from latency_trace import LatencyHistogram
+
+
+def _on_frame(histogram):
+    def on_frame(code, value, sequence, timestamp):
+        histogram.record((((time.monotonic_ns() // 1000000) - timestamp) & 0xFFFF) * 1000)
+    return on_frame
+
+
+async def run(seconds, rate, workload, peripherals, send_interval, track_acks, snapshot_interval):
+    histograms = [LatencyHistogram() for _ in peripherals]
+    for peripheral, histogram in zip(peripherals, histograms):
+        peripheral.on_frame = _on_frame(histogram)
+    by_address = {"loopback{}".format(n): peripheral for n, peripheral in enumerate(peripherals)}
+    per_batch = max(1, rate // 1000)
+    batches = batches_of(WORKLOADS[workload](int(seconds * rate)), per_batch, per_batch * 1000000000 // rate)
+    with tempfile.TemporaryDirectory() as directory:
+        fifo = os.path.join(directory, "js")
+        def transport(address, disconnected_callback=None, timeout=10.0):
+            return by_address[address].transport(address, disconnected_callback, timeout)
+
+        controller = EncodingController(interface=fifo, connecting_using_ds4drv=False, send_interval=send_interval,
+                                        transport=transport, track_acks=track_acks,
+                                        snapshot_interval=snapshot_interval)
+        controller.encoder = FrameEncoder(sequence=track_acks, timestamp=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for address in by_address:
+                await controller.pair(address)
+            for link in controller.links.values():
+                await link.supervisor.connected.wait()
+            replayer = Replayer(fifo, batches, speed=1.0)
+            replayer.open()
+            writer = asyncio.get_running_loop().create_task(replayer.run())
+            started = time.perf_counter()
+            await controller.listen(timeout=1)
+            await writer
+            for link in controller.links.values():
+                if link.send_queue is not None:
+                    await link.send_queue.flush()
+            if controller.snapshot is not None:
+                # the last delta could be lost, wait for the next keyframe
+                await asyncio.sleep(controller.snapshot.keyframe_interval + controller.snapshot.interval)
+            # let the frames in flight arrive
+            await asyncio.sleep(max(p.latency + 2 * p.connection_interval for p in peripherals))
+            elapsed = time.perf_counter() - started
+            await controller.close()
+    return (controller, histograms, elapsed)
+
+
+SWEEP_MTUS = (23, 64, 185, 247)
+SWEEP_INTERVALS = (0.0075, 0.015, 0.030)
+
+
+def sweep(seconds, rate, workload, send_interval, options):
+    print("{} events/s of {} for {:.1f} s each, send interval {}".format(rate, workload, seconds, send_interval))
+    print("{:>5} {:>9} {:>9} {:>10} {:>12} {:>8} {:>8}".format(
+        "MTU", "interval", "frames/s", "bytes/s", "frames/write", "p50 ms", "p99 ms"))
+    for mtu in SWEEP_MTUS:
+        for interval in SWEEP_INTERVALS:
+            peripheral = LoopbackPeripheral(mtu=mtu, connection_interval=interval,
+                                            packets_per_interval=int(options.get("packets", 4)),
+                                            latency=float(options.get("latency", 0.0)),
+                                            drop_rate=float(options.get("drop", 0.0)))
+            (controller, histograms, elapsed) = asyncio.run(
+                run(seconds, rate, workload, [peripheral], send_interval, False, None))
+            received = peripheral.stats()
+            link = next(iter(controller.links.values()))
+            print("{:>5} {:>7.1f}ms {:>9.0f} {:>10.0f} {:>12.2f} {:>8.0f} {:>8.0f}".format(
+                link.mtu, interval * 1000, received["frames"] / elapsed, received["bytes"] / elapsed,
+                received["frames"] / max(1, received["received"]),
+                histograms[0].percentile(50) / 1000, histograms[0].percentile(99) / 1000))
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    options = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+    rate = int(options.get("rate", 1000))
+    send_interval = options.get("send_interval", "0.015")
+    send_interval = None if send_interval == "none" else float(send_interval)
+    if "--sweep" in sys.argv:
+        sweep(float(args[0]) if args else 2.0, rate, options.get("workload", "stick_heavy"), send_interval, options)
+        return
+    seconds = float(args[0]) if args else 5.0
+    peripherals = [LoopbackPeripheral(mtu=int(options.get("mtu", 23)),
+                                      connection_interval=float(options.get("interval", 0.0075)),
+                                      packets_per_interval=int(options.get("packets", 4)),
+                                      latency=float(options.get("latency", 0.0)),
+                                      drop_rate=float(options.get("drop", 0.0)),
+                                      seed=n,
+                                      ack_every=int(options.get("ack", 0)))
+                   for n in range(int(options.get("links", 1)))]
+    if "slow" in options:
+        peripherals[-1].packets_per_interval = int(options["slow"])
+
+    (controller, histograms, elapsed) = asyncio.run(
+        run(seconds, rate, options.get("workload", "stick_heavy"), peripherals, send_interval, "ack" in options,
+            float(options["snapshot"]) if "snapshot" in options else None))
+
+    snapshot = options.get("snapshot")
+    print("{} events/s for {:.1f} s, send interval {}".format(rate, elapsed, send_interval))
+    if controller.snapshot is not None:
+        print("snapshot every {} s: {}".format(snapshot, controller.snapshot.stats()))
+    for link, peripheral, histogram in zip(controller.links.values(), peripherals, histograms):
+        received = peripheral.stats()
+        print("{}: MTU {}, {} writes per {} ms connection interval".format(
+            link.address, link.mtu, peripheral.packets_per_interval, peripheral.connection_interval * 1000))
+        print("  link       : {}".format(link.stats()))
+        print("  peripheral : {}".format(received))
+        print("  delivered  : {:.0f} frames/s, {:.0f} bytes/s, {:.2f} frames per write".format(
+            received["frames"] / elapsed, received["bytes"] / elapsed,
+            received["frames"] / max(1, received["received"])))
+        if controller.snapshot is not None:
+            state = peripheral.state
+            print("  state      : {} (buttons {:05x} axes {})".format(
+                "in sync" if state.buttons == controller.state.buttons and state.axes == list(controller.state.axes)
+                else "differs", state.buttons, state.axes))
+        else:
+            print("  latency ms : p50 {:.0f}  p99 {:.0f}  max {:.0f}".format(
+                histogram.percentile(50) / 1000, histogram.percentile(99) / 1000, histogram.max / 1000))
+
+
+if __name__ == '__main__':
+    main()
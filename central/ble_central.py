@@ -1,172 +1,187 @@
-import os
+import asyncio
 import struct
 import time
-
-from bleak import BleakClient
-from bleak import uuids
+from collections import deque
+
+from pyPS4Controller.event_mapping.DefaultMapping import DefaultMapping
+from pyPS4Controller.event_mapping.Mapping3Bh2b import Mapping3Bh2b
+
+from event_dispatch import DispatchTable, resolve_event
+from device_watcher import DeviceWatcher
+from ds4_protocol import COALESCE_KEY_OF_CODE, EVENT_CODES, EVENT_NAMES
+from combo_engine import ComboEngine
+from event_recorder import BUTTONS, DISPATCH, NOTIFY
+from gatt_cache import GattCache
+from js_reader import JoystickReader
+from latency_trace import DISPATCH_END, DISPATCH_START, ENQUEUE, WRITE_DONE
+from metrics import count_by_class
+from pipeline import ReaderThread
+from send_queue import DROP_OLDEST
+from snapshot_sync import ControllerState, SnapshotSync
+from sequence_matcher import SequenceMatcher
+from uart_link import UartLink
 
 class Actions:
     """
     Actions are inherited in the Controller class.
     In order to bind to the controller events, subclass the Controller class and
     override desired action events in this class.
+    The defaults do nothing, pass an EventRecorder to the Controller to see the event stream.
     """
     def __init__(self):
         return
 
     async def on_x_press(self):
-        print("on_x_press")  
+        pass
 
     async def on_x_release(self):
-        print("on_x_release")
+        pass
 
     async def on_triangle_press(self):
-        print("on_triangle_press")
+        pass
 
     async def on_triangle_release(self):
-        print("on_triangle_release")
+        pass
 
     async def on_circle_press(self):
-        print("on_circle_press")
+        pass
 
     async def on_circle_release(self):
-        print("on_circle_release")
+        pass
 
     async def on_square_press(self):
-        print("on_square_press")
+        pass
 
     async def on_square_release(self):
-        print("on_square_release")
+        pass
 
     async def on_L1_press(self):
-        print("on_L1_press")
+        pass
 
     async def on_L1_release(self):
-        print("on_L1_release")
+        pass
 
     async def on_L2_press(self, value):
-        print("on_L2_press: {}".format(value))
+        pass
 
     async def on_L2_release(self):
-        print("on_L2_release")
+        pass
 
     async def on_R1_press(self):
-        print("on_R1_press")
+        pass
 
     async def on_R1_release(self):
-        print("on_R1_release")
+        pass
 
     async def on_R2_press(self, value):
-        print("on_R2_press: {}".format(value))
+        pass
 
     async def on_R2_release(self):
-        print("on_R2_release")
+        pass
 
     async def on_up_arrow_press(self):
-        print("on_up_arrow_press")
+        pass
 
     async def on_up_down_arrow_release(self):
-        print("on_up_down_arrow_release")
+        pass
 
     async def on_down_arrow_press(self):
-        print("on_down_arrow_press")
+        pass
 
     async def on_left_arrow_press(self):
-        print("on_left_arrow_press")
+        pass
 
     async def on_left_right_arrow_release(self):
-        print("on_left_right_arrow_release")
+        pass
 
     async def on_right_arrow_press(self):
-        print("on_right_arrow_press")
+        pass
 
     async def on_L3_up(self, value):
-        print("on_L3_up: {}".format(value))
+        pass
 
     async def on_L3_down(self, value):
-        print("on_L3_down: {}".format(value))
+        pass
 
     async def on_L3_left(self, value):
-        print("on_L3_left: {}".format(value))
+        pass
 
     async def on_L3_right(self, value):
-        print("on_L3_right: {}".format(value))
+        pass
 
     async def on_L3_y_at_rest(self):
         """L3 joystick is at rest after the joystick was moved and let go off"""
-        print("on_L3_y_at_rest")
+        pass
 
     async def on_L3_x_at_rest(self):
         """L3 joystick is at rest after the joystick was moved and let go off"""
-        print("on_L3_x_at_rest")
+        pass
 
     async def on_L3_press(self):
         """L3 joystick is clicked. This event is only detected when connecting without ds4drv"""
-        print("on_L3_press")
+        pass
 
     async def on_L3_release(self):
         """L3 joystick is released after the click. This event is only detected when connecting without ds4drv"""
-        print("on_L3_release")
+        pass
 
     async def on_R3_up(self, value):
-        print("on_R3_up: {}".format(value))
+        pass
 
     async def on_R3_down(self, value):
-        print("on_R3_down: {}".format(value))
+        pass
 
     async def on_R3_left(self, value):
-        print("on_R3_left: {}".format(value))
+        pass
 
     async def on_R3_right(self, value):
-        print("on_R3_right: {}".format(value))
+        pass
 
     async def on_R3_y_at_rest(self):
         """R3 joystick is at rest after the joystick was moved and let go off"""
-        print("on_R3_y_at_rest")
+        pass
 
     async def on_R3_x_at_rest(self):
         """R3 joystick is at rest after the joystick was moved and let go off"""
-        print("on_R3_x_at_rest")
+        pass
 
     async def on_R3_press(self):
         """R3 joystick is clicked. This event is only detected when connecting without ds4drv"""
-        print("on_R3_press")
+        pass
 
     async def on_R3_release(self):
         """R3 joystick is released after the click. This event is only detected when connecting without ds4drv"""
-        print("on_R3_release")
+        pass
 
     async def on_options_press(self):
-        print("on_options_press")
+        pass
 
     async def on_options_release(self):
-        print("on_options_release")
+        pass
 
     async def on_share_press(self):
         """this event is only detected when connecting without ds4drv"""
-        print("on_share_press")
+        pass
 
     async def on_share_release(self):
         """this event is only detected when connecting without ds4drv"""
-        print("on_share_release")
+        pass
 
     async def on_playstation_button_press(self):
         """this event is only detected when connecting without ds4drv"""
-        print("on_playstation_button_press")
+        pass
 
     async def on_playstation_button_release(self):
         """this event is only detected when connecting without ds4drv"""
-        print("on_playstation_button_release")
+        pass
 
 class Controller(Actions):
-    _MODEL_NUMBER_UUID = "00002a00-0000-1000-8000-00805f9b34fb"
-    _UART_UUID = "6E400001-B5A3-F393-E0A9-E50E24DCCA9E"
-    _UART_TX = ""
-    _UART_RX = ""
-    _ble = None
     def __init__(
             self, interface, connecting_using_ds4drv=True,
-            event_definition=None, event_format=None
+            event_definition=None, event_format=None, send_interval=0.015, event_filter=None,
+            history_size=64, gatt_cache=None, read_model_number=False, send_buffer=256, outage_policy=DROP_OLDEST,
+            tracer=None, recorder=None, transport=None, track_acks=False, snapshot_interval=None,
+            keyframe_interval=0.5, combos=None, pipeline=None, motion=None
                 ):
         """
         Initiate controller instance that is capable of listening to all events on specified input interface
@@ -176,6 +191,37 @@ class Controller(Actions):
                                                  to True. Otherwise if you are connecting directly via directly via
                                                  bluetooth/bluetoothctl, set it to False otherwise the controller
                                                  button mapping will be off.
+        :param send_interval: FLOAT, seconds. Frames passed to send() are queued and written once per interval,
+                              packed up to the MTU and with analog axes coalesced. Align it with the BLE connection
+                              interval. None writes every frame right away.
+                              Every paired peripheral has its own queue, see pair().
+        :param event_filter: EventFilter, deadzone / min delta / quantization of sticks and triggers applied before
+                             dispatch. Only used with the stock event definitions.
+        :param history_size: INT, how many entries event_history keeps, older ones are discarded
+        :param gatt_cache: GattCache, resolved UART characteristics per address. Defaults to an in-memory cache.
+        :param read_model_number: BOOLEAN, read and print the model number characteristic on every connection
+        :param send_buffer: INT, frames kept by the send queue of each peripheral, e.g. while its link is down
+        :param outage_policy: STRING, what the send queue drops when it is full or the link is down,
+                              send_queue.DROP_OLDEST, DROP_NEWEST or DISCARD
+        :param tracer: LatencyTracer, records the trace points of every event from its js timestamp to the write
+        :param recorder: EventRecorder, dispatched events and notifications are recorded there instead of printed
+        :param transport: function object creating the link to the peripheral, see ble_transport.Transport.
+                          Defaults to BleakClient, ble_transport.LoopbackPeripheral.transport simulates one.
+        :param track_acks: BOOLEAN, consume the cumulative acks of the peripherals and track delivered frames,
+                           loss and round trip per link, see ack_tracker.AckTracker. Needs frames with sequence
+                           numbers. Other notifications still reach notification_handler.
+        :param snapshot_interval: FLOAT, seconds. Enables the snapshot sync mode: self.state, the state of all buttons
+                                  and axes, is sent every interval as keyframes and delta frames,
+                                  see snapshot_sync.SnapshotSync. Actions should not send frames of their own then.
+                                  Combine it with send_interval=None, the snapshots are paced already.
+        :param keyframe_interval: FLOAT, seconds between the keyframes of the snapshot sync mode
+        :param combos: list, chords of buttons and their callbacks, evaluated on the button mask of self.state
+                       e.g [{"buttons": ["share", "options", "circle"], "trigger": "circle",
+                             "callback": async () -> None}], see combo_engine.ComboEngine for hold and tap.
+        :param pipeline: Pipeline, run the reads, the decoding and the dispatch as stages connected by bounded
+                         queues, see pipeline.Pipeline. None handles every event before the next read.
+        :param motion: MotionSensor, streams the gyro and accelerometer of the controller from its evdev node and sends
+                       motion frames at its own rate once a peripheral is paired, see motion_sensor.MotionSensor
         """
         Actions.__init__(self)
         self.stop = False
@@ -192,64 +238,178 @@ class Controller(Actions):
 
         if event_definition is None:  # means it wasn't specified by user
             if self.event_format == "LhBB":
-                from pyPS4Controller.event_mapping.DefaultMapping import DefaultMapping
                 self.event_definition = DefaultMapping
             else:
-                from pyPS4Controller.event_mapping.Mapping3Bh2b import Mapping3Bh2b
                 self.event_definition = Mapping3Bh2b
         else:
             self.event_definition = event_definition
 
+        # stock mappings are dispatched through a precomputed table, custom ones are evaluated per event
+        self._event_fields_in_overflow = self.event_definition is Mapping3Bh2b
+        if self.event_definition in (DefaultMapping, Mapping3Bh2b):
+            self._dispatch = DispatchTable(self, self.event_definition, self.connecting_using_ds4drv)
+        else:
+            self._dispatch = None
+
+        self.event_filter = event_filter
+        if self.event_filter is not None and self._dispatch is not None:
+            self.event_filter.bind(self._dispatch.axis_keys)
+
         self.event_size = struct.calcsize(self.event_format)
-        self.event_history = []
+        self.event_history = deque(maxlen=history_size)
+        self.events_handled = 0
+        self.dispatched = [0] * len(EVENT_NAMES)  # dispatched events per event code, 0 for unknown actions
+        self._sequence_matcher = None
+
+        self.gatt_cache = gatt_cache if gatt_cache is not None else GattCache()
+        self.read_model_number = read_model_number
+        self.transport = transport
+        self.send_interval = send_interval
+        self.send_buffer = send_buffer
+        self.outage_policy = outage_policy
+        self.track_acks = track_acks
+        self.links = {}   # {address: UartLink}, in the order they were paired
+        self._links = ()
+
+        self.tracer = tracer
+        self._trace_slot = -1  # trace record of the event being dispatched
+        self.recorder = recorder
+
+        # pressed buttons and axis positions, kept in sync by the dispatch
+        self.state = ControllerState()
+        self.combos = ComboEngine(combos) if combos else None
+        self.pipeline = pipeline
+        self.motion = motion
+        self.snapshot = None
+        if snapshot_interval is not None:
+            self.snapshot = SnapshotSync(self.state, self.send, interval=snapshot_interval,
+                                         keyframe_interval=keyframe_interval)
 
     def notification_handler(self, sender, data):
-        print(data)
-
-    def discover_uart_uuid(self) -> bool:
-        if self._ble is None:
-            return False
-        for s in self._ble.services:
-                print(s)
-                if s.description.__eq__(uuids.uuidstr_to_str(self._UART_UUID)):
-                    for c in s.characteristics:
-                        for p in c.properties:
-                            if p.__eq__('notify'):
-                                self._UART_TX = c.uuid
-                            elif p.__eq__('write'):
-                                self._UART_RX = c.uuid
-        return not self._UART_TX.__eq__("") and not self._UART_RX.__eq__("") 
-    
-    async def start_notify(self):
-        if self._ble is None:
-            return
-        model_number = await self._ble.read_gatt_char(self._MODEL_NUMBER_UUID)
-        print("Model Number: {0}".format("".join(map(chr, model_number))))
-        if self.discover_uart_uuid():
-            await self._ble.start_notify(self._UART_TX, self.notification_handler)
-            await self._ble.write_gatt_char(self._UART_RX, data=b"Central is Rady\r\n")
-        else:
-            print("not found service: {0}".format("".join(uuids.uuidstr_to_str(self._UART_UUID))))
+        if self.recorder is not None:
+            self.recorder.record(NOTIFY, len(data), data[0] if data else 0)
+
+    @property
+    def link(self):
+        """LinkSupervisor of the first paired peripheral, None before pair()"""
+        return self._links[0].supervisor if self._links else None
+
+    @property
+    def send_queue(self):
+        """SendQueue of the first paired peripheral"""
+        return self._links[0].send_queue if self._links else None
 
     async def send(self,value):
-        if self._ble is None:
+        """Queue the frame for every paired peripheral, or write it to all of them at once without send queues"""
+        links = self._links
+        if not links:
+            return
+        slot = self._trace_slot
+        if self.tracer is not None:
+            self.tracer.stamp(slot, ENQUEUE)
+        if self.send_interval is not None:
+            for link in links:
+                link.send_queue.put(value, slot)
             return
-        if self._ble.is_connected:
-            await self._ble.write_gatt_char(self._UART_RX, data=value,response=False)
+        if len(links) == 1:
+            try:
+                written = await links[0].write(value)
+            except Exception as e:
+                print("write failed on {}: {}".format(links[0].address, e))
+                written = False
+        else:
+            # a failing link must not cost the others the frame, its write_errors count the failure
+            results = await asyncio.gather(*(link.write(value) for link in links), return_exceptions=True)
+            written = False
+            for (link, result) in zip(links, results):
+                if isinstance(result, Exception):
+                    print("write failed on {}: {}".format(link.address, result))
+                elif result:
+                    written = True
+        if written and self.tracer is not None:
+            self.tracer.stamp(slot, WRITE_DONE)
+
+    def stats(self):
+        stats = {
+            "interface": self.interface,
+            "input": self.is_connected,
+            "events": self.events_handled,
+            "dispatched": count_by_class(self.dispatched),
+            "links": [link.stats() for link in self._links],
+        }
+        if self.event_filter is not None:
+            stats["filtered"] = self.event_filter.suppressed
+        if self.tracer is not None:
+            histogram = self.tracer.histograms["read->write"]
+            stats["read->write us"] = (histogram.percentile(50), histogram.percentile(99))
+        if self.snapshot is not None:
+            stats.update(self.snapshot.stats())
+        if self.combos is not None:
+            stats.update(self.combos.stats())
+        if self.pipeline is not None:
+            stats["pipeline"] = self.pipeline.stats()
+        if self.motion is not None:
+            stats.update(self.motion.stats())
+        return stats
+
+    def payload_size(self):
+        """bytes one write to every connected peripheral can carry, from the lowest negotiated MTU"""
+        sizes = [link.payload_size() for link in self._links if link.is_ready()]
+        return min(sizes) if sizes else 20
+
+    @property
+    def ready_time(self):
+        """seconds from connecting to the first write of the last connection"""
+        if self.link is None:
+            return None
+        return self.link.last_connect_time
 
     async def pair(self,address):
-        if self._ble is not None:
+        """
+        Start a supervisor that connects to the peripheral and keeps reconnecting whenever the link drops.
+        Pairing more peripherals fans send() out to all of them, each through its own queue and writer task.
+        Returns right away, await self.links[address].supervisor.connected.wait() to wait for the link.
+        """
+        if address in self.links:
             return
-        async with BleakClient(address) as client:
-            self._ble = client
-            await self.start_notify()
+        # the first link is traced, a frame counts as written when it reached that peripheral
+        link = UartLink(address, self.gatt_cache, self.notification_handler, send_interval=self.send_interval,
+                        send_buffer=self.send_buffer, outage_policy=self.outage_policy,
+                        tracer=self.tracer if not self._links else None, read_model_number=self.read_model_number,
+                        transport=self.transport, track_acks=self.track_acks)
+        self.links[address] = link
+        self._links = tuple(self.links.values())
+        link.start()
+        if self.snapshot is not None:
+            self.snapshot.start()
+        if self.motion is not None:
+            self.motion.start(self.send)
+
+    async def unpair(self, address):
+        link = self.links.pop(address, None)
+        if link is None:
+            return
+        self._links = tuple(self.links.values())
+        await link.close()
+
+    async def close(self):
+        """Flush the send queues and disconnect every peripheral, the links stay listed with their stats"""
+        if self.snapshot is not None:
+            await self.snapshot.close()
+        if self.motion is not None:
+            await self.motion.close()
+        if self.combos is not None:
+            await self.combos.close()
+        for link in self._links:
+            await link.close()
 
     async def listen(self, timeout=30, on_connect=None, on_disconnect=None, on_sequence=None):
         """
         Start listening for events on a given self.interface
         :param timeout: INT, seconds. How long you want to wait for the self.interface.
                         This allows you to start listening and connect your controller after the fact.
-                        If self.interface does not become available in N seconds, the script will exit with exit code 1.
+                        If self.interface does not become available in N seconds, listen returns.
+                        When the controller is unplugged later on, listen waits for it to come back without timeout.
         :param on_connect: function object, allows to register a call back when connection is established
         :param on_disconnect: function object, allows to register a call back when connection is lost
         :param on_sequence: list, allows to register a call back on specific input sequence.
@@ -268,171 +428,213 @@ class Controller(Actions):
             if on_connect is not None:
                 on_connect()
 
-        def wait_for_interface():
+        async def wait_for_interface(wait_timeout):
             print("Waiting for interface: {} to become available . . .".format(self.interface))
-            for i in range(timeout):
-                if os.path.exists(self.interface):
-                    print("Successfully bound to: {}.".format(self.interface))
-                    on_connect_callback()
-                    return
-                time.sleep(1)
-            print("Timeout({} sec). Interface not available.".format(timeout))
-            exit(1)
-
-        def read_events():
-            try:
-                return _file.read(self.event_size)
-            except IOError:
-                print("Interface lost. Device disconnected?")
-                on_disconnect_callback()
-                exit(1)
-
-        def check_for(sub, full, start_index):
-            return [start for start in range(start_index, len(full) - len(sub) + 1) if
-                    sub == full[start:start + len(sub)]]
-
-        def unpack():
-            __event = struct.unpack(self.event_format, event)
+            if not await watcher.wait(present=True, timeout=wait_timeout):
+                print("Timeout({} sec). Interface not available.".format(wait_timeout))
+                return False
+            print("Successfully bound to: {}.".format(self.interface))
+            on_connect_callback()
+            return True
+
+        def unpack(__event):
             return (__event[3:], __event[2], __event[1], __event[0])
-              
-        wait_for_interface()
+
+        def kernel_time(__event):
+            if self.event_format == "LhBB":
+                return __event[0]
+            # 3Bh2b splits the 32-bit time, the padding hides its top byte
+            return __event[0] | (__event[1] << 8) | (__event[2] << 16)
+
+        self._sequence_matcher = SequenceMatcher(on_sequence) if on_sequence else None
+        watcher = DeviceWatcher(self.interface)
+        wait_timeout = timeout
         try:
-            _file = open(self.interface, "rb")
-            event = read_events()
-            if on_sequence is None:
-                on_sequence = []
-            special_inputs_indexes = [0] * len(on_sequence)
-            while not self.stop and event:
-                (overflow, value, button_type, button_id) = unpack()
-                if button_id not in self.black_listed_buttons:
-                    await self.__handle_event(button_id=button_id, button_type=button_type, value=value, overflow=overflow,
-                                        debug=self.debug)
-                for i, special_input in enumerate(on_sequence):
-                    check = check_for(special_input["inputs"], self.event_history, special_inputs_indexes[i])
-                    if len(check) != 0:
-                        special_inputs_indexes[i] = check[0] + 1
-                        special_input["callback"]()
-                event = read_events()
+            while not self.stop:
+                if not await wait_for_interface(wait_timeout):
+                    return
+                wait_timeout = None
+                reader = JoystickReader(self.interface, self.event_format)
+                try:
+                    reader.open()
+                    if self.pipeline is not None and not await self.__run_pipeline(reader, unpack, kernel_time):
+                        # end of file
+                        on_disconnect_callback()
+                        return
+                    while not self.stop:
+                        events = await reader.read()
+                        if events is None:
+                            # end of file, e.g. a pipe that was closed
+                            on_disconnect_callback()
+                            return
+                        tracer = self.tracer
+                        if tracer is not None:
+                            read_ns = time.monotonic_ns()
+                        for event in events:
+                            (overflow, value, button_type, button_id) = unpack(event)
+                            if button_id not in self.black_listed_buttons:
+                                self.events_handled += 1
+                                if tracer is not None:
+                                    self._trace_slot = tracer.begin(kernel_time(event), read_ns)
+                                    tracer.stamp(self._trace_slot, DISPATCH_START)
+                                await self.__handle_event(button_id=button_id, button_type=button_type, value=value,
+                                                          overflow=overflow, debug=self.debug)
+                                if tracer is not None:
+                                    tracer.stamp(self._trace_slot, DISPATCH_END)
+                                    self._trace_slot = -1
+                            if self.stop:
+                                break
+                except OSError:
+                    print("Interface lost. Device disconnected?")
+                    on_disconnect_callback()
+                    reader.close()
+                    # udev removes the node shortly after the device is gone
+                    await watcher.wait(present=False, timeout=1.0)
+                finally:
+                    reader.close()
         except KeyboardInterrupt:
             print("\nExiting (Ctrl + C)")
             on_disconnect_callback()
             exit(1)
+        finally:
+            watcher.close()
 
-    async def __handle_event(self, button_id, button_type, value, overflow, debug):
+    async def __run_pipeline(self, reader, unpack, kernel_time):
+        """
+        Run the reader, decoder and dispatcher stages of self.pipeline until the end of file or self.stop
+        :return: BOOLEAN, False at the end of file
+        :raises OSError: when the device is gone
+        """
+        pipeline = self.pipeline
+        pipeline.reset()
+        read_queue = pipeline.read_queue
+        dispatch_queue = pipeline.dispatch_queue
+        tracer = self.tracer
 
-        event = self.event_definition(button_id=button_id,
-                                      button_type=button_type,
-                                      value=value,
-                                      connecting_using_ds4drv=self.connecting_using_ds4drv,
-                                      overflow=overflow,
-                                      debug=debug)
-
-        if event.R3_event():
-            self.event_history.append("right_joystick")
-            if event.R3_y_at_rest():
-                await self.on_R3_y_at_rest()
-            elif event.R3_x_at_rest():
-                await self.on_R3_x_at_rest()
-            elif event.R3_right():
-                await self.on_R3_right(event.value)
-            elif event.R3_left():
-                await self.on_R3_left(event.value)
-            elif event.R3_up():
-                await self.on_R3_up(event.value)
-            elif event.R3_down():
-                await self.on_R3_down(event.value)
-        elif event.L3_event():
-            self.event_history.append("left_joystick")
-            if event.L3_y_at_rest():
-                await self.on_L3_y_at_rest()
-            elif event.L3_x_at_rest():
-                await self.on_L3_x_at_rest()
-            elif event.L3_up():
-                await self.on_L3_up(event.value)
-            elif event.L3_down():
-                await self.on_L3_down(event.value)
-            elif event.L3_left():
-                await self.on_L3_left(event.value)
-            elif event.L3_right():
-                await self.on_L3_right(event.value)
-        elif event.circle_pressed():
-            self.event_history.append("circle")
-            await self.on_circle_press()
-        elif event.circle_released():
-            await self.on_circle_release()
-        elif event.x_pressed():
-            self.event_history.append("x")
-            await self.on_x_press()
-        elif event.x_released():
-            await self.on_x_release()
-        elif event.triangle_pressed():
-            self.event_history.append("triangle")
-            await self.on_triangle_press()
-        elif event.triangle_released():
-            await self.on_triangle_release()
-        elif event.square_pressed():
-            self.event_history.append("square")
-            await self.on_square_press()
-        elif event.square_released():
-            await self.on_square_release()
-        elif event.L1_pressed():
-            self.event_history.append("L1")
-            await self.on_L1_press()
-        elif event.L1_released():
-            await self.on_L1_release()
-        elif event.L2_pressed():
-            self.event_history.append("L2")
-            await self.on_L2_press(event.value)
-        elif event.L2_released():
-            await self.on_L2_release()
-        elif event.R1_pressed():
-            self.event_history.append("R1")
-            await self.on_R1_press()
-        elif event.R1_released():
-            await self.on_R1_release()
-        elif event.R2_pressed():
-            self.event_history.append("R2")
-            await self.on_R2_press(event.value)
-        elif event.R2_released():
-            await self.on_R2_release()
-        elif event.options_pressed():
-            self.event_history.append("options")
-            await self.on_options_press()
-        elif event.options_released():
-            await self.on_options_release()
-        elif event.left_right_arrow_released():
-            await self.on_left_right_arrow_release()
-        elif event.up_down_arrow_released():
-            await self.on_up_down_arrow_release()
-        elif event.left_arrow_pressed():
-            self.event_history.append("left")
-            await self.on_left_arrow_press()
-        elif event.right_arrow_pressed():
-            self.event_history.append("right")
-            await self.on_right_arrow_press()
-        elif event.up_arrow_pressed():
-            self.event_history.append("up")
-            await self.on_up_arrow_press()
-        elif event.down_arrow_pressed():
-            self.event_history.append("down")
-            await self.on_down_arrow_press()
-        elif event.playstation_button_pressed():
-            self.event_history.append("ps")
-            await self.on_playstation_button_press()
-        elif event.playstation_button_released():
-            await self.on_playstation_button_release()
-        elif event.share_pressed():
-            self.event_history.append("share")
-            await self.on_share_press()
-        elif event.share_released():
-            await self.on_share_release()
-        elif event.R3_pressed():
-            self.event_history.append("R3")
-            await self.on_R3_press()
-        elif event.R3_released():
-            await self.on_R3_release()
-        elif event.L3_pressed():
-            self.event_history.append("L3")
-            await self.on_L3_press()
-        elif event.L3_released():
-            await self.on_L3_release()
+        async def read():
+            try:
+                while True:
+                    events = await reader.read()
+                    if events is None:
+                        return
+                    await read_queue.put((time.monotonic_ns(), list(events)))
+            finally:
+                read_queue.close()
+
+        async def decode():
+            try:
+                while True:
+                    batch = await read_queue.get()
+                    if batch is None:
+                        return
+                    (read_ns, events) = batch
+                    for event in events:
+                        (overflow, value, button_type, button_id) = unpack(event)
+                        if button_id in self.black_listed_buttons:
+                            continue
+                        self.events_handled += 1
+                        slot = tracer.begin(kernel_time(event), read_ns) if tracer is not None else -1
+                        resolved = self.__resolve(button_id, button_type, value, overflow, self.debug)
+                        if resolved is not None:
+                            (action, value) = resolved
+                            await dispatch_queue.put((action, value, slot), COALESCE_KEY_OF_CODE[action[3]])
+            finally:
+                dispatch_queue.close()
+
+        async def dispatch():
+            while not self.stop:
+                item = await dispatch_queue.get()
+                if item is None:
+                    return False
+                (action, value, self._trace_slot) = item
+                if tracer is not None:
+                    tracer.stamp(self._trace_slot, DISPATCH_START)
+                await self.__dispatch(action, value)
+                if tracer is not None:
+                    tracer.stamp(self._trace_slot, DISPATCH_END)
+                self._trace_slot = -1
+            return True
+
+        loop = asyncio.get_running_loop()
+        thread = None
+        if pipeline.reader_thread:
+            thread = ReaderThread(reader, read_queue)
+            thread.start()
+            tasks = [loop.create_task(decode())]
+        else:
+            tasks = [loop.create_task(read()), loop.create_task(decode())]
+        dispatcher = loop.create_task(dispatch())
+        tasks.append(dispatcher)
+        try:
+            while not dispatcher.done():
+                (done, _) = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task is not dispatcher and task.exception() is not None:
+                        raise task.exception()
+                tasks = [task for task in tasks if not task.done()]
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if thread is not None:
+                await thread.stop()
+        if thread is not None and thread.error is not None:
+            raise thread.error
+        return dispatcher.result()
+
+    def __resolve(self, button_id, button_type, value, overflow, debug):
+        """:return: (action, value) of the event, None if nothing is bound to it or the filter suppressed it"""
+        if self._dispatch is None:
+            event = self.event_definition(button_id=button_id,
+                                          button_type=button_type,
+                                          value=value,
+                                          connecting_using_ds4drv=self.connecting_using_ds4drv,
+                                          overflow=overflow,
+                                          debug=debug)
+            action = resolve_event(event)
+            if action is not None:
+                action = (action[0], getattr(self, action[1]) if action[1] else None, action[2],
+                          EVENT_CODES[action[1]] if action[1] else 0)
+            value = event.value
+        else:
+            if self._event_fields_in_overflow:
+                (value, button_type, button_id) = overflow
+            if debug:
+                print("button_id: {} button_type: {} value: {} overflow: {}"
+                      .format(button_id, button_type, value, overflow))
+            if self.event_filter is not None:
+                value = self.event_filter.filter(button_type, button_id, value)
+                if value is None:
+                    return None
+            action = self._dispatch.lookup(button_type, button_id, value)
+        if action is None:
+            return None
+        return (action, value)
+
+    async def __handle_event(self, button_id, button_type, value, overflow, debug):
+        resolved = self.__resolve(button_id, button_type, value, overflow, debug)
+        if resolved is not None:
+            await self.__dispatch(*resolved)
+
+    async def __dispatch(self, action, value):
+        (history, handler, with_value, code) = action
+        self.dispatched[code] += 1
+        if history is not None:
+            self.event_history.append(history)
+        if code:
+            state = self.state
+            buttons = state.apply(code, value)
+            if state.buttons != buttons:
+                if self.recorder is not None:
+                    self.recorder.record(BUTTONS, state.buttons)
+                if self.combos is not None:
+                    self.combos.update(buttons, state.buttons)
+        if handler is not None:
+            if self.recorder is not None:
+                self.recorder.record(DISPATCH, code, value)
+            if with_value:
+                await handler(value)
+            else:
+                await handler()
+        if history is not None and self._sequence_matcher is not None:
+            self._sequence_matcher.advance(history)
@@ -1,4 +1,7 @@
 import asyncio
+import os
+import sys
+import time
 from bleak import BleakScanner
 from bleak.backends.device import BLEDevice
 from bleak.backends.scanner import (
@@ -6,26 +9,80 @@ from bleak.backends.scanner import (
 )
 from typing import (
     Dict,
+    Optional,
     Tuple,
 )
 from bleak import uuids
 
-async def discover_devices() -> Dict[str, Tuple[BLEDevice, AdvertisementData]]: 
+TARGET_NAME = 'Pico Terminal'
+UART_SERVICE_UUID = uuids.normalize_uuid_str("6E400001-B5A3-F393-E0A9-E50E24DCCA9E")
+ADDRESS_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "ble_ds4_to_ctr_device", "address")
+
+# seconds the last get_address() took to find its device, None if nothing was found
+last_discovery_time: Optional[float] = None
+
+# BlueZ runs one discovery per adapter, controllers looking for their peripherals take turns
+_scan_lock = asyncio.Lock()
+
+async def discover_devices() -> Dict[str, Tuple[BLEDevice, AdvertisementData]]:
     devices = await BleakScanner.discover(return_adv=True)
     for key in devices:
         d,a = devices[key]
         print(f"{d} : {a}")
     return devices
 
-async def get_address() -> str:
-    devices = await BleakScanner.discover(return_adv=True)
-    for key in devices:
-        d,a = devices[key]
-        print(f"{d} : {a}")
-        if d.name.__eq__('Pico Terminal'):
-            return d.address
-    return ""    
+def is_target(d: BLEDevice, a: AdvertisementData, name: str = TARGET_NAME, match_service: bool = True) -> bool:
+    """The peripheral is recognized by its advertised name or by the Nordic UART service it advertises"""
+    return name in (d.name, a.local_name) or (match_service and UART_SERVICE_UUID in a.service_uuids)
+
+def load_cached_address(path: str = ADDRESS_CACHE) -> str:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+def save_cached_address(address: str, path: str = ADDRESS_CACHE):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(address)
+    except OSError as e:
+        print(f"could not cache address: {e}")
+
+async def get_address(name: str = TARGET_NAME, timeout: float = 10.0, cache_timeout: float = 2.0,
+                      cache_path: Optional[str] = ADDRESS_CACHE, match_service: bool = True) -> str:
+    """
+    Find the peripheral and return its address, "" if it was not found.
+    The last known address is looked for first, it is reported with its first advertisement.
+    Only when it is not seen within cache_timeout, a scan for the name / UART service runs and stops at the first match.
+    :param cache_path: file the last known address is kept in, None disables the cache
+    :param match_service: accept any device advertising the UART service, turn it off when several peripherals
+                          are around and each is bound to its own name
+    """
+    global last_discovery_time
+    last_discovery_time = None
+    start = time.monotonic()
+    cached = load_cached_address(cache_path) if cache_path else ""
+    device = None
+    async with _scan_lock:
+        if cached:
+            device = await BleakScanner.find_device_by_address(cached, timeout=cache_timeout)
+        if device is None:
+            device = await BleakScanner.find_device_by_filter(lambda d, a: is_target(d, a, name, match_service),
+                                                              timeout=timeout)
+    if device is None:
+        return ""
+    last_discovery_time = time.monotonic() - start
+    print(f"found {device} in {last_discovery_time:.3f} s")
+    if cache_path and device.address != cached:
+        save_cached_address(device.address, cache_path)
+    return device.address
 
 if __name__ == '__main__':
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(discover_devices())
+    if "--first" in sys.argv:
+        # measure time to first address
+        loop.run_until_complete(get_address())
+    else:
+        loop.run_until_complete(discover_devices())
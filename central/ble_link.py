@@ -0,0 +1,154 @@
+import asyncio
+import random
+
+from bleak import BleakClient
+
+
+class LinkSupervisor:
+    """
+    Long-lived owner of the connection to one peripheral.
+    Disconnects are reported by bleak's disconnected callback, the link is then re-established
+    with exponential backoff and jitter until it is closed or paused.
+    """
+    def __init__(self, address, on_connected, backoff_min=0.5, backoff_max=30.0, jitter=0.5, connect_timeout=10.0,
+                 transport=None):
+        """
+        :param address: STRING, address of the peripheral
+        :param on_connected: coroutine function(BleakClient), sets the link up (notify, first write ...)
+        :param backoff_min: FLOAT, seconds before the first retry
+        :param backoff_max: FLOAT, upper bound of the delay between retries
+        :param jitter: FLOAT, 0..1, the delay is randomized by +/- this fraction
+        :param connect_timeout: FLOAT, seconds one connection attempt may take
+        :param transport: function object(address, disconnected_callback, timeout) creating the client of
+                          one connection attempt, see ble_transport.Transport. Defaults to BleakClient.
+        """
+        self.address = address
+        self._on_connected = on_connected
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.connect_timeout = connect_timeout
+        self._transport = transport if transport is not None else BleakClient
+        self.client = None
+        self.paused = False
+        self.connected = asyncio.Event()
+        self._lost = asyncio.Event()
+        self._resume = asyncio.Event()
+        self._task = None
+
+        self.attempts = 0
+        self.reconnects = 0
+        self.last_connect_time = None  # seconds the last successful attempt took, connect + setup
+        self.last_outage = None        # seconds from losing the link until it was usable again
+        self.total_outage = 0.0
+        self._outage_started = None
+
+    def is_connected(self):
+        return self.client is not None and self.client.is_connected and self.connected.is_set()
+
+    def _on_disconnect(self, client):
+        if client is not self.client:
+            return
+        self.connected.clear()
+        self._lost.set()
+
+    def _delay(self, delay):
+        return delay * random.uniform(1.0 - self.jitter, 1.0 + self.jitter)
+
+    async def _connect(self, loop):
+        started = loop.time()
+        self.attempts += 1
+        client = self._transport(self.address, disconnected_callback=self._on_disconnect, timeout=self.connect_timeout)
+        self.client = client
+        self._lost.clear()
+        try:
+            await client.connect()
+            await self._on_connected(client)
+        except Exception as e:
+            print("Connecting to {} failed: {}".format(self.address, e))
+            try:
+                await client.disconnect()
+            except Exception:
+                pass
+            return False
+        if not client.is_connected:
+            return False
+        if self.paused:
+            # pause() came while connecting, before there was a connection to drop
+            try:
+                await client.disconnect()
+            except Exception:
+                pass
+            return False
+        now = loop.time()
+        self.last_connect_time = now - started
+        if self._outage_started is not None:
+            self.reconnects += 1
+            self.last_outage = now - self._outage_started
+            self.total_outage += self.last_outage
+            self._outage_started = None
+            print("Reconnected to {} after {:.3f} s".format(self.address, self.last_outage))
+        print("Ready in {:.3f} s".format(self.last_connect_time))
+        self.connected.set()
+        return True
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        delay = self.backoff_min
+        while True:
+            if self.paused:
+                await self._resume.wait()
+                continue
+            if not await self._connect(loop):
+                if self.paused:
+                    continue
+                if self._outage_started is None and self.last_connect_time is not None:
+                    self._outage_started = loop.time()
+                await asyncio.sleep(self._delay(delay))
+                delay = min(delay * 2, self.backoff_max)
+                continue
+            delay = self.backoff_min
+            await self._lost.wait()
+            self.connected.clear()
+            if not self.paused:
+                print("Link to {} lost".format(self.address))
+                self._outage_started = loop.time()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def pause(self):
+        """Disconnect on purpose, the link stays down until resume()"""
+        self.paused = True
+        self._resume.clear()
+        self.connected.clear()
+        if self.client is not None and self.client.is_connected:
+            await self.client.disconnect()
+        self._lost.set()
+
+    def resume(self):
+        self.paused = False
+        self._resume.set()
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.client is not None and self.client.is_connected:
+            await self.client.disconnect()
+        self.connected.clear()
+
+    def stats(self):
+        return {
+            "connected": self.is_connected(),
+            "attempts": self.attempts,
+            "reconnects": self.reconnects,
+            "last_connect_time": self.last_connect_time,
+            "last_outage": self.last_outage,
+            "total_outage": self.total_outage,
+        }
@@ -0,0 +1,327 @@
+import asyncio
+import collections
+import importlib.util
+import math
+import os
+import random
+
+from bleak import uuids
+
+UART_SERVICE_UUID = "6e400001-b5a3-f393-e0a9-e50e24dcca9e"
+UART_RX_UUID = "6e400002-b5a3-f393-e0a9-e50e24dcca9e"  # central -> peripheral, write
+UART_TX_UUID = "6e400003-b5a3-f393-e0a9-e50e24dcca9e"  # peripheral -> central, notify
+
+_PERIPHERAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "peripheral")
+
+
+def load_peripheral_module(name):
+    """
+    Import a module of the MicroPython peripheral in CPython, under its own name so that it does not
+    shadow the central module of the same name (e.g. ds4_protocol).
+    """
+    spec = importlib.util.spec_from_file_location("peripheral_" + name, os.path.join(_PERIPHERAL_DIR, name + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Transport:
+    """
+    Link to the UART peripheral as used by Controller and LinkSupervisor, the subset of BleakClient they need.
+    BleakClient already is a Transport, other implementations are passed to the Controller as a factory
+    with BleakClient's signature: transport(address, disconnected_callback=None, timeout=10.0).
+    """
+    address = ""
+
+    @property
+    def is_connected(self):
+        raise NotImplementedError
+
+    @property
+    def mtu_size(self):
+        raise NotImplementedError
+
+    @property
+    def services(self):
+        """service collection: iterable of services, get_characteristic(handle)"""
+        raise NotImplementedError
+
+    @property
+    def connection_interval(self):
+        """seconds between connection events, None if it is not known, as with BleakClient"""
+        return None
+
+    async def connect(self):
+        raise NotImplementedError
+
+    async def disconnect(self):
+        raise NotImplementedError
+
+    async def start_notify(self, characteristic, callback):
+        raise NotImplementedError
+
+    async def read_gatt_char(self, characteristic):
+        raise NotImplementedError
+
+    async def write_gatt_char(self, characteristic, data, response=False):
+        raise NotImplementedError
+
+
+class _Characteristic:
+    def __init__(self, uuid, handle, properties):
+        self.uuid = uuid
+        self.handle = handle
+        self.properties = properties
+        self.description = uuids.uuidstr_to_str(uuid)
+
+    def __str__(self):
+        return "{} (Handle: {}): {}".format(self.uuid, self.handle, self.description)
+
+
+class _Service:
+    def __init__(self, uuid, characteristics):
+        self.uuid = uuid
+        self.characteristics = characteristics
+        self.description = uuids.uuidstr_to_str(uuid)
+
+    def __str__(self):
+        return "{} (Handle: {}): {}".format(self.uuid, self.characteristics[0].handle - 1, self.description)
+
+
+class _Services:
+    def __init__(self, services):
+        self._services = services
+        self._characteristics = {c.handle: c for s in services for c in s.characteristics}
+
+    def __iter__(self):
+        return iter(self._services)
+
+    def get_characteristic(self, handle):
+        return self._characteristics.get(handle)
+
+
+class LoopbackPeripheral:
+    """
+    In-process stand-in for the Pico and the radio between them, for benchmarks and tests without hardware.
+    Writes are scheduled into simulated connection events: at most packets_per_interval writes go out per
+    connection interval. Like the BLE controller, the link buffers the packets of the next connection event,
+    a write completes once its packet is buffered, so a busy link pushes back on the sender as the real one
+    does. Packets arrive latency seconds after their connection event, drop_rate of them are lost (seeded,
+    the same seed loses the same packets). Arriving packets are decoded with the peripheral's own
+    FrameDecoder, as peripheral/main.py does, and acknowledged with its Acknowledger if ack_every is set.
+    State frames of the snapshot sync mode are applied to the peripheral's StateDecoder, self.state, motion frames
+    to its MotionDecoder, self.motion.
+    """
+    def __init__(self, mtu=23, connection_interval=0.0075, packets_per_interval=4, latency=0.0, drop_rate=0.0,
+                 seed=0, on_frame=None, ack_every=0, central_mtu=517):
+        """
+        :param mtu: INT, ATT MTU the peripheral asks for, the connection uses the lower of mtu and central_mtu,
+                    writes may carry up to that - 3 bytes
+        :param connection_interval: FLOAT, seconds between connection events
+        :param packets_per_interval: INT, writes without response that fit in one connection event
+        :param latency: FLOAT, seconds from the connection event to the arrival at the peripheral
+        :param drop_rate: FLOAT, 0..1, fraction of writes without response that are lost
+        :param seed: INT, seed of the loss pattern
+        :param on_frame: function object(code, value, sequence, timestamp), called for every decoded frame
+        :param ack_every: INT, notify a cumulative ack every that many frames, 0 does not ack.
+                          Unlike peripheral/main.py there is no ack timer, a trailing partial batch is not acked.
+        :param central_mtu: INT, ATT MTU the central offers in the exchange, BlueZ offers 517
+        """
+        self.mtu = min(mtu, central_mtu)
+        self.connection_interval = connection_interval
+        self.packets_per_interval = packets_per_interval
+        self.latency = latency
+        self.drop_rate = drop_rate
+        self.on_frame = on_frame
+        self._random = random.Random(seed)
+        protocol = load_peripheral_module("ds4_protocol")
+        self.event_name = protocol.event_name
+        self.decoder = protocol.FrameDecoder()
+        self.acknowledger = protocol.Acknowledger(ack_every) if ack_every else None
+        self.is_state_frame = protocol.is_state_frame
+        self.state = protocol.StateDecoder()
+        self.is_motion_frame = protocol.is_motion_frame
+        self.motion = protocol.MotionDecoder()
+        self.client = None
+        self._anchor = None   # time of connection event 0
+        self._event = 0       # connection event the last write was scheduled in
+        self._used = 0        # writes scheduled in that event
+        self._in_flight = collections.deque()
+        self.services = _Services([_Service(UART_SERVICE_UUID, [
+            _Characteristic(UART_TX_UUID, 12, ["read", "notify"]),
+            _Characteristic(UART_RX_UUID, 15, ["write-without-response", "write"]),
+        ])])
+
+        self.packets_sent = 0
+        self.packets_dropped = 0
+        self.packets_received = 0
+        self.bytes_received = 0
+        self.frames_received = 0
+        self.other_received = 0  # writes that are not frames, e.g. the greeting text
+        self.frames_by_code = [0] * len(protocol.EVENT_NAMES)
+
+    def transport(self, address, disconnected_callback=None, timeout=10.0):
+        """factory of LoopbackTransport, pass it as the transport of Controller"""
+        return LoopbackTransport(self, address, disconnected_callback, timeout)
+
+    def on_rx(self, data):
+        """peripheral side of a write, mirrors on_rx in peripheral/main.py"""
+        self.packets_received += 1
+        self.bytes_received += len(data)
+        decoder = self.decoder
+        offset = 0
+        while offset < len(data):
+            if self.is_motion_frame(data, offset):
+                offset = self.motion.decode(data, offset)
+                if offset < 0:
+                    self.other_received += 1
+                    break
+                continue
+            if self.is_state_frame(data, offset):
+                offset = self.state.decode(data, offset)
+                if offset < 0:
+                    self.other_received += 1
+                    break
+                continue
+            offset = decoder.decode(data, offset)
+            if offset < 0:
+                self.other_received += 1
+                break
+            self.frames_received += 1
+            if decoder.code < len(self.frames_by_code):
+                self.frames_by_code[decoder.code] += 1
+            if self.on_frame is not None:
+                self.on_frame(decoder.code, decoder.value, decoder.sequence, decoder.timestamp)
+            if self.acknowledger is not None and self.acknowledger.received(decoder.sequence):
+                self.notify(self.acknowledger.frame())
+
+    def notify(self, data):
+        """send a notification to the connected central"""
+        client = self.client
+        if client is None or client._notify is None:
+            return False
+        asyncio.get_running_loop().call_later(self.latency, client._notify, client._tx, bytearray(data))
+        return True
+
+    def drop_link(self):
+        """the link is lost, e.g. the peripheral went out of range"""
+        client = self.client
+        if client is not None:
+            client._lost()
+
+    def _connected(self, client, now):
+        self.client = client
+        self._anchor = now
+        self._event = 0
+        self._used = 0
+
+    def _reserve(self, now):
+        """:return: time of the connection event the next write goes out in"""
+        event = max(self._event, math.floor((now - self._anchor) / self.connection_interval) + 1)
+        if event == self._event and self._used >= self.packets_per_interval:
+            event += 1
+        if event != self._event:
+            self._event = event
+            self._used = 0
+        self._used += 1
+        return self._anchor + event * self.connection_interval
+
+    def _arrive(self):
+        self.on_rx(self._in_flight.popleft())
+
+    async def transmit(self, data, response):
+        loop = asyncio.get_running_loop()
+        while True:
+            send_time = self._reserve(loop.time())
+            # the buffer holds one connection event, wait until the packet fits in
+            delay = send_time - self.connection_interval - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.packets_sent += 1
+            if self.drop_rate and self._random.random() < self.drop_rate:
+                self.packets_dropped += 1
+                if response:
+                    continue  # not acknowledged, retried in a later connection event
+                return
+            break
+        self._in_flight.append(data)
+        loop.call_at(send_time + self.latency, self._arrive)
+        if response:
+            # the write response comes back with the connection event
+            await asyncio.sleep(max(0.0, send_time + 2 * self.latency - loop.time()))
+
+    def stats(self):
+        return {
+            "sent": self.packets_sent,
+            "dropped": self.packets_dropped,
+            "received": self.packets_received,
+            "bytes": self.bytes_received,
+            "frames": self.frames_received,
+            "other": self.other_received,
+            "states": self.state.frames,
+            "states lost": self.state.lost,
+            "states stale": self.state.stale,
+            "motion": self.motion.frames,
+        }
+
+
+class LoopbackTransport(Transport):
+    """Central side of a LoopbackPeripheral, created through LoopbackPeripheral.transport"""
+    def __init__(self, peripheral, address, disconnected_callback=None, timeout=10.0):
+        self.peripheral = peripheral
+        self.address = address
+        self._disconnected_callback = disconnected_callback
+        self.timeout = timeout
+        self._connected = False
+        self._notify = None
+        self._tx = peripheral.services.get_characteristic(12)
+
+    @property
+    def is_connected(self):
+        return self._connected
+
+    @property
+    def mtu_size(self):
+        return self.peripheral.mtu
+
+    @property
+    def services(self):
+        return self.peripheral.services
+
+    @property
+    def connection_interval(self):
+        return self.peripheral.connection_interval
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(self.peripheral.connection_interval)
+        self._connected = True
+        self.peripheral._connected(self, loop.time())
+        return True
+
+    def _lost(self):
+        if not self._connected:
+            return
+        self._connected = False
+        self._notify = None
+        if self.peripheral.client is self:
+            self.peripheral.client = None
+        if self._disconnected_callback is not None:
+            self._disconnected_callback(self)
+
+    async def disconnect(self):
+        self._lost()
+        return True
+
+    async def start_notify(self, characteristic, callback):
+        self._notify = callback
+
+    async def read_gatt_char(self, characteristic):
+        return bytearray(b"Loopback")
+
+    async def write_gatt_char(self, characteristic, data, response=False):
+        if not self._connected:
+            raise ConnectionError("{} is not connected".format(self.address))
+        if len(data) > self.peripheral.mtu - 3:
+            raise ValueError("{} bytes do not fit in MTU {}".format(len(data), self.peripheral.mtu))
+        await self.peripheral.transmit(bytes(data), response)
@@ -0,0 +1,124 @@
+import asyncio
+
+from ds4_protocol import BUTTON_NAMES
+
+_BITS = {name: 1 << bit for bit, name in enumerate(BUTTON_NAMES)}
+ALL_BUTTONS = (1 << len(BUTTON_NAMES)) - 1
+
+
+class _Combo:
+    __slots__ = ("name", "mask", "compare", "trigger", "hold", "tap", "callback", "completed_at", "timer", "task")
+
+    def __init__(self, combo):
+        buttons = 0
+        for name in combo["buttons"]:
+            if name not in _BITS:
+                raise ValueError("unknown button {}, see ds4_protocol.BUTTON_NAMES".format(name))
+            buttons |= _BITS[name]
+        self.name = "+".join(combo["buttons"])
+        self.compare = buttons
+        self.mask = ALL_BUTTONS if combo.get("exact", False) else buttons
+        self.trigger = _BITS[combo["trigger"]] if combo.get("trigger") else 0
+        self.hold = combo.get("hold", 0.0)
+        self.tap = combo.get("tap", 0.0)
+        self.callback = combo["callback"]
+        self.completed_at = None
+        self.timer = None
+        self.task = None
+
+
+class ComboEngine:
+    """
+    Chords of the controller's buttons, evaluated on the button mask kept by the Controller
+    (bit n is ds4_protocol.BUTTON_NAMES[n]).
+    Every combo is compiled into a mask / compare pair, it is down when (buttons & mask) == compare.
+    A press is only checked against the combos holding the pressed button, each check is constant time.
+      chord  fires when a press completes it, only the press of trigger if one is given
+      hold   fires once the completed chord was held for hold seconds
+      tap    fires when the chord is released within tap seconds of completing it
+    Callbacks run as tasks, the input path never waits for them. A combo whose callback still runs does not fire.
+    """
+    def __init__(self, combos):
+        """
+        :param combos: list, e.g [{"buttons": ["share", "options", "circle"], "callback": async () -> None,
+                                   "trigger": "circle"}]
+                       optional keys: "trigger" the button whose press fires the chord,
+                                      "exact" BOOLEAN no other button may be down,
+                                      "hold" FLOAT seconds, "tap" FLOAT seconds
+        """
+        self._combos = tuple(_Combo(combo) for combo in combos)
+        # combos per button bit
+        self._by_bit = tuple(tuple(combo for combo in self._combos if combo.compare & (1 << bit))
+                             for bit in range(len(BUTTON_NAMES)))
+        self.buttons = 0
+        self.fired = 0
+        self.busy = 0  # fired while the previous callback of the combo was still running
+
+    def update(self, previous, buttons):
+        """
+        :param previous: INT, button mask before the event
+        :param buttons: INT, button mask after the event
+        """
+        self.buttons = buttons
+        pressed = buttons & ~previous
+        released = previous & ~buttons
+        while pressed:
+            bit = pressed & -pressed
+            pressed ^= bit
+            for combo in self._by_bit[bit.bit_length() - 1]:
+                if (buttons & combo.mask) != combo.compare or (combo.trigger and combo.trigger != bit):
+                    continue
+                if combo.hold:
+                    if combo.timer is None:
+                        combo.timer = asyncio.get_running_loop().call_later(combo.hold, self._held, combo)
+                elif combo.tap:
+                    combo.completed_at = asyncio.get_running_loop().time()
+                else:
+                    self._fire(combo)
+        while released:
+            bit = released & -released
+            released ^= bit
+            for combo in self._by_bit[bit.bit_length() - 1]:
+                if combo.timer is not None:
+                    combo.timer.cancel()
+                    combo.timer = None
+                if combo.completed_at is not None:
+                    held = asyncio.get_running_loop().time() - combo.completed_at
+                    combo.completed_at = None
+                    if held <= combo.tap and (previous & combo.mask) == combo.compare:
+                        self._fire(combo)
+
+    def _held(self, combo):
+        combo.timer = None
+        if (self.buttons & combo.mask) == combo.compare:
+            self._fire(combo)
+
+    def _fire(self, combo):
+        if combo.task is not None and not combo.task.done():
+            self.busy += 1
+            return
+        self.fired += 1
+        result = combo.callback()
+        if asyncio.iscoroutine(result):
+            combo.task = asyncio.get_running_loop().create_task(result)
+            combo.task.add_done_callback(self._done)
+
+    @staticmethod
+    def _done(task):
+        if not task.cancelled() and task.exception() is not None:
+            print("combo callback failed: {!r}".format(task.exception()))
+
+    async def close(self):
+        """cancel the pending hold timers and the running callbacks"""
+        tasks = []
+        for combo in self._combos:
+            if combo.timer is not None:
+                combo.timer.cancel()
+                combo.timer = None
+            if combo.task is not None and not combo.task.done():
+                combo.task.cancel()
+                tasks.append(combo.task)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self):
+        return {"combos fired": self.fired, "combos busy": self.busy}
@@ -0,0 +1,115 @@
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len of the name that follows
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class DeviceWatcher:
+    """
+    Waits for a device node (e.g. /dev/input/js0) to appear or disappear without blocking the event loop.
+    inotify on the parent directory reports changes as they happen, udev creating the node and later
+    fixing its permissions are both seen. Where inotify is not available the path is polled.
+    """
+    def __init__(self, path, poll_interval=0.25):
+        """
+        :param path: STRING, device node to watch
+        :param poll_interval: FLOAT, seconds between checks when inotify is not available
+        """
+        self.path = path
+        self.directory = os.path.dirname(path) or "."
+        self.name = os.path.basename(path)
+        self.poll_interval = poll_interval
+        self._fd = -1
+        self._changed = None
+        self._libc = _load_libc()
+
+    def is_present(self):
+        return os.access(self.path, os.R_OK)
+
+    def _open(self):
+        if self._fd >= 0 or self._libc is None:
+            return self._fd >= 0
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return False
+        mask = IN_CREATE | IN_DELETE | IN_ATTRIB | IN_MOVED_TO | IN_MOVED_FROM
+        if self._libc.inotify_add_watch(fd, os.fsencode(self.directory), mask) < 0:
+            print("inotify on {} failed: {}".format(self.directory, os.strerror(ctypes.get_errno())))
+            os.close(fd)
+            return False
+        self._fd = fd
+        self._changed = asyncio.Event()
+        asyncio.get_running_loop().add_reader(fd, self._on_readable)
+        return True
+
+    def close(self):
+        if self._fd < 0:
+            return
+        asyncio.get_running_loop().remove_reader(self._fd)
+        os.close(self._fd)
+        self._fd = -1
+
+    def _on_readable(self):
+        name = os.fsencode(self.name)
+        while True:
+            try:
+                data = os.read(self._fd, 4096)
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    print("inotify read failed: {}".format(e))
+                return
+            offset = 0
+            while offset + _EVENT.size <= len(data):
+                (_, _, _, length) = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                if data[offset:offset + length].rstrip(b"\0") == name:
+                    self._changed.set()
+                offset += length
+
+    async def wait(self, present=True, timeout=None):
+        """
+        :param present: BOOLEAN, wait for the node to appear (True) or to disappear (False)
+        :param timeout: FLOAT, seconds, None waits forever
+        :return: BOOLEAN, False if the timeout expired first
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        watching = self._open()
+        while True:
+            if watching:
+                # cleared before checking, a change in between still wakes the wait below
+                self._changed.clear()
+            if self.is_present() == present:
+                return True
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            if not watching:
+                await asyncio.sleep(self.poll_interval if remaining is None else min(self.poll_interval, remaining))
+                continue
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return self.is_present() == present
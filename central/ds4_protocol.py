@@ -0,0 +1,214 @@
+"""
+Binary frames sent over the UART characteristic.
+The layout is fixed for a given set of flags, so several frames can be packed into one write:
+
+    byte 0      header: version (high nibble) | flags (low nibble)
+    byte 1      event code, see EVENT_NAMES
+    byte 2-3    value, int16 little endian
+    [byte]      sequence number, uint8          (FLAG_SEQUENCE)
+    [2 bytes]   timestamp in ms, uint16 LE      (FLAG_TIMESTAMP)
+
+In snapshot sync mode (snapshot_sync.py) the state of the whole controller is sent instead, in state frames
+with FLAG_STATE. They carry their own sequence number and never the other flags:
+
+    byte 0      header: version | FLAG_STATE
+    byte 1      STATE_KEYFRAME or STATE_DELTA
+    byte 2      sequence number, uint8
+    keyframe:
+    byte 3-6    buttons, uint32 LE, bit n is BUTTON_NAMES[n]
+    byte 7-18   axes, AXIS_COUNT x int16 LE, indexed by AXIS_*
+    delta, the state relative to the keyframe it names:
+    byte 3      sequence number of the keyframe
+    byte 4      changed fields: bit 0 buttons, bit 1 + n axis n
+    [4 bytes]   buttons XOR the keyframe's, uint32 LE
+    [2 bytes]   value of every changed axis, int16 LE, in axis order
+    motion frame (motion_sensor.py), without sequence number, only the latest one counts:
+    byte 1      STATE_MOTION
+    byte 2-7    orientation pitch / roll / yaw, int16 LE, 0.01 degree
+    byte 8-13   angular rate x / y / z, int16 LE, 0.1 degree/s
+    byte 14-19  acceleration x / y / z, int16 LE, mg
+
+The peripheral acknowledges frames with a notification in the same layout, with FLAG_SEQUENCE and CODE_ACK:
+the value is the number of frames it received so far (uint16, wrapping), the sequence number is the one of the
+last frame it received. See ack_tracker.py.
+
+peripheral/ds4_protocol.py holds the matching decoder, keep both files in sync.
+"""
+
+import struct
+import time
+
+VERSION = 1
+FLAG_SEQUENCE = 0x01
+FLAG_TIMESTAMP = 0x02
+FLAG_STATE = 0x08
+STATE_KEYFRAME = 0
+STATE_DELTA = 1
+STATE_MOTION = 2
+
+# event codes, the index in EVENT_NAMES is the code sent over the air
+EVENT_NAMES = (
+    "",
+    "on_x_press", "on_x_release",
+    "on_triangle_press", "on_triangle_release",
+    "on_circle_press", "on_circle_release",
+    "on_square_press", "on_square_release",
+    "on_L1_press", "on_L1_release",
+    "on_L2_press", "on_L2_release",
+    "on_R1_press", "on_R1_release",
+    "on_R2_press", "on_R2_release",
+    "on_up_arrow_press", "on_up_down_arrow_release", "on_down_arrow_press",
+    "on_left_arrow_press", "on_left_right_arrow_release", "on_right_arrow_press",
+    "on_L3_up", "on_L3_down", "on_L3_left", "on_L3_right",
+    "on_L3_y_at_rest", "on_L3_x_at_rest", "on_L3_press", "on_L3_release",
+    "on_R3_up", "on_R3_down", "on_R3_left", "on_R3_right",
+    "on_R3_y_at_rest", "on_R3_x_at_rest", "on_R3_press", "on_R3_release",
+    "on_options_press", "on_options_release",
+    "on_share_press", "on_share_release",
+    "on_playstation_button_press", "on_playstation_button_release",
+)
+EVENT_CODES = {name: code for code, name in enumerate(EVENT_NAMES) if name}
+CODE_ACK = 0xFF
+
+# analog axes, events of the same axis carry the latest position and can replace each other
+AXIS_L3_X = 0
+AXIS_L3_Y = 1
+AXIS_R3_X = 2
+AXIS_R3_Y = 3
+AXIS_L2 = 4
+AXIS_R2 = 5
+_AXIS_EVENTS = {
+    AXIS_L3_X: ("on_L3_left", "on_L3_right", "on_L3_x_at_rest"),
+    AXIS_L3_Y: ("on_L3_up", "on_L3_down", "on_L3_y_at_rest"),
+    AXIS_R3_X: ("on_R3_left", "on_R3_right", "on_R3_x_at_rest"),
+    AXIS_R3_Y: ("on_R3_up", "on_R3_down", "on_R3_y_at_rest"),
+    AXIS_L2: ("on_L2_press", "on_L2_release"),
+    AXIS_R2: ("on_R2_press", "on_R2_release"),
+}
+AXIS_OF_CODE = tuple(next((axis for axis, names in _AXIS_EVENTS.items() if name in names), None)
+                     for name in EVENT_NAMES)
+AXIS_COUNT = 6
+
+# buttons of the snapshot, the index is the bit in the button mask
+BUTTON_NAMES = (
+    "x", "triangle", "circle", "square", "L1", "L2", "R1", "R2",
+    "up", "down", "left", "right", "L3", "R3", "options", "share", "playstation",
+)
+_BUTTON_BITS = {name: 1 << bit for bit, name in enumerate(BUTTON_NAMES)}
+_BUTTON_EVENTS = dict(
+    [("on_{}_press".format(name), (bit, 0)) for name, bit in _BUTTON_BITS.items()] +
+    [("on_{}_release".format(name), (0, bit)) for name, bit in _BUTTON_BITS.items()] +
+    [("on_{}_arrow_press".format(name), (_BUTTON_BITS[name], 0)) for name in ("up", "down", "left", "right")] +
+    [("on_up_down_arrow_release", (0, _BUTTON_BITS["up"] | _BUTTON_BITS["down"])),
+     ("on_left_right_arrow_release", (0, _BUTTON_BITS["left"] | _BUTTON_BITS["right"])),
+     ("on_playstation_button_press", (_BUTTON_BITS["playstation"], 0)),
+     ("on_playstation_button_release", (0, _BUTTON_BITS["playstation"]))])
+# (bits set, bits cleared) of the button mask per event code, (0, 0) for events that are no button edge
+BUTTONS_OF_CODE = tuple(_BUTTON_EVENTS.get(name, (0, 0)) for name in EVENT_NAMES)
+# key of the events a newer one may replace while queued: the axis, for the codes that press no button
+COALESCE_KEY_OF_CODE = tuple(axis if not pressed and not released else None
+                             for axis, (pressed, released) in zip(AXIS_OF_CODE, BUTTONS_OF_CODE))
+
+_FORMATS = {
+    0: "<BBh",
+    FLAG_SEQUENCE: "<BBhB",
+    FLAG_TIMESTAMP: "<BBhH",
+    FLAG_SEQUENCE | FLAG_TIMESTAMP: "<BBhBH",
+}
+_SIZES = {flags: struct.calcsize(fmt) for flags, fmt in _FORMATS.items()}
+_ACK_HEADER = (VERSION << 4) | FLAG_SEQUENCE
+_STATE_HEADER = (VERSION << 4) | FLAG_STATE
+KEYFRAME_SIZE = 7 + 2 * AXIS_COUNT
+DELTA_HEAD_SIZE = 5
+MOTION_FRAME_SIZE = 20
+# coalescing key of the motion frames in the send queue, next to the analog axes
+MOTION_AXIS = AXIS_COUNT
+
+
+def frame_size(header):
+    """
+    :return: INT, size of the event frame starting with header,
+             0 if the header is not a frame of this version or a state frame, whose size varies
+    """
+    if header >> 4 != VERSION or header & FLAG_STATE:
+        return 0
+    return _SIZES[header & (FLAG_SEQUENCE | FLAG_TIMESTAMP)]
+
+
+def state_frame_size(data, offset=0):
+    """:return: INT, size of the state or motion frame at offset, 0 if there is none or it is truncated"""
+    if len(data) < offset + 2 or data[offset] != _STATE_HEADER:
+        return 0
+    kind = data[offset + 1]
+    if kind == STATE_KEYFRAME:
+        size = KEYFRAME_SIZE
+    elif kind == STATE_MOTION:
+        size = MOTION_FRAME_SIZE
+    elif kind == STATE_DELTA and len(data) >= offset + DELTA_HEAD_SIZE:
+        changed = data[offset + 4]
+        size = DELTA_HEAD_SIZE + (4 if changed & 1 else 0) + 2 * bin(changed >> 1).count("1")
+    else:
+        return 0
+    return size if len(data) >= offset + size else 0
+
+
+def parse_ack(data):
+    """:return: (INT frames received, INT last sequence number) of an ack notification, None for anything else"""
+    if len(data) != _SIZES[FLAG_SEQUENCE] or data[0] != _ACK_HEADER or data[1] != CODE_ACK:
+        return None
+    return (data[2] | (data[3] << 8), data[4])
+
+
+def frame_axis(frame):
+    """
+    :return: INT, analog axis the frame reports, MOTION_AXIS for a motion frame, None for button edges
+             (trigger presses and releases included), other state frames and anything that is not a frame
+    """
+    if len(frame) < 2 or frame[0] >> 4 != VERSION:
+        return None
+    if frame[0] & FLAG_STATE:
+        return MOTION_AXIS if frame[0] == _STATE_HEADER and frame[1] == STATE_MOTION else None
+    if frame[1] >= len(COALESCE_KEY_OF_CODE):
+        return None
+    return COALESCE_KEY_OF_CODE[frame[1]]
+
+
+class FrameEncoder:
+    """
+    Encoder of event frames.
+    Without sequence and timestamp the frames of value-less events are built once and reused.
+    """
+    def __init__(self, sequence=False, timestamp=False):
+        """
+        :param sequence: BOOLEAN, append a wrapping 8-bit sequence number to every frame
+        :param timestamp: BOOLEAN, append the low 16 bits of a millisecond clock to every frame
+        """
+        flags = (FLAG_SEQUENCE if sequence else 0) | (FLAG_TIMESTAMP if timestamp else 0)
+        self.flags = flags
+        self.header = (VERSION << 4) | flags
+        self.sequence = 0
+        self._struct = struct.Struct(_FORMATS[flags])
+        self.frame_size = self._struct.size
+        if flags == 0:
+            self._frames = tuple(self._struct.pack(self.header, code, 0) for code in range(len(EVENT_NAMES)))
+        else:
+            self._frames = None
+
+    def encode(self, code, value=0):
+        """
+        :param code: INT, event code
+        :param value: INT, -32768 <= value <= 32767
+        :return: BYTES, one frame
+        """
+        flags = self.flags
+        if flags == 0:
+            if value == 0:
+                return self._frames[code]
+            return self._struct.pack(self.header, code, value)
+        if flags == FLAG_TIMESTAMP:
+            return self._struct.pack(self.header, code, value, (time.monotonic_ns() // 1000000) & 0xFFFF)
+        sequence = self.sequence
+        self.sequence = (sequence + 1) & 0xFF
+        if flags == FLAG_SEQUENCE:
+            return self._struct.pack(self.header, code, value, sequence)
+        return self._struct.pack(self.header, code, value, sequence, (time.monotonic_ns() // 1000000) & 0xFFFF)
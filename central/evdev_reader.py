@@ -0,0 +1,100 @@
+"""
+evdev interface of the controller (/dev/input/eventN).
+Besides the node of the buttons and sticks, the DS4 driver (hid-sony / hid-playstation) registers separate input
+devices for the motion sensors and the touchpad, which the joystick API does not expose.
+"""
+
+import fcntl
+import glob
+import os
+import struct
+import time
+
+from js_reader import JoystickReader
+
+SYSFS = "/sys/class/input"
+
+EVENT_FORMAT = "llHHi"  # struct input_event: timeval, type, code, value
+
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_ABS = 0x03
+EV_MSC = 0x04
+SYN_REPORT = 0
+SYN_DROPPED = 3
+MSC_TIMESTAMP = 0x05
+ABS_X = 0x00
+ABS_Y = 0x01
+ABS_Z = 0x02
+ABS_RX = 0x03
+ABS_RY = 0x04
+ABS_RZ = 0x05
+
+_EVIOCSCLOCKID = 0x400445a0  # _IOW('E', 0xa0, int)
+_EVIOCGABS = 0x80184540      # _IOR('E', 0x40 + axis, struct input_absinfo)
+_ABSINFO = struct.Struct("6i")  # value, minimum, maximum, fuzz, flat, resolution
+
+
+class EvdevReader(JoystickReader):
+    """
+    Non-blocking reader of an evdev node, the input_event records are drained in bulk like the js events.
+    The kernel timestamps of the events are switched to CLOCK_MONOTONIC, the clock of time.monotonic_ns().
+    """
+    def __init__(self, interface, max_events=256):
+        """
+        :param interface: STRING aka /dev/input/event0, or any path that yields raw input_event records
+        :param max_events: INT, how many events can be drained per wakeup
+        """
+        JoystickReader.__init__(self, interface, EVENT_FORMAT, max_events)
+
+    def open(self):
+        JoystickReader.open(self)
+        try:
+            fcntl.ioctl(self._fd, _EVIOCSCLOCKID, struct.pack("i", time.CLOCK_MONOTONIC))
+        except OSError:
+            # not an evdev node, e.g. a FIFO fed by a recording
+            pass
+
+    def absinfo(self, axis):
+        """:return: (value, minimum, maximum, fuzz, flat, resolution) of an absolute axis, None if it is unknown"""
+        info = bytearray(_ABSINFO.size)
+        try:
+            fcntl.ioctl(self._fd, _EVIOCGABS + axis, info)
+        except OSError:
+            return None
+        return _ABSINFO.unpack(info)
+
+
+def _attribute(device, name):
+    try:
+        with open(os.path.join(device, name)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def event_nodes(interface):
+    """
+    Event nodes of the controller an input node belongs to, found through sysfs: all input devices of one DS4 share
+    its uniq, the Bluetooth address of the controller.
+    :param interface: STRING, e.g. /dev/input/js0
+    :return: DICT {device name: /dev/input/eventN}, empty if the interface is not an input device
+    """
+    uniq = _attribute(os.path.join(SYSFS, os.path.basename(interface), "device"), "uniq")
+    if not uniq:
+        return {}
+    nodes = {}
+    for device in glob.glob(os.path.join(SYSFS, "input*")):
+        if _attribute(device, "uniq") != uniq:
+            continue
+        for event in glob.glob(os.path.join(device, "event*")):
+            nodes[_attribute(device, "name")] = os.path.join("/dev/input", os.path.basename(event))
+    return nodes
+
+
+def motion_sensor_node(interface):
+    """:return: STRING, event node of the motion sensors of the controller of interface, None if there is none"""
+    for (name, node) in event_nodes(interface).items():
+        if name and name.endswith("Motion Sensors"):
+            return node
+    return None
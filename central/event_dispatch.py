@@ -0,0 +1,192 @@
+"""
+Table driven event dispatch.
+The predicate chain of the pyPS4Controller mappings is evaluated once per (mapping, connecting_using_ds4drv)
+for every button and every class of values, the result is a table that maps
+(button_type, button_id, value class) to the handler to call, so handling an event is a couple of lookups.
+"""
+
+from ds4_protocol import AXIS_OF_CODE, EVENT_CODES
+
+# Every predicate of the stock mappings is constant inside each of these value ranges.
+VALUE_BELOW_MIN = 0   # value < -32767
+VALUE_MIN = 1         # value == -32767
+VALUE_NEGATIVE = 2    # -32767 < value < 0
+VALUE_ZERO = 3        # value == 0
+VALUE_ONE = 4         # value == 1
+VALUE_POSITIVE = 5    # 1 < value < 32767
+VALUE_MAX = 6         # value >= 32767
+_VALUE_SAMPLES = (-32768, -32767, -16384, 0, 1, 16384, 32767)
+
+BUTTON_TYPES = (1, 2)
+BUTTON_IDS = range(32)  # ids the table is built for, DS4 reports less than 20 buttons and axes
+
+_tables = {}
+
+
+def value_class(value):
+    if value == 0:
+        return VALUE_ZERO
+    if value > 0:
+        if value == 1:
+            return VALUE_ONE
+        return VALUE_POSITIVE if value < 32767 else VALUE_MAX
+    if value > -32767:
+        return VALUE_NEGATIVE
+    return VALUE_MIN if value == -32767 else VALUE_BELOW_MIN
+
+
+def resolve_event(event):
+    """
+    Resolve an event_definition instance to the action it triggers.
+    :param event: event_definition instance (DefaultMapping, Mapping3Bh2b or compatible)
+    :return: (history entry or None, name of the Actions method, BOOLEAN whether the value is passed) or None
+    """
+    if event.R3_event():
+        if event.R3_y_at_rest():
+            return ("right_joystick", "on_R3_y_at_rest", False)
+        elif event.R3_x_at_rest():
+            return ("right_joystick", "on_R3_x_at_rest", False)
+        elif event.R3_right():
+            return ("right_joystick", "on_R3_right", True)
+        elif event.R3_left():
+            return ("right_joystick", "on_R3_left", True)
+        elif event.R3_up():
+            return ("right_joystick", "on_R3_up", True)
+        elif event.R3_down():
+            return ("right_joystick", "on_R3_down", True)
+        return ("right_joystick", None, False)
+    elif event.L3_event():
+        if event.L3_y_at_rest():
+            return ("left_joystick", "on_L3_y_at_rest", False)
+        elif event.L3_x_at_rest():
+            return ("left_joystick", "on_L3_x_at_rest", False)
+        elif event.L3_up():
+            return ("left_joystick", "on_L3_up", True)
+        elif event.L3_down():
+            return ("left_joystick", "on_L3_down", True)
+        elif event.L3_left():
+            return ("left_joystick", "on_L3_left", True)
+        elif event.L3_right():
+            return ("left_joystick", "on_L3_right", True)
+        return ("left_joystick", None, False)
+    elif event.circle_pressed():
+        return ("circle", "on_circle_press", False)
+    elif event.circle_released():
+        return (None, "on_circle_release", False)
+    elif event.x_pressed():
+        return ("x", "on_x_press", False)
+    elif event.x_released():
+        return (None, "on_x_release", False)
+    elif event.triangle_pressed():
+        return ("triangle", "on_triangle_press", False)
+    elif event.triangle_released():
+        return (None, "on_triangle_release", False)
+    elif event.square_pressed():
+        return ("square", "on_square_press", False)
+    elif event.square_released():
+        return (None, "on_square_release", False)
+    elif event.L1_pressed():
+        return ("L1", "on_L1_press", False)
+    elif event.L1_released():
+        return (None, "on_L1_release", False)
+    elif event.L2_pressed():
+        return ("L2", "on_L2_press", True)
+    elif event.L2_released():
+        return (None, "on_L2_release", False)
+    elif event.R1_pressed():
+        return ("R1", "on_R1_press", False)
+    elif event.R1_released():
+        return (None, "on_R1_release", False)
+    elif event.R2_pressed():
+        return ("R2", "on_R2_press", True)
+    elif event.R2_released():
+        return (None, "on_R2_release", False)
+    elif event.options_pressed():
+        return ("options", "on_options_press", False)
+    elif event.options_released():
+        return (None, "on_options_release", False)
+    elif event.left_right_arrow_released():
+        return (None, "on_left_right_arrow_release", False)
+    elif event.up_down_arrow_released():
+        return (None, "on_up_down_arrow_release", False)
+    elif event.left_arrow_pressed():
+        return ("left", "on_left_arrow_press", False)
+    elif event.right_arrow_pressed():
+        return ("right", "on_right_arrow_press", False)
+    elif event.up_arrow_pressed():
+        return ("up", "on_up_arrow_press", False)
+    elif event.down_arrow_pressed():
+        return ("down", "on_down_arrow_press", False)
+    elif event.playstation_button_pressed():
+        return ("ps", "on_playstation_button_press", False)
+    elif event.playstation_button_released():
+        return (None, "on_playstation_button_release", False)
+    elif event.share_pressed():
+        return ("share", "on_share_press", False)
+    elif event.share_released():
+        return (None, "on_share_release", False)
+    elif event.R3_pressed():
+        return ("R3", "on_R3_press", False)
+    elif event.R3_released():
+        return (None, "on_R3_release", False)
+    elif event.L3_pressed():
+        return ("L3", "on_L3_press", False)
+    elif event.L3_released():
+        return (None, "on_L3_release", False)
+    return None
+
+
+def build_dispatch_table(event_definition, connecting_using_ds4drv):
+    """
+    Build (or fetch the cached) table of handler names for a mapping.
+    :return: DICT {(button_type, button_id): TUPLE of resolve_event() results indexed by value class}
+    """
+    key = (event_definition, connecting_using_ds4drv)
+    table = _tables.get(key)
+    if table is not None:
+        return table
+    table = {}
+    for button_type in BUTTON_TYPES:
+        for button_id in BUTTON_IDS:
+            row = tuple(resolve_event(event_definition(button_id=button_id,
+                                                       button_type=button_type,
+                                                       value=value,
+                                                       connecting_using_ds4drv=connecting_using_ds4drv,
+                                                       overflow=(value, button_type, button_id)))
+                        for value in _VALUE_SAMPLES)
+            if any(row):
+                table[(button_type, button_id)] = row
+    _tables[key] = table
+    return table
+
+
+class DispatchTable:
+    """
+    Dispatch table bound to the handlers of one Controller instance, overridden actions are honoured.
+    """
+    def __init__(self, target, event_definition, connecting_using_ds4drv):
+        self._rows = {}
+        self.axis_keys = {}  # {(button_type, button_id): analog axis as in ds4_protocol}
+        for key, row in build_dispatch_table(event_definition, connecting_using_ds4drv).items():
+            self._rows[key] = tuple(self._bind(target, entry) for entry in row)
+            axes = set(AXIS_OF_CODE[EVENT_CODES[entry[1]]] for entry in row if entry is not None and entry[1])
+            axes.discard(None)
+            if axes:
+                self.axis_keys[key] = axes.pop()
+
+    @staticmethod
+    def _bind(target, entry):
+        if entry is None:
+            return None
+        history, name, with_value = entry
+        return (history, getattr(target, name) if name else None, with_value, EVENT_CODES[name] if name else 0)
+
+    def lookup(self, button_type, button_id, value):
+        """
+        :return: (history entry or None, bound handler or None, BOOLEAN whether the value is passed,
+                  INT event code as in ds4_protocol) or None
+        """
+        row = self._rows.get((button_type, button_id))
+        if row is None:
+            return None
+        return row[value_class(value)]
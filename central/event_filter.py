@@ -0,0 +1,80 @@
+from ds4_protocol import AXIS_L2, AXIS_L3_X, AXIS_L3_Y, AXIS_R2, AXIS_R3_X, AXIS_R3_Y
+
+STICK_AXES = (AXIS_L3_X, AXIS_L3_Y, AXIS_R3_X, AXIS_R3_Y)
+TRIGGER_AXES = (AXIS_L2, AXIS_R2)
+
+AXIS_MIN = -32767
+AXIS_MAX = 32767
+
+
+class AxisFilter:
+    """
+    Filter of one analog axis, applied to raw js values before they are dispatched.
+    Values inside the deadzone snap to the rest position, so the at_rest/release events still fire.
+    A value that moved less than min_delta from the last dispatched one is suppressed, except a return to rest.
+    """
+    def __init__(self, rest=0, deadzone=0, min_delta=0, step=0):
+        """
+        :param rest: INT, value of the axis when it is let go, 0 for sticks and -32767 for triggers
+        :param deadzone: INT, distance from rest treated as rest
+        :param min_delta: INT, smallest change that is dispatched
+        :param step: INT, quantization step counted from rest, 0 disables quantization
+        """
+        self.rest = rest
+        self.deadzone = deadzone
+        self.min_delta = min_delta
+        self.step = step
+        self.last = rest
+        self.suppressed = 0
+
+    def filter(self, value):
+        """:return: INT, value to dispatch or None if the event is suppressed"""
+        rest = self.rest
+        offset = value - rest
+        if -self.deadzone <= offset <= self.deadzone:
+            value = rest
+        elif self.step > 1:
+            value = rest + (offset + self.step // 2) // self.step * self.step
+            value = AXIS_MIN if value < AXIS_MIN else AXIS_MAX if value > AXIS_MAX else value
+        last = self.last
+        if value == last or (value != rest and -self.min_delta < value - last < self.min_delta):
+            self.suppressed += 1
+            return None
+        self.last = value
+        return value
+
+
+class EventFilter:
+    """
+    Per controller filtering stage in front of dispatch.
+    e.g. EventFilter({axis: dict(deadzone=2048, min_delta=256) for axis in STICK_AXES})
+    """
+    def __init__(self, config):
+        """
+        :param config: DICT {axis: DICT of AxisFilter arguments}, axes as in ds4_protocol (AXIS_L3_X, ...).
+                       rest defaults to the rest position of the axis.
+        """
+        self.config = config
+        self.axes = {}
+        for axis, params in config.items():
+            params = dict(params)
+            params.setdefault("rest", AXIS_MIN if axis in TRIGGER_AXES else 0)
+            self.axes[axis] = AxisFilter(**params)
+        self._filters = {}
+
+    def bind(self, axis_keys):
+        """
+        :param axis_keys: DICT {(button_type, button_id): axis} of the mapping in use
+        """
+        self._filters = {key: self.axes[axis] for key, axis in axis_keys.items() if axis in self.axes}
+
+    def filter(self, button_type, button_id, value):
+        """:return: INT, value to dispatch or None if the event is suppressed"""
+        axis_filter = self._filters.get((button_type, button_id))
+        if axis_filter is None:
+            return value
+        return axis_filter.filter(value)
+
+    @property
+    def suppressed(self):
+        return sum(axis_filter.suppressed for axis_filter in self.axes.values())
@@ -0,0 +1,88 @@
+import asyncio
+import signal
+import sys
+import time
+from array import array
+
+from ds4_protocol import EVENT_NAMES
+
+# record kinds
+DISPATCH = 1    # a: event code, b: value
+NOTIFY = 2      # a: payload length, b: first byte
+BUTTONS = 3     # a: pressed button mask
+LINK = 4        # a: 1 connected / 0 disconnected
+KINDS = ("", "dispatch", "notify", "buttons", "link")
+
+
+class EventRecorder:
+    """
+    Fixed-size in-memory ring of compact debug records (time, kind, a, b).
+    Recording is a few array stores and never touches stdout; records are formatted only when drained,
+    by a background task or on a signal, so debug visibility costs close to nothing while nobody reads it.
+    """
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self._time = array("q", bytes(8 * capacity))
+        self._kind = array("b", bytes(capacity))
+        self._a = array("q", bytes(8 * capacity))
+        self._b = array("q", bytes(8 * capacity))
+        self._next = 0
+        self._drained = 0
+        self._task = None
+
+    def record(self, kind, a=0, b=0):
+        slot = self._next % self.capacity
+        self._time[slot] = time.monotonic_ns()
+        self._kind[slot] = kind
+        self._a[slot] = a
+        self._b[slot] = b
+        self._next += 1
+
+    @property
+    def lost(self):
+        """records overwritten before they were drained"""
+        return max(0, self._next - self.capacity - self._drained)
+
+    def drain(self):
+        """:return: list of (time_ns, kind, a, b) recorded since the last drain, oldest first"""
+        first = max(self._drained, self._next - self.capacity)
+        records = []
+        for n in range(first, self._next):
+            slot = n % self.capacity
+            records.append((self._time[slot], self._kind[slot], self._a[slot], self._b[slot]))
+        self._drained = self._next
+        return records
+
+    @staticmethod
+    def format(record):
+        (time_ns, kind, a, b) = record
+        if kind == DISPATCH:
+            text = "{} {}".format(EVENT_NAMES[a] if 0 <= a < len(EVENT_NAMES) else a, b)
+        elif kind == NOTIFY:
+            text = "{} bytes, first 0x{:02x}".format(a, b)
+        elif kind == BUTTONS:
+            text = bin(a)
+        else:
+            text = "{} {}".format(a, b)
+        return "{:.6f} {} {}".format(time_ns / 1e9, KINDS[kind] if 0 < kind < len(KINDS) else kind, text)
+
+    def dump(self, file=None):
+        file = file if file is not None else sys.stderr
+        for record in self.drain():
+            file.write(self.format(record) + "\n")
+        file.flush()
+
+    def install_signal(self, signum=signal.SIGUSR1):
+        """Dump the ring to stderr on a signal, e.g. kill -USR1 <pid>"""
+        asyncio.get_running_loop().add_signal_handler(signum, self.dump)
+
+    async def run(self, path, interval=1.0):
+        """Append the records to a file every interval seconds"""
+        with open(path, "a") as f:
+            while True:
+                await asyncio.sleep(interval)
+                self.dump(f)
+
+    def start(self, path, interval=1.0):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run(path, interval))
@@ -0,0 +1,64 @@
+import json
+import os
+
+GATT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "ble_ds4_to_ctr_device", "gatt.json")
+
+
+class GattCache:
+    """
+    Resolved UART characteristics per peripheral address, kept in memory and optionally in a json file.
+    An entry is {"tx": uuid, "tx_handle": handle, "rx": uuid, "rx_handle": handle}.
+    """
+    def __init__(self, path=None):
+        """
+        :param path: STRING, json file the cache is loaded from and saved to, None keeps it in memory only
+        """
+        self.path = path
+        self._entries = {}
+        if path is not None:
+            try:
+                with open(path) as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+
+    def get(self, address):
+        return self._entries.get(address)
+
+    def put(self, address, tx, rx):
+        """
+        :param tx: BleakGATTCharacteristic, notify characteristic
+        :param rx: BleakGATTCharacteristic, write characteristic
+        """
+        self._entries[address] = {"tx": str(tx.uuid), "tx_handle": tx.handle,
+                                  "rx": str(rx.uuid), "rx_handle": rx.handle}
+        self._save()
+
+    def invalidate(self, address):
+        if self._entries.pop(address, None) is not None:
+            self._save()
+
+    def resolve(self, address, services):
+        """
+        Look the cached characteristics up in the services of the current connection.
+        :return: (tx, rx) BleakGATTCharacteristic, None if there is no entry or it does not match the services
+        """
+        entry = self._entries.get(address)
+        if entry is None:
+            return None
+        tx = services.get_characteristic(entry["tx_handle"])
+        rx = services.get_characteristic(entry["rx_handle"])
+        if tx is None or rx is None or str(tx.uuid) != entry["tx"] or str(rx.uuid) != entry["rx"]:
+            self.invalidate(address)
+            return None
+        return (tx, rx)
+
+    def _save(self):
+        if self.path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w") as f:
+                json.dump(self._entries, f)
+        except OSError as e:
+            print("could not save gatt cache: {}".format(e))
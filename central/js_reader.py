@@ -0,0 +1,116 @@
+import asyncio
+import os
+import select
+import struct
+
+_WOULD_BLOCK = object()
+
+
+class JoystickReader:
+    """
+    Non-blocking reader for the legacy joystick interface (/dev/input/jsN).
+    The file descriptor is registered with the running event loop only while there is nothing to read,
+    so waiting for the next event never freezes bleak's notification callbacks or pending writes.
+    Every wakeup drains all queued events into a preallocated buffer and decodes them in one pass.
+    """
+    def __init__(self, interface, event_format="3Bh2b", max_events=64):
+        """
+        :param interface: STRING aka /dev/input/js0, or any path that yields raw js events (pipe, fifo)
+        :param event_format: STRING, struct format of a single event
+        :param max_events: INT, how many events can be drained per wakeup
+        """
+        self.interface = interface
+        self.event_format = event_format
+        self._struct = struct.Struct(event_format)
+        self.event_size = self._struct.size
+        self._buffer = bytearray(self.event_size * max_events)
+        self._view = memoryview(self._buffer)
+        self._carry = b""
+        self._fd = -1
+
+    def open(self):
+        self._fd = os.open(self.interface, os.O_RDONLY | os.O_NONBLOCK)
+
+    def close(self):
+        if self._fd < 0:
+            return
+        os.close(self._fd)
+        self._fd = -1
+
+    def fileno(self):
+        return self._fd
+
+    async def _wait_readable(self):
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+
+        def on_readable():
+            if not waiter.done():
+                waiter.set_result(None)
+
+        loop.add_reader(self._fd, on_readable)
+        try:
+            await waiter
+        finally:
+            loop.remove_reader(self._fd)
+
+    def _drain(self):
+        """:return: memoryview of the queued events, None at end of file, _WOULD_BLOCK if no complete event is queued"""
+        size = self.event_size
+        pending = len(self._carry)
+        if pending:
+            self._buffer[:pending] = self._carry
+            self._carry = b""
+        try:
+            n = os.readv(self._fd, [self._view[pending:]])
+        except BlockingIOError:
+            if pending:
+                self._carry = bytes(self._view[:pending])
+            return _WOULD_BLOCK
+        if n == 0:
+            return None
+        n += pending
+        used = n - n % size
+        if used != n:
+            # pipes may split an event, keep the tail for the next read
+            self._carry = bytes(self._view[used:n])
+        if used:
+            return self._view[:used]
+        return _WOULD_BLOCK
+
+    async def read_buffer(self):
+        """
+        Wait for at least one complete event and return everything that is queued, undecoded.
+        The returned view is the internal buffer, consume it before reading again.
+        :return: memoryview of whole events, or None when the interface reached end of file
+        :raises OSError: when the device is gone (e.g. ENODEV after the controller disconnected)
+        """
+        while True:
+            data = self._drain()
+            if data is not _WOULD_BLOCK:
+                return data
+            await self._wait_readable()
+
+    async def read(self):
+        """
+        Wait for at least one complete event and decode everything that is queued.
+        The returned iterator is backed by the internal buffer, consume it before calling read() again.
+        :return: iterator of event tuples, or None when the interface reached end of file
+        :raises OSError: when the device is gone (e.g. ENODEV after the controller disconnected)
+        """
+        data = await self.read_buffer()
+        return None if data is None else self._struct.iter_unpack(data)
+
+    def read_sync(self, timeout=None):
+        """
+        Blocking variant of read() for a reader thread, waits at most timeout seconds.
+        :return: list of event tuples, empty after the timeout, or None when the interface reached end of file
+        :raises OSError: when the device is gone
+        """
+        data = self._drain()
+        if data is _WOULD_BLOCK:
+            select.select((self._fd,), (), (), timeout)
+            data = self._drain()
+            if data is _WOULD_BLOCK:
+                return []
+        return None if data is None else list(self._struct.iter_unpack(data))
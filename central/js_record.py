@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Record raw js event streams and replay them into a FIFO, so the input path can be exercised without a controller.
+usage: python3 js_record.py record /dev/input/js0 FILE [seconds]
+       python3 js_record.py replay FILE FIFO [speed]    speed 1.0 is real time, 0 replays as fast as possible
+The replayed FIFO is read like a js device, e.g. python3 main.py --interface=/tmp/js_replay
+"""
+
+import asyncio
+import os
+import struct
+import sys
+import time
+
+MAGIC = b"JSRC"
+VERSION = 1
+_HEADER = struct.Struct("<4sB8s")  # magic, version, event format padded with NUL
+_BATCH = struct.Struct("<QH")      # ns since the start of the recording, number of events that follow
+
+
+def write_header(f, event_format):
+    f.write(_HEADER.pack(MAGIC, VERSION, event_format.encode()))
+
+
+def save(path, event_format, batches):
+    """
+    :param batches: iterable of (ns since start, BYTES of whole events)
+    """
+    size = struct.calcsize(event_format)
+    with open(path, "wb") as f:
+        write_header(f, event_format)
+        for (time_ns, data) in batches:
+            f.write(_BATCH.pack(time_ns, len(data) // size))
+            f.write(data)
+
+
+def load(path):
+    """
+    :return: (STRING event format, list of (ns since start, BYTES of whole events))
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    (magic, version, event_format) = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("{} is not a js recording".format(path))
+    event_format = event_format.rstrip(b"\0").decode()
+    size = struct.calcsize(event_format)
+    batches = []
+    offset = _HEADER.size
+    while offset + _BATCH.size <= len(data):
+        (time_ns, count) = _BATCH.unpack_from(data, offset)
+        offset += _BATCH.size
+        batches.append((time_ns, data[offset:offset + count * size]))
+        offset += count * size
+    return (event_format, batches)
+
+
+async def _readable(fd):
+    loop = asyncio.get_running_loop()
+    waiter = loop.create_future()
+    loop.add_reader(fd, waiter.set_result, None)
+    try:
+        await waiter
+    finally:
+        loop.remove_reader(fd)
+
+
+async def _writable(fd):
+    loop = asyncio.get_running_loop()
+    waiter = loop.create_future()
+    loop.add_writer(fd, waiter.set_result, None)
+    try:
+        await waiter
+    finally:
+        loop.remove_writer(fd)
+
+
+async def record(interface, path, event_format="3Bh2b", duration=None):
+    """
+    Copy the events of interface into a recording, every read is stored as one batch with its arrival time.
+    Stops at end of file, when the device is gone or after duration seconds.
+    :return: INT, number of events recorded
+    """
+    size = struct.calcsize(event_format)
+    fd = os.open(interface, os.O_RDONLY | os.O_NONBLOCK)
+    start = time.monotonic_ns()
+    deadline = None if duration is None else start + int(duration * 1e9)
+    events = 0
+    carry = b""
+    try:
+        with open(path, "wb") as f:
+            write_header(f, event_format)
+            while deadline is None or time.monotonic_ns() < deadline:
+                try:
+                    data = os.read(fd, 64 * size)
+                except BlockingIOError:
+                    remaining = None if deadline is None else (deadline - time.monotonic_ns()) / 1e9
+                    try:
+                        await asyncio.wait_for(_readable(fd), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                    continue
+                except OSError:
+                    break
+                if not data:
+                    break
+                now = time.monotonic_ns()
+                data = carry + data
+                used = len(data) - len(data) % size
+                carry = data[used:]
+                if used:
+                    f.write(_BATCH.pack(now - start, used // size))
+                    f.write(data[:used])
+                    events += used // size
+    finally:
+        os.close(fd)
+    return events
+
+
+class Replayer:
+    """
+    Writes the batches of a recording into a FIFO at their recorded pace, scaled, or as fast as the reader drains.
+    The FIFO is created under a temporary name and opened for writing before it is moved in place,
+    so a reader waiting for the path never sees end of file before the first event.
+    """
+    def __init__(self, path, batches, speed=1.0):
+        """
+        :param path: STRING, FIFO to create, an existing file there is replaced
+        :param batches: list of (ns since start, BYTES of whole events), see load()
+        :param speed: FLOAT, 2.0 replays twice as fast as recorded, 0 ignores the timestamps
+        """
+        self.path = path
+        self.batches = batches
+        self.speed = speed
+        self._fd = -1
+        self.bytes_written = 0
+
+    def open(self):
+        temporary = "{}.{}.tmp".format(self.path, os.getpid())
+        os.mkfifo(temporary)
+        # O_RDWR does not wait for a reader, and keeps the FIFO from reporting end of file until close()
+        self._fd = os.open(temporary, os.O_RDWR | os.O_NONBLOCK)
+        os.replace(temporary, self.path)
+
+    def close(self):
+        if self._fd < 0:
+            return
+        os.close(self._fd)
+        self._fd = -1
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    async def _write(self, data):
+        view = memoryview(data)
+        while view:
+            try:
+                n = os.write(self._fd, view)
+            except BlockingIOError:
+                await _writable(self._fd)
+                continue
+            view = view[n:]
+            self.bytes_written += n
+
+    async def run(self):
+        """Replay every batch, then close the FIFO so the reader sees end of file"""
+        if self._fd < 0:
+            self.open()
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            if self.speed:
+                for (time_ns, data) in self.batches:
+                    delay = start + time_ns / 1e9 / self.speed - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    await self._write(data)
+            else:
+                await self._write(b"".join(data for (_, data) in self.batches))
+        finally:
+            self.close()
+
+
+def main():
+    args = sys.argv[1:]
+    if len(args) >= 3 and args[0] == "record":
+        duration = float(args[3]) if len(args) > 3 else None
+        count = asyncio.run(record(args[1], args[2], duration=duration))
+        print("recorded {} events to {}".format(count, args[2]))
+    elif len(args) >= 3 and args[0] == "replay":
+        (event_format, batches) = load(args[1])
+        replayer = Replayer(args[2], batches, float(args[3]) if len(args) > 3 else 1.0)
+        print("replaying {} ({}) into {}".format(args[1], event_format, args[2]))
+        asyncio.run(replayer.run())
+        print("replayed {} bytes".format(replayer.bytes_written))
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
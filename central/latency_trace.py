@@ -0,0 +1,156 @@
+import time
+from array import array
+
+# trace points of one input event, in the order they happen
+KERNEL = 0          # js event timestamp, mapped onto the monotonic clock
+READ = 1            # the batch holding the event was read
+DISPATCH_START = 2
+DISPATCH_END = 3
+ENQUEUE = 4         # a frame of the event was handed to send()
+WRITE_DONE = 5      # write_gatt_char carrying the frame completed
+STAGES = ("kernel", "read", "dispatch_start", "dispatch_end", "enqueue", "write_done")
+
+# intervals reported as histograms: (name, from stage, to stage)
+INTERVALS = (
+    ("kernel->read", KERNEL, READ),
+    ("read->dispatch", READ, DISPATCH_START),
+    ("dispatch", DISPATCH_START, DISPATCH_END),
+    ("enqueue->write", ENQUEUE, WRITE_DONE),
+    ("read->write", READ, WRITE_DONE),
+    ("kernel->write", KERNEL, WRITE_DONE),
+)
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram of microsecond values in the spirit of HdrHistogram.
+    Values below 2^bits are counted exactly, above that every power of two is split in 2^(bits-1) buckets,
+    so the relative error stays below 2^(1-bits) (about 3% with the default 6 bits) up to ~71 minutes.
+    """
+    def __init__(self, bits=6, max_exponent=32):
+        self.bits = bits
+        self._sub = 1 << bits
+        self._half = 1 << (bits - 1)
+        self._counts = array("q", bytes(8 * (self._sub + (max_exponent - bits + 1) * self._half)))
+        self.count = 0
+        self.max = 0
+
+    def _index(self, value):
+        if value < self._sub:
+            return value
+        shift = value.bit_length() - self.bits
+        return self._sub + (shift - 1) * self._half + (value >> shift) - self._half
+
+    def _value(self, index):
+        """lowest value counted in bucket index"""
+        if index < self._sub:
+            return index
+        shift, top = divmod(index - self._sub, self._half)
+        return (top + self._half) << (shift + 1)
+
+    def record(self, value):
+        if value < 0:
+            value = 0
+        index = self._index(value)
+        if index >= len(self._counts):
+            index = len(self._counts) - 1
+        self._counts[index] += 1
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        if self.count == 0:
+            return 0
+        rank = max(1, int(self.count * percent / 100.0 + 0.5))
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                return min(self._value(index), self.max)
+        return self.max
+
+    def reset(self):
+        for index in range(len(self._counts)):
+            self._counts[index] = 0
+        self.count = 0
+        self.max = 0
+
+
+class LatencyTracer:
+    """
+    Per event trace points kept in a preallocated ring, intervals accumulated in histograms.
+    Recording is a few array stores; reports and trace files are produced on demand.
+    """
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self._ring = array("q", bytes(8 * capacity * len(STAGES)))
+        self._next = 0
+        self.histograms = {name: LatencyHistogram() for (name, _, _) in INTERVALS}
+        self._kernel_offset = None  # smallest (read - kernel timestamp) seen, in ns
+        self._last_kernel_ms = 0
+
+    def begin(self, kernel_ms, read_ns):
+        """
+        Start the record of one event.
+        The js timestamp runs on jiffies, it is mapped onto the monotonic clock through the smallest read delay
+        observed, so kernel->read is the delay in excess of the fastest read.
+        :param kernel_ms: INT, js event time in ms (24 significant bits)
+        :param read_ns: INT, time.monotonic_ns() when the event was read
+        :return: INT, slot of the record
+        """
+        slot = self._next % self.capacity
+        self._next += 1
+        # unwrap the 24-bit millisecond counter
+        kernel_ms = self._last_kernel_ms + ((kernel_ms - self._last_kernel_ms) & 0xFFFFFF)
+        self._last_kernel_ms = kernel_ms
+        offset = read_ns - kernel_ms * 1000000
+        if self._kernel_offset is None or offset < self._kernel_offset:
+            self._kernel_offset = offset
+        base = slot * len(STAGES)
+        ring = self._ring
+        ring[base + KERNEL] = kernel_ms * 1000000 + self._kernel_offset
+        ring[base + READ] = read_ns
+        ring[base + DISPATCH_START] = 0
+        ring[base + DISPATCH_END] = 0
+        ring[base + ENQUEUE] = 0
+        ring[base + WRITE_DONE] = 0
+        return slot
+
+    def stamp(self, slot, stage, now_ns=None):
+        if slot < 0:
+            return
+        base = slot * len(STAGES)
+        ring = self._ring
+        if ring[base + stage] and stage == ENQUEUE:
+            return  # an event sending several frames is traced through its first one
+        ring[base + stage] = time.monotonic_ns() if now_ns is None else now_ns
+        if stage == DISPATCH_END:
+            self._record(base, 0, 3)
+        elif stage == WRITE_DONE:
+            self._record(base, 3, 6)
+
+    def _record(self, base, first, last):
+        ring = self._ring
+        for (name, start, end) in INTERVALS[first:last]:
+            if ring[base + start] and ring[base + end]:
+                self.histograms[name].record((ring[base + end] - ring[base + start]) // 1000)
+
+    def report(self):
+        lines = ["{:16} {:>9} {:>9} {:>9} {:>9} {:>9}".format("interval (us)", "count", "p50", "p99", "p99.9", "max")]
+        for (name, _, _) in INTERVALS:
+            histogram = self.histograms[name]
+            lines.append("{:16} {:>9} {:>9} {:>9} {:>9} {:>9}".format(
+                name, histogram.count, histogram.percentile(50), histogram.percentile(99),
+                histogram.percentile(99.9), histogram.max))
+        return "\n".join(lines)
+
+    def write_trace(self, path):
+        """Write the records still in the ring as csv, one event per line, ns of the monotonic clock"""
+        stages = len(STAGES)
+        first = max(0, self._next - self.capacity)
+        with open(path, "w") as f:
+            f.write(",".join(STAGES) + "\n")
+            for n in range(first, self._next):
+                base = (n % self.capacity) * stages
+                f.write(",".join(str(v) for v in self._ring[base:base + stages]) + "\n")
@@ -0,0 +1,59 @@
+"""
+Link parameters of the connection to the peripheral: ATT MTU and connection interval.
+The peripheral asks for its MTU in the MTU exchange and advertises its preferred connection interval in the
+scan response (peripheral/ble_simple_peripheral.py), the central decides both.
+"""
+
+import os
+
+DEBUGFS = "/sys/kernel/debug/bluetooth"
+DEFAULT_MTU = 23
+
+
+async def acquire_mtu(client):
+    """
+    Effective ATT MTU of a connected client. BlueZ exchanges the MTU when connecting, but bleak reports the default
+    until it acquires the write-without-response characteristic once, so the services have to be resolved before.
+    :param client: BleakClient or ble_transport.Transport
+    :return: INT, the MTU, DEFAULT_MTU if it is not known
+    """
+    acquire = getattr(getattr(client, "_backend", None), "_acquire_mtu", None)
+    if acquire is not None:
+        try:
+            await acquire()
+        except Exception as e:
+            print("MTU of {} not acquired: {}".format(client.address, e))
+            return DEFAULT_MTU
+    return client.mtu_size or DEFAULT_MTU
+
+
+def connection_interval(client):
+    """:return: FLOAT, seconds between connection events of a connected client, None if it is not known (BlueZ)"""
+    return getattr(client, "connection_interval", None)
+
+
+def set_connection_interval(min_ms, max_ms=None, adapter="hci0"):
+    """
+    Set the connection interval range BlueZ requests for new LE connections, through the kernel's debugfs,
+    which needs root. Connections in place keep their interval, bleak has no API for it.
+    :param min_ms: FLOAT, shortest interval, 7.5 ms is the minimum of the specification
+    :param max_ms: FLOAT, longest interval, defaults to min_ms
+    :param adapter: STRING, HCI adapter
+    :return: BOOLEAN, whether the range was applied
+    """
+    if max_ms is None:
+        max_ms = min_ms
+    # in units of 1.25 ms
+    values = {"conn_min_interval": int(min_ms * 4 / 5), "conn_max_interval": int(max_ms * 4 / 5)}
+    directory = os.path.join(DEBUGFS, adapter)
+    # the kernel rejects min > max, in one of the two orders both writes succeed
+    for order in (("conn_min_interval", "conn_max_interval"), ("conn_max_interval", "conn_min_interval")):
+        try:
+            for name in order:
+                with open(os.path.join(directory, name), "w") as f:
+                    f.write(str(values[name]))
+            return True
+        except OSError as e:
+            error = e
+    print("could not set the connection interval: {}".format(error))
+    return False
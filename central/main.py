@@ -1,123 +1,209 @@
 #!/usr/bin/env python3
 
+import os
 import sys
 import asyncio
 import time
 from ble_central import Controller
 from ble_discover import *
+from ds4_protocol import EVENT_CODES, FrameEncoder
+from evdev_reader import motion_sensor_node
+from event_filter import EventFilter, STICK_AXES, TRIGGER_AXES
+from event_recorder import EventRecorder
+from gatt_cache import GATT_CACHE, GattCache
+from latency_trace import LatencyTracer
+from link_params import set_connection_interval
+from metrics import parse_address
+from motion_sensor import MotionSensor
+from multi_controller import ControllerGroup, run_sharded
+from pipeline import Pipeline
 
-args = sys.argv
- 
-if(len(args) < 2):
-    js_num = str(0)
-else:
-    js_num = args[1]
+args = [a for a in sys.argv if not a.startswith("--")]
+options = [a for a in sys.argv if a.startswith("--")]
+
+# every argument is a js number, optionally bound to its peripheral by address or advertised name,
+# e.g. main.py 0=AA:BB:CC:DD:EE:FF "1=Pico Terminal 2". Without a binding the default target is paired.
+# A comma separated list fans one controller out to several peripherals: main.py "0=Pico A,Pico B"
+bindings = [tuple(a.split("=", 1)) if "=" in a else (a, None) for a in args[1:]] or [("0", None)]
+js_num = bindings[0][0]
+
+# --trace prints input latency histograms on exit, --trace=FILE also writes the raw trace points
+trace = next((o for o in options if o == "--trace" or o.startswith("--trace=")), None)
+# events are recorded in memory, kill -USR1 <pid> dumps them to stderr, --record=FILE appends them every second
+record = next((o.split("=", 1)[1] for o in options if o.startswith("--record=")), None)
+# --interface=PATH reads another js device or a FIFO fed by js_record.py replay (single controller only)
+interface = next((o.split("=", 1)[1] for o in options if o.startswith("--interface=")), "/dev/input/js" + js_num)
+# --workers=N spreads the controllers over N processes, --report=SECONDS prints per controller stats
+workers = int(next((o.split("=", 1)[1] for o in options if o.startswith("--workers=")), 1))
+report = next((float(o.split("=", 1)[1]) for o in options if o.startswith("--report=")), None)
+# --snapshot=SECONDS sends the state of all buttons and axes at that interval instead of every event
+snapshot = next((float(o.split("=", 1)[1]) for o in options if o.startswith("--snapshot=")), None)
+# --conn_interval=MIN_MS[,MAX_MS] sets the connection interval BlueZ asks for (root, through debugfs)
+conn_interval = next((o.split("=", 1)[1] for o in options if o.startswith("--conn_interval=")), None)
+# --pipeline runs reads, decoding and dispatch as stages with bounded queues, --pipeline=thread reads on a thread
+pipeline = next((o for o in options if o == "--pipeline" or o.startswith("--pipeline=")), None)
+# --metrics=PORT|PATH serves Prometheus metrics on localhost:PORT or the Unix socket PATH, +N / .N per worker
+metrics = next((o.split("=", 1)[1] for o in options if o.startswith("--metrics=")), None)
+# --motion[=RATE] sends the orientation from the gyro and accelerometer, RATE frames per second (default 50, numpy)
+motion = next((o.split("=", 1)[1] if "=" in o else "50" for o in options
+               if o == "--motion" or o.startswith("--motion=")), None)
+
+def is_address(peripheral):
+    return len(peripheral) == 17 and peripheral.count(":") == 5
 
 class WirelessController():
     class MyController(Controller):
-        _pressed = 0b0000000000000000
-        def __init__(self, **kwargs):
-            Controller.__init__(self, **kwargs)
+        # button combos and the method each one runs, see combo_engine.ComboEngine
+        COMBOS = (
+            {"buttons": ["share", "options", "circle"], "trigger": "circle", "callback": "toggle_connect"},
+            {"buttons": ["share", "L1", "circle"], "trigger": "circle", "callback": "activate"},
+        )
+
+        def __init__(self, peripheral=None, **kwargs):
+            Controller.__init__(self, combos=[dict(combo, callback=getattr(self, combo["callback"]))
+                                              for combo in self.COMBOS], **kwargs)
+            self.peripheral = peripheral
+            # sequence numbers let the acks of the peripheral report delivery and loss
+            self._encoder = FrameEncoder(sequence=True)
+
+        async def send_event(self, name, value=0):
+            # in snapshot sync mode the controller sends the state, events are not sent one by one
+            if self.snapshot is None:
+                await self.send(self._encoder.encode(EVENT_CODES[name], value))
 
-        # share_press + options_press + circle_press
+        # share + options, then circle
         async def toggle_connect(self):
-            if (self._pressed & 0b1100000000000000) != 0b1100000000000000:
+            if self.link is None:
                 return
-            if self._ble is None:
-                return
-            if self._ble.is_connected:
-                print("disconnect")
-                await self._ble.disconnect()
-            else:
+            if self.link.paused:
                 print("connect")
-                await self._ble.connect()
+                for link in self.links.values():
+                    link.supervisor.resume()
+            else:
+                print("disconnect")
+                for link in self.links.values():
+                    await link.supervisor.pause()
 
-        # share_press + L1_press + circle_press
+        # share + L1, then circle
         async def activate(self):
-            if (self._pressed & 0b0110000000000000) != 0b0110000000000000:
-                return
-            if self._ble is not None:
+            if self.link is not None:
                 return
-            address = await get_address()
-            if address.__eq__(""):
-                print("not found target")
-                return
-            await self.pair(address)            
+            if self.peripheral is None:
+                peripherals = [await get_address()]
+            else:
+                peripherals = self.peripheral.split(",")
+            for peripheral in peripherals:
+                if is_address(peripheral):
+                    address = peripheral
+                else:
+                    # several peripherals are around, only the bound name matches and it keeps its own cache
+                    address = await get_address(peripheral, cache_path=ADDRESS_CACHE + "." + peripheral,
+                                                match_service=False)
+                if address.__eq__(""):
+                    print("not found target {}".format(peripheral))
+                    continue
+                await self.pair(address)
 
         # Implementation if any input is received.
         # Example
         # ---
         async def on_circle_press(self):
             await super().on_circle_press()
-            eventname = sys._getframe().f_code.co_name
-            await self.send(eventname.encode('utf-8'))
-            await self.activate()
-            await self.toggle_connect()
+            await self.send_event("on_circle_press")
 
         async def on_R2_press(self,value):
             await super().on_R2_press(value)
-            eventname = sys._getframe().f_code.co_name
-            await self.send(eventname.encode('utf-8'))
-            await self.send("{}".format(value).encode('utf-8'))
+            await self.send_event("on_R2_press", value)
 
         async def on_L2_press(self,value):
             await super().on_L2_press(value)
-            eventname = sys._getframe().f_code.co_name
-            await self.send(eventname.encode('utf-8'))
-            await self.send("{}".format(value).encode('utf-8'))
+            await self.send_event("on_L2_press", value)
 
         async def on_L1_press(self):
-            self._pressed = self._pressed | 0b0010000000000000
-            print(bin(self._pressed))
             await super().on_L1_press()
-            eventname = sys._getframe().f_code.co_name
-            await self.send(eventname.encode('utf-8'))
+            await self.send_event("on_L1_press")
 
         async def on_L1_release(self):
-            self._pressed = self._pressed ^ 0b0010000000000000
-            print(bin(self._pressed))
             await super().on_L1_release()
-            eventname = sys._getframe().f_code.co_name
-            await self.send(eventname.encode('utf-8'))
+            await self.send_event("on_L1_release")
         
         async def on_share_press(self):
-            self._pressed = self._pressed | 0b0100000000000000
-            print(bin(self._pressed))
             await super().on_share_press()
-            eventname = sys._getframe().f_code.co_name
-            await self.send(eventname.encode('utf-8'))
+            await self.send_event("on_share_press")
 
         async def on_share_release(self):
-            self._pressed = self._pressed ^ 0b0100000000000000
-            print(bin(self._pressed))
             await super().on_share_release()
-            eventname = sys._getframe().f_code.co_name
-            await self.send(eventname.encode('utf-8'))          
+            await self.send_event("on_share_release")
 
         async def on_options_press(self):
-            self._pressed = self._pressed | 0b1000000000000000
-            print(bin(self._pressed))
             await super().on_options_press()
-            eventname = sys._getframe().f_code.co_name
-            await self.send(eventname.encode('utf-8'))
+            await self.send_event("on_options_press")
 
         async def on_options_release(self):
-            self._pressed = self._pressed ^ 0b1000000000000000
-            print(bin(self._pressed))
             await super().on_options_release()
-            eventname = sys._getframe().f_code.co_name
-            await self.send(eventname.encode('utf-8'))
+            await self.send_event("on_options_release")
             
         async def on_playstation_button_press(self):
             await super().on_playstation_button_press()
-            eventname = sys._getframe().f_code.co_name
-            await self.send(eventname.encode('utf-8'))
+            await self.send_event("on_playstation_button_press")
             self.stop = True
         # ---
 
+    recorder = None
+    gatt_cache = None
+
+    def create(self, binding):
+        (js, peripheral) = binding
+        # one recorder and gatt cache per process, created in its event loop
+        if self.recorder is None:
+            self.gatt_cache = GattCache(GATT_CACHE)
+            self.recorder = EventRecorder()
+            self.recorder.install_signal()
+            if record is not None:
+                self.recorder.start(record)
+        # ignore stick jitter around center and 1-LSB trigger noise
+        filters = {axis: dict(deadzone=2048, min_delta=256) for axis in STICK_AXES}
+        filters.update({axis: dict(deadzone=256, min_delta=256) for axis in TRIGGER_AXES})
+        tracer = LatencyTracer() if trace else None
+        js_interface = interface if len(bindings) == 1 else "/dev/input/js" + js
+        sensor = None
+        if motion is not None:
+            # the motion sensors are a separate evdev node of the same controller, it has to be connected already
+            node = motion_sensor_node(js_interface)
+            if node is None:
+                print("No motion sensors found for {}".format(js_interface))
+            else:
+                sensor = MotionSensor(node, rate=float(motion))
+        return self.MyController(interface=js_interface,
+                                 peripheral=peripheral, connecting_using_ds4drv=False,
+                                 event_filter=EventFilter(filters), gatt_cache=self.gatt_cache,
+                                 tracer=tracer, recorder=self.recorder, track_acks=True,
+                                 snapshot_interval=snapshot, send_interval=0.015 if snapshot is None else None,
+                                 pipeline=Pipeline(reader_thread=pipeline == "--pipeline=thread") if pipeline else None,
+                                 motion=sensor)
+
     async def listen(self):
-        controller = self.MyController(interface="/dev/input/js" + js_num, connecting_using_ds4drv=False)
-        await controller.listen()
+        controllers = [self.create(binding) for binding in bindings]
+        await ControllerGroup(controllers, report_interval=report,
+                              metrics=parse_address(metrics) if metrics is not None else None).run()
+        for controller in controllers:
+            if controller.tracer is not None:
+                print(controller.interface)
+                print(controller.tracer.report())
+                if "=" in trace:
+                    path = trace.split("=", 1)[1]
+                    if len(controllers) > 1:
+                        path += "." + os.path.basename(controller.interface)
+                    controller.tracer.write_trace(path)
+
+    def run(self):
+        if conn_interval is not None:
+            set_connection_interval(*(float(ms) for ms in conn_interval.split(",")))
+        if workers > 1 and len(bindings) > 1:
+            run_sharded(self.create, bindings, workers, report_interval=report or 10.0,
+                        metrics=(lambda worker: parse_address(metrics, worker)) if metrics is not None else None)
+        else:
+            asyncio.run(self.listen())
 
-ds4 = WirelessController()
-asyncio.run(ds4.listen())
\ No newline at end of file
+if __name__ == '__main__':
+    WirelessController().run()
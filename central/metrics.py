@@ -0,0 +1,193 @@
+"""
+Live metrics of the central in the Prometheus text format.
+The hot path only increments the plain counters the Controller, its links and their send queues keep anyway,
+a scrape renders their stats() on demand. MetricsServer answers HTTP GET /metrics on localhost or on a Unix socket
+from the running event loop, a scrape takes as long as one stats report and never waits for the input.
+    curl http://127.0.0.1:9100/metrics
+    curl --unix-socket /run/ds4_central.sock http://localhost/metrics
+"""
+
+import asyncio
+import os
+
+from ds4_protocol import AXIS_L2, AXIS_OF_CODE, AXIS_R2, EVENT_NAMES
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _event_class(code):
+    name = EVENT_NAMES[code]
+    axis = AXIS_OF_CODE[code]
+    if not name:
+        return "other"
+    if axis in (AXIS_L2, AXIS_R2):
+        return "trigger"
+    if axis is not None:
+        return "stick"
+    if "arrow" in name:
+        return "dpad"
+    return "button"
+
+
+# class of the button of every event code
+EVENT_CLASS_OF_CODE = tuple(_event_class(code) for code in range(len(EVENT_NAMES)))
+EVENT_CLASSES = ("button", "dpad", "stick", "trigger", "other")
+
+
+def count_by_class(per_code):
+    """
+    :param per_code: list of INT, count per event code
+    :return: DICT {class: count}, classes as in EVENT_CLASSES
+    """
+    counts = dict.fromkeys(EVENT_CLASSES, 0)
+    for code, count in enumerate(per_code):
+        counts[EVENT_CLASS_OF_CODE[code]] += count
+    return counts
+
+
+# (name, type, help, key in the stats)
+_CONTROLLER_METRICS = (
+    ("ds4_input_connected", "gauge", "1 while the js interface is open.", "input"),
+    ("ds4_events_read_total", "counter", "Events read from the js interface, blacklisted ones excluded.", "events"),
+    ("ds4_events_filtered_total", "counter", "Events suppressed by the event filter.", "filtered"),
+    ("ds4_motion_samples_total", "counter", "Samples read from the motion sensors.", "motion samples"),
+    ("ds4_motion_frames_total", "counter", "Motion frames sent.", "motion frames"),
+)
+_LINK_METRICS = (
+    ("ds4_link_connected", "gauge", "1 while the link to the peripheral is connected.", "connected"),
+    ("ds4_link_reconnects_total", "counter", "Reconnections after the link was lost.", "reconnects"),
+    ("ds4_link_outage_seconds_total", "counter", "Seconds the link was down after it was lost.", "total_outage"),
+    ("ds4_link_mtu", "gauge", "Negotiated ATT MTU.", "mtu"),
+    ("ds4_send_queue_frames", "gauge", "Frames waiting in the send queue.", "pending"),
+    ("ds4_frames_sent_total", "counter", "Frames written to the peripheral.", "sent"),
+    ("ds4_frames_coalesced_total", "counter", "Frames replaced by a newer position of their axis.", "coalesced"),
+    ("ds4_frames_dropped_total", "counter", "Frames dropped by the send queue or a failed write.", "dropped"),
+    ("ds4_writes_total", "counter", "Writes to the peripheral.", "writes"),
+    ("ds4_bytes_sent_total", "counter", "Bytes written to the peripheral.", "bytes"),
+    ("ds4_write_errors_total", "counter", "Writes that raised an error.", "write_errors"),
+    ("ds4_frames_lost_total", "counter", "Frames the acks of the peripheral report as lost.", "lost"),
+)
+_STAGE_METRICS = (
+    ("ds4_stage_queue_depth", "gauge", "Items waiting in the queue in front of a pipeline stage.", "depth"),
+    ("ds4_stage_dropped_total", "counter", "Items a pipeline stage queue dropped when it was full.", "dropped"),
+    ("ds4_stage_coalesced_total", "counter", "Items a pipeline stage queue replaced by a newer one.", "coalesced"),
+)
+
+
+def _labels(labels):
+    return ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                    for (name, value) in labels)
+
+
+def _value(value):
+    if value is True or value is False:
+        return "1" if value else "0"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render(stats):
+    """
+    :param stats: list of Controller.stats()
+    :return: STRING, the metrics in the Prometheus text format
+    """
+    # {name: (type, help, [(labels, value)])}, in the order of first appearance
+    families = {}
+
+    def add(name, kind, description, labels, value):
+        if value is None:
+            return
+        family = families.setdefault(name, (kind, description, []))
+        family[2].append((labels, value))
+
+    for s in stats:
+        controller = (("interface", s["interface"]),)
+        for (name, kind, description, key) in _CONTROLLER_METRICS:
+            add(name, kind, description, controller, s.get(key))
+        for (event_class, count) in s.get("dispatched", {}).items():
+            add("ds4_events_dispatched_total", "counter", "Events dispatched to an action, per button class.",
+                controller + (("class", event_class),), count)
+        for (stage, queue) in s.get("pipeline", {}).items():
+            for (name, kind, description, key) in _STAGE_METRICS:
+                add(name, kind, description, controller + (("stage", stage),), queue.get(key))
+        for link in s["links"]:
+            labels = controller + (("address", link["address"]),)
+            for (name, kind, description, key) in _LINK_METRICS:
+                add(name, kind, description, labels, link.get(key))
+
+    lines = []
+    for (name, (kind, description, samples)) in families.items():
+        lines.append("# HELP {} {}".format(name, description))
+        lines.append("# TYPE {} {}".format(name, kind))
+        for (labels, value) in samples:
+            lines.append("{}{{{}}} {}".format(name, _labels(labels), _value(value)))
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    HTTP endpoint of the metrics in the event loop of the controllers, GET /metrics renders them.
+    """
+    def __init__(self, collect, address, timeout=5.0):
+        """
+        :param collect: function object -> list of Controller.stats(), e.g. ControllerGroup.stats
+        :param address: INT port on 127.0.0.1, or STRING path of a Unix socket
+        :param timeout: FLOAT, seconds a client has to send its request
+        """
+        self._collect = collect
+        self.address = address
+        self.timeout = timeout
+        self._server = None
+        self.scrapes = 0
+
+    async def start(self):
+        if isinstance(self.address, int):
+            self._server = await asyncio.start_server(self._handle, "127.0.0.1", self.address)
+        else:
+            if os.path.exists(self.address):
+                # left behind by a previous run
+                os.unlink(self.address)
+            self._server = await asyncio.start_unix_server(self._handle, self.address)
+        print("Metrics on {}".format(self.address))
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.timeout)
+            (method, path) = request.split(b" ", 2)[:2]
+            if method != b"GET":
+                (status, body) = ("405 Method Not Allowed", b"")
+            elif path.split(b"?", 1)[0] != b"/metrics":
+                (status, body) = ("404 Not Found", b"")
+            else:
+                (status, body) = ("200 OK", render(self._collect()).encode())
+                self.scrapes += 1
+            writer.write("HTTP/1.0 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: close\r\n\r\n"
+                         .format(status, CONTENT_TYPE, len(body)).encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError,
+                ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def close(self):
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+        if not isinstance(self.address, int):
+            try:
+                os.unlink(self.address)
+            except FileNotFoundError:
+                pass
+
+
+def parse_address(value, worker=None):
+    """
+    :param value: STRING, a port or the path of a Unix socket
+    :param worker: INT, index of the worker process, each gets its own port (+ index) or path (.index)
+    :return: INT port or STRING path
+    """
+    if value.isdigit():
+        return int(value) + (worker or 0)
+    return value if worker is None else "{}.{}".format(value, worker)
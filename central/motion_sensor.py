@@ -0,0 +1,278 @@
+"""
+Motion sensors of the DS4, accelerometer and gyroscope, streamed from their evdev node at up to 1 kHz and sent to the
+peripherals at a lower rate.
+The input_event records are decoded in numpy batches, a read costs a few array operations however many samples it
+holds. Every tick, the samples read since the previous one are reduced at once: the acceleration is averaged (a boxcar
+low-pass that also downsamples to the tick rate), the angular rate is integrated over the sensor timestamps. A first
+order low-pass at cutoff smooths the per tick values, and a complementary filter fuses the integrated rate with the
+tilt of the gravity vector into the orientation. Yaw has no reference and drifts.
+With the controller lying flat, gravity is reported on +Y: pitch turns about X, yaw about Y, roll about Z.
+numpy is only needed for the motion sensors: pip3 install numpy
+"""
+
+import asyncio
+import math
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from device_watcher import DeviceWatcher
+from ds4_protocol import FLAG_STATE, STATE_MOTION, VERSION
+from evdev_reader import (ABS_RX, ABS_X, EV_ABS, EV_MSC, EV_SYN, MSC_TIMESTAMP, SYN_DROPPED, SYN_REPORT,
+                          EvdevReader)
+
+_MOTION = struct.Struct("<BB9h")  # ds4_protocol.MOTION_FRAME_SIZE bytes
+# resolutions of the DS4 in hid-sony, used when the node does not report them (e.g. a FIFO)
+ACCEL_PER_G = 8192
+GYRO_PER_DEG_S = 1024
+# a gap in the samples longer than this is not integrated, e.g. after the controller reconnected
+_MAX_GAP_US = 100000
+# column of every channel in a decoded sample: 3 accel axes, 3 gyro axes, the sensor timestamp
+_CHANNELS = 7
+_TIMESTAMP = 6
+
+
+def _clamp16(value):
+    return max(-32768, min(32767, int(round(value))))
+
+
+def _wrap(angle):
+    """:return: FLOAT, angle in degrees wrapped to -180..180"""
+    return (angle + 180.0) % 360.0 - 180.0
+
+
+class MotionSensor:
+    """
+    Reads the motion sensor node and sends one motion frame (ds4_protocol STATE_MOTION) per tick.
+    self.orientation (pitch, roll, yaw in degrees), self.gyro (degree/s) and self.accel (g) hold the latest values.
+    """
+    def __init__(self, node, send=None, rate=50.0, cutoff=10.0, time_constant=0.5, max_events=1024):
+        """
+        :param node: STRING, evdev node of the motion sensors, see evdev_reader.motion_sensor_node()
+        :param send: coroutine function(bytes), sends one frame. The Controller passing the sensor binds its send.
+        :param rate: FLOAT, motion frames per second
+        :param cutoff: FLOAT, Hz, cutoff of the low-pass on the per tick values, None disables it
+        :param time_constant: FLOAT, seconds, how slowly the complementary filter trusts the gravity vector over the
+                              integrated rate, longer rejects more shaking, shorter corrects the gyro drift sooner
+        :param max_events: INT, input_event records drained per read
+        """
+        if numpy is None:
+            raise ImportError("the motion sensors need numpy: pip3 install numpy")
+        self.node = node
+        self._send = send
+        self.rate = rate
+        self.cutoff = cutoff
+        self.time_constant = time_constant
+        self.max_events = max_events
+        self._event = numpy.dtype([("sec", "l"), ("usec", "l"), ("type", "H"), ("code", "H"), ("value", "i")],
+                                  align=True)
+        self._tail = self._event_array(0)  # events of a report whose SYN_REPORT was not read yet
+        self._last = numpy.zeros(_CHANNELS, numpy.int64)  # latest value of every channel, evdev reports changes only
+        self._has_timestamp = False
+        self._last_time = None  # us of the previous sample
+        self._accel_per_g = ACCEL_PER_G
+        self._gyro_per_deg_s = GYRO_PER_DEG_S
+        # reduced samples since the previous tick
+        self._accel_sum = numpy.zeros(3)
+        self._angle_sum = numpy.zeros(3)  # integral of the rate, in raw units * us
+        self._time_sum = 0
+        self._count = 0
+
+        self.orientation = [0.0, 0.0, 0.0]
+        self.gyro = [0.0, 0.0, 0.0]
+        self.accel = [0.0, 0.0, 0.0]
+        self._filtered = False
+        self._tasks = ()
+
+        self.samples = 0
+        self.frames = 0
+        self.dropped = 0  # SYN_DROPPED, the kernel buffer overflowed
+        self.send_errors = 0
+
+    def _event_array(self, count):
+        return numpy.zeros(count, self._event)
+
+    def _resolutions(self, reader):
+        accel = reader.absinfo(ABS_X)
+        gyro = reader.absinfo(ABS_RX)
+        if accel is not None and accel[5]:
+            self._accel_per_g = accel[5]
+        if gyro is not None and gyro[5]:
+            self._gyro_per_deg_s = gyro[5]
+
+    def feed(self, data):
+        """
+        Decode a batch of input_event records and add the complete samples to the current tick
+        :param data: BYTES or memoryview, whole input_event records
+        """
+        events = numpy.frombuffer(data, self._event)
+        if len(self._tail):
+            events = numpy.concatenate((self._tail, events))
+        types = events["type"]
+        codes = events["code"]
+        values = events["value"].astype(numpy.int64)
+        is_syn = types == EV_SYN
+        self.dropped += int(numpy.count_nonzero(is_syn & (codes == SYN_DROPPED)))
+        is_end = is_syn & (codes == SYN_REPORT)
+        ends = numpy.flatnonzero(is_end)
+        count = len(ends)
+        if count == 0:
+            self._tail = events.copy()
+            return
+        used = ends[-1] + 1
+        self._tail = events[used:].copy()
+        (events, types, codes, values, is_end) = (events[:used], types[:used], codes[:used], values[:used],
+                                                  is_end[:used])
+        # sample of every event: the number of SYN_REPORTs before it
+        report = numpy.cumsum(is_end) - is_end
+        index = numpy.arange(used)
+        samples = numpy.empty((count, _CHANNELS), numpy.int64)
+        for channel in range(_CHANNELS):
+            if channel == _TIMESTAMP:
+                selected = (types == EV_MSC) & (codes == MSC_TIMESTAMP)
+            else:
+                selected = (types == EV_ABS) & (codes == ABS_X + channel)
+            # forward fill: every sample takes the latest event of the channel up to it
+            latest = numpy.full(count, -1)
+            numpy.maximum.at(latest, report[selected], index[selected])
+            latest = numpy.maximum.accumulate(latest)
+            samples[:, channel] = numpy.where(latest >= 0, values[numpy.maximum(latest, 0)], self._last[channel])
+            if channel == _TIMESTAMP and latest[-1] >= 0:
+                self._has_timestamp = True
+        self._last[:] = samples[-1]
+
+        if self._has_timestamp:
+            times = samples[:, _TIMESTAMP] & 0xFFFFFFFF
+        else:
+            times = events["sec"][ends].astype(numpy.int64) * 1000000 + events["usec"][ends]
+        previous = times[0] if self._last_time is None else self._last_time
+        steps = numpy.diff(times, prepend=previous)
+        if self._has_timestamp:
+            steps &= 0xFFFFFFFF
+        steps[steps > _MAX_GAP_US] = 0
+        self._last_time = int(times[-1])
+
+        self._accel_sum += samples[:, 0:3].sum(axis=0)
+        self._angle_sum += (samples[:, 3:6] * steps[:, None]).sum(axis=0)
+        self._time_sum += int(steps.sum())
+        self._count += count
+        self.samples += count
+
+    def tick(self, dt):
+        """
+        Reduce the samples since the previous tick into the latest values
+        :param dt: FLOAT, seconds since the previous tick
+        :return: BOOLEAN, whether there were new samples
+        """
+        if self._count == 0:
+            return False
+        accel = self._accel_sum / (self._count * self._accel_per_g)
+        angle = self._angle_sum / (self._gyro_per_deg_s * 1e6)  # degrees turned since the previous tick
+        gyro = angle * 1e6 / self._time_sum if self._time_sum else numpy.zeros(3)
+        self._accel_sum[:] = 0
+        self._angle_sum[:] = 0
+        self._time_sum = 0
+        self._count = 0
+
+        if self.cutoff and self._filtered:
+            alpha = dt / (dt + 1.0 / (2 * math.pi * self.cutoff))
+            accel = self.accel + alpha * (accel - self.accel)
+            gyro = self.gyro + alpha * (gyro - self.gyro)
+        self.accel = accel.tolist()
+        self.gyro = gyro.tolist()
+
+        (pitch, roll, yaw) = self.orientation
+        (ax, ay, az) = self.accel
+        (turn_x, turn_y, turn_z) = angle.tolist()
+        pitch = _wrap(pitch + turn_x)
+        yaw = _wrap(yaw + turn_y)
+        roll = _wrap(roll + turn_z)
+        norm = math.sqrt(ax * ax + ay * ay + az * az)
+        # the gravity vector only tells the tilt while the controller is not accelerated much
+        if 0.5 < norm < 1.5:
+            weight = dt / (self.time_constant + dt) if self._filtered else 1.0
+            pitch = _wrap(pitch + weight * _wrap(math.degrees(math.atan2(az, ay)) - pitch))
+            roll = _wrap(roll + weight * _wrap(math.degrees(math.atan2(-ax, ay)) - roll))
+        self.orientation = [pitch, roll, yaw]
+        self._filtered = True
+        return True
+
+    def frame(self):
+        """:return: BYTES, motion frame of the latest values"""
+        self.frames += 1
+        return _MOTION.pack((VERSION << 4) | FLAG_STATE, STATE_MOTION,
+                            *(_clamp16(angle * 100) for angle in self.orientation),
+                            *(_clamp16(rate * 10) for rate in self.gyro),
+                            *(_clamp16(g * 1000) for g in self.accel))
+
+    async def read(self):
+        """read the node until it reaches end of file, waiting for it while the controller is away"""
+        watcher = DeviceWatcher(self.node)
+        try:
+            while True:
+                await watcher.wait(present=True)
+                reader = EvdevReader(self.node, self.max_events)
+                try:
+                    reader.open()
+                    self._resolutions(reader)
+                    while True:
+                        data = await reader.read_buffer()
+                        if data is None:
+                            return
+                        self.feed(data)
+                except OSError:
+                    print("Motion sensors lost: {}".format(self.node))
+                    self._tail = self._event_array(0)
+                    self._last_time = None
+                    await watcher.wait(present=False, timeout=1.0)
+                finally:
+                    reader.close()
+        finally:
+            watcher.close()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / self.rate
+        next_tick = loop.time()
+        while True:
+            next_tick += interval
+            delay = next_tick - loop.time()
+            if delay < 0:
+                # fell behind, skip the missed ticks
+                next_tick = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+            if self.tick(interval) and self._send is not None:
+                try:
+                    await self._send(self.frame())
+                except Exception as e:
+                    # e.g. a write failing while the link flaps, the next tick sends the latest values again
+                    print("motion send failed: {}".format(e))
+                    self.send_errors += 1
+
+    def start(self, send=None):
+        """
+        :param send: coroutine function(bytes), sends the frames if none was given to the constructor
+        """
+        if self._send is None:
+            self._send = send
+        if not self._tasks:
+            loop = asyncio.get_running_loop()
+            self._tasks = (loop.create_task(self.read()), loop.create_task(self.run()))
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = ()
+
+    def stats(self):
+        return {
+            "motion samples": self.samples,
+            "motion frames": self.frames,
+            "motion dropped": self.dropped,
+            "motion send errors": self.send_errors,
+        }
@@ -0,0 +1,147 @@
+import asyncio
+import multiprocessing
+import queue
+import time
+
+from metrics import MetricsServer
+
+
+def format_stats(stats, interval=None, previous=None):
+    """
+    One line per controller.
+    :param stats: list of Controller.stats()
+    :param interval: FLOAT, seconds since previous, to report events/s
+    :param previous: DICT {interface: events} of the previous report
+    """
+    lines = []
+    for s in stats:
+        rate = ""
+        if interval and previous is not None and s["interface"] in previous:
+            rate = "{:.0f} events/s, ".format((s["events"] - previous[s["interface"]]) / interval)
+        line = "{}: {}{} events".format(s["interface"], rate, s["events"])
+        if "read->write us" in s:
+            line += ", read->write p50 {} us p99 {} us".format(*s["read->write us"])
+        lines.append(line)
+        for (stage, queue) in s.get("pipeline", {}).items():
+            lines.append("    {}: depth {} (max {}), {} dropped, {} coalesced".format(
+                stage, queue["depth"], queue["max depth"], queue["dropped"], queue["coalesced"]))
+        for link in s["links"]:
+            line = "    {}: {} ({} reconnects)".format(link["address"], "up" if link["connected"] else "down",
+                                                    link["reconnects"])
+            if "sent" in link:
+                line += ", {} frames sent, {} dropped".format(link["sent"], link["dropped"])
+            line += ", latency p50 {} us p99 {} us".format(*link["latency us"][:2])
+            lines.append(line)
+    return "\n".join(lines)
+
+
+class ControllerGroup:
+    """
+    Several Controllers listening in one event loop, each on its own js interface with its own peripheral link.
+    They share the process, the bleak / D-Bus connection and the event loop; a busy controller only delays
+    the others by the time it takes to dispatch one batch of events.
+    """
+    def __init__(self, controllers, report_interval=10.0, report=print, metrics=None):
+        """
+        :param controllers: list of Controller
+        :param report_interval: FLOAT, seconds between stats reports, None disables them
+        :param report: function object(STRING), receives the reports
+        :param metrics: INT port on localhost or STRING Unix socket path, serves the stats of the controllers in the
+                        Prometheus text format, see metrics.MetricsServer
+        """
+        self.controllers = controllers
+        self.report_interval = report_interval
+        self.report = report
+        self.metrics = MetricsServer(self.stats, metrics) if metrics is not None else None
+
+    def stats(self):
+        return [controller.stats() for controller in self.controllers]
+
+    async def _report(self):
+        previous = None
+        last = time.monotonic()
+        while True:
+            await asyncio.sleep(self.report_interval)
+            now = time.monotonic()
+            stats = self.stats()
+            self.report(format_stats(stats, now - last, previous))
+            previous = {s["interface"]: s["events"] for s in stats}
+            last = now
+
+    async def run(self, **listen_kwargs):
+        """Listen on every controller until all of them returned, or one of them raised"""
+        loop = asyncio.get_running_loop()
+        reporter = None
+        if self.report_interval:
+            reporter = loop.create_task(self._report())
+        if self.metrics is not None:
+            await self.metrics.start()
+        listening = [loop.create_task(controller.listen(**listen_kwargs)) for controller in self.controllers]
+        try:
+            if listening:
+                await asyncio.wait(listening, return_when=asyncio.FIRST_EXCEPTION)
+            for task in listening:
+                if task.done() and not task.cancelled() and task.exception() is not None:
+                    raise task.exception()
+        finally:
+            # no controller is closed while its listen() still runs
+            for task in listening:
+                task.cancel()
+            await asyncio.gather(*listening, return_exceptions=True)
+            if reporter is not None:
+                reporter.cancel()
+            if self.metrics is not None:
+                await self.metrics.close()
+            for controller in self.controllers:
+                await controller.close()
+
+
+def _worker(factory, specs, results, report_interval, metrics):
+    async def run():
+        group = ControllerGroup([factory(spec) for spec in specs], report_interval=None, metrics=metrics)
+        listening = asyncio.get_running_loop().create_task(group.run())
+        while not listening.done():
+            await asyncio.wait([listening], timeout=report_interval)
+            results.put(group.stats())
+        listening.result()
+
+    asyncio.run(run())
+
+
+def run_sharded(factory, specs, workers, report_interval=10.0, report=print, metrics=None):
+    """
+    Spread the controllers over worker processes, each running a ControllerGroup, for when one core saturates.
+    The workers are forked before any event loop exists, factory does not need to be picklable.
+    :param factory: function object(spec) -> Controller, called in the worker
+    :param specs: list of anything describing one controller, dealt out round robin
+    :param workers: INT, number of processes
+    :param metrics: function object(INT worker) -> metrics address of the worker's ControllerGroup, None serves none
+    :return: list of the last stats of every controller
+    """
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    processes = []
+    for n in range(min(workers, len(specs))):
+        process = context.Process(target=_worker, args=(factory, specs[n::workers], results, report_interval,
+                                                        metrics(n) if metrics is not None else None))
+        process.start()
+        processes.append(process)
+
+    latest = {}
+    previous = None
+    last = time.monotonic()
+    while any(process.is_alive() for process in processes) or not results.empty():
+        try:
+            for s in results.get(timeout=report_interval):
+                latest[s["interface"]] = s
+        except queue.Empty:
+            continue
+        now = time.monotonic()
+        if now - last >= report_interval * 0.9:
+            stats = list(latest.values())
+            report(format_stats(stats, now - last, previous))
+            previous = {s["interface"]: s["events"] for s in stats}
+            last = now
+    for process in processes:
+        process.join()
+    return list(latest.values())
@@ -0,0 +1,206 @@
+"""
+Staged input path of the Controller: reader -> decoder -> dispatcher -> sender.
+The reader hands the batches read from the js interface to the decoder, which filters the events and looks their
+actions up, the dispatcher runs the actions, whose frames go to the send queue of every link (the sender stage,
+send_queue.SendQueue). The stages run as tasks connected by bounded queues, a slow action or link no longer holds
+the reads back, what happens when a queue is full is up to its policy.
+"""
+
+import asyncio
+import concurrent.futures
+import threading
+import time
+from collections import deque
+
+BLOCK = "block"              # a full queue makes the producer wait
+DROP_OLDEST = "drop_oldest"  # a full queue discards its oldest item
+COALESCE = "coalesce"        # a queued item with the same key is replaced (latest wins), else as DROP_OLDEST
+
+
+class StageQueue:
+    """
+    Bounded queue between two stages of the pipeline, in a single event loop.
+    Items without a key are never coalesced. close() ends the stream, get() returns None once the queue is drained.
+    """
+    def __init__(self, name, max_items=256, policy=BLOCK):
+        """
+        :param name: STRING, name of the stage fed by the queue, used in the stats
+        :param max_items: INT, items that can be queued
+        :param policy: STRING, BLOCK, DROP_OLDEST or COALESCE
+        """
+        if policy not in (BLOCK, DROP_OLDEST, COALESCE):
+            raise ValueError("unknown policy {}".format(policy))
+        self.name = name
+        self.max_items = max_items
+        self.policy = policy
+        self._items = deque()  # [key, item]
+        self._keyed = {}       # {key: queued [key, item]}
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._closed = False
+
+        self.max_depth = 0
+        self.put_count = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.blocked = 0  # puts that waited for room
+
+    def reset(self):
+        self._items.clear()
+        self._keyed.clear()
+        self._readable.clear()
+        self._writable.set()
+        self._closed = False
+
+    def __len__(self):
+        return len(self._items)
+
+    def put_nowait(self, item, key=None):
+        """Queue the item, dropping the oldest one if the queue is full whatever the policy"""
+        self.put_count += 1
+        if key is not None and self.policy == COALESCE:
+            entry = self._keyed.get(key)
+            if entry is not None:
+                entry[1] = item
+                self.coalesced += 1
+                return
+        items = self._items
+        if len(items) >= self.max_items:
+            self.dropped += 1
+            self._forget(items.popleft())
+        entry = [key, item]
+        items.append(entry)
+        if key is not None and self.policy == COALESCE:
+            self._keyed[key] = entry
+        if len(items) > self.max_depth:
+            self.max_depth = len(items)
+        if len(items) >= self.max_items:
+            self._writable.clear()
+        self._readable.set()
+
+    async def put(self, item, key=None):
+        """Queue the item, with the BLOCK policy wait for room first"""
+        if self.policy == BLOCK and len(self._items) >= self.max_items:
+            self.blocked += 1
+            while len(self._items) >= self.max_items:
+                await self._writable.wait()
+        self.put_nowait(item, key)
+
+    def _forget(self, entry):
+        if entry[0] is not None and self._keyed.get(entry[0]) is entry:
+            del self._keyed[entry[0]]
+
+    def close(self):
+        self._closed = True
+        self._readable.set()
+
+    async def get(self):
+        """:return: the oldest item, None once the queue was closed and drained"""
+        items = self._items
+        while not items:
+            if self._closed:
+                return None
+            self._readable.clear()
+            await self._readable.wait()
+        entry = items.popleft()
+        self._forget(entry)
+        self._writable.set()
+        return entry[1]
+
+    def stats(self):
+        return {
+            "depth": len(self._items),
+            "max depth": self.max_depth,
+            "put": self.put_count,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "blocked": self.blocked,
+        }
+
+
+class ReaderThread:
+    """
+    Reader stage on a dedicated thread: blocking reads of a js_reader.JoystickReader, the batches are handed to the
+    event loop. Reads go on while the loop is busy, the policy of the queue decides what happens if it falls behind,
+    BLOCK holds the thread back.
+    """
+    def __init__(self, reader, queue, poll_interval=0.1):
+        """
+        :param reader: JoystickReader, opened
+        :param queue: StageQueue, receives (read ns, [event]) per batch and is closed at the end
+        :param poll_interval: FLOAT, seconds, how soon the thread notices stop()
+        """
+        self._reader = reader
+        self._queue = queue
+        self._poll_interval = poll_interval
+        self._loop = asyncio.get_running_loop()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="js reader", daemon=True)
+        self.error = None  # OSError that ended the reads, e.g. the device is gone
+
+    def start(self):
+        self._thread.start()
+
+    def _hand_over(self, batch):
+        if self._queue.policy != BLOCK:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, batch)
+            return
+        future = asyncio.run_coroutine_threadsafe(self._queue.put(batch), self._loop)
+        while True:
+            try:
+                future.result(self._poll_interval)
+                return
+            except concurrent.futures.TimeoutError:
+                if self._stopping.is_set():
+                    future.cancel()
+                    return
+
+    def _run(self):
+        try:
+            while not self._stopping.is_set():
+                events = self._reader.read_sync(self._poll_interval)
+                if events is None:
+                    break
+                if events:
+                    self._hand_over((time.monotonic_ns(), events))
+        except OSError as e:
+            self.error = e
+        try:
+            self._loop.call_soon_threadsafe(self._queue.close)
+        except RuntimeError:
+            # the event loop is closed already
+            pass
+
+    async def stop(self):
+        self._stopping.set()
+        await asyncio.to_thread(self._thread.join)
+
+
+class Pipeline:
+    """
+    Configuration and metrics of the staged input path, pass it to the Controller.
+    The read queue carries the batches from the reader to the decoder, the dispatch queue the looked up actions
+    from the decoder to the dispatcher. By default the reader waits for the decoder (the kernel buffers the events
+    meanwhile) and the dispatch queue keeps the latest position of every stick and trigger when the actions fall
+    behind, button events are never coalesced. The send queues of the links are the last stage.
+    """
+    def __init__(self, read_items=16, read_policy=BLOCK, dispatch_items=256, dispatch_policy=COALESCE,
+                 reader_thread=False):
+        """
+        :param read_items: INT, batches the read queue holds
+        :param read_policy: STRING, BLOCK, DROP_OLDEST or COALESCE (batches have no key, same as DROP_OLDEST)
+        :param dispatch_items: INT, events the dispatch queue holds
+        :param dispatch_policy: STRING, BLOCK, DROP_OLDEST or COALESCE
+        :param reader_thread: BOOLEAN, read on a dedicated thread instead of the event loop
+        """
+        self.read_queue = StageQueue("decoder", read_items, read_policy)
+        self.dispatch_queue = StageQueue("dispatcher", dispatch_items, dispatch_policy)
+        self.reader_thread = reader_thread
+
+    def reset(self):
+        self.read_queue.reset()
+        self.dispatch_queue.reset()
+
+    def stats(self):
+        return {queue.name: queue.stats() for queue in (self.read_queue, self.dispatch_queue)}
@@ -0,0 +1,197 @@
+import asyncio
+import time
+
+from ds4_protocol import frame_axis
+from latency_trace import WRITE_DONE
+
+
+DROP_NEWEST = "drop_newest"  # a full queue rejects new frames
+DROP_OLDEST = "drop_oldest"  # a full queue discards its oldest frame
+DISCARD = "discard"          # nothing is kept while the link is down
+
+
+class SendQueue:
+    """
+    Outbound scheduler between the input path and the radio.
+    Frames are queued without waiting for the link. On every tick the queue is flushed, frames are packed
+    into as few writes as the payload size allows. Until a flush, a newer position of an analog axis
+    replaces the queued one (latest value wins) unless a button edge was queued after it, button edges,
+    trigger presses and releases included, are always kept and stay in order.
+    While the link is down frames stay queued, up to max_frames, and are sent once it is back.
+    """
+    def __init__(self, write, payload_size=20, interval=0.015, max_frames=256, is_ready=None, policy=DROP_OLDEST,
+                 tracer=None, latency=None):
+        """
+        :param write: coroutine function(bytes) -> BOOLEAN, performs one write, returns False if the link is down
+        :param payload_size: INT or function object returning INT, max bytes of one write (ATT MTU - 3)
+        :param interval: FLOAT, seconds between flushes. Align it with the connection interval.
+        :param max_frames: INT, frames that can be queued, the policy decides what is dropped beyond it
+        :param is_ready: function object returning BOOLEAN, whether the link can be written to
+        :param policy: STRING, DROP_NEWEST, DROP_OLDEST or DISCARD
+        :param tracer: LatencyTracer, stamped with the completion of every write
+        :param latency: LatencyHistogram, records the us from put() to the completion of the write of every frame
+        """
+        self._write = write
+        self._payload_size = payload_size if callable(payload_size) else (lambda: payload_size)
+        self._is_ready = is_ready if is_ready is not None else (lambda: True)
+        self.interval = interval
+        self.max_frames = max_frames
+        self.policy = policy
+        self.tracer = tracer
+        self.latency = latency
+        self._pending = []
+        self._tokens = []  # trace slot of every pending frame
+        self._times = []   # put() time of every pending frame, when latency is recorded
+        self._axis_slots = {}
+        self._task = None
+
+        self.frames_queued = 0
+        self.frames_coalesced = 0
+        self.frames_packed = 0  # frames that shared a write with at least one other frame
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.writes = 0
+        self.bytes_sent = 0
+        self.write_errors = 0
+
+    def put(self, frame, token=-1):
+        """
+        :param frame: BYTES
+        :param token: INT, trace slot of the event the frame belongs to, -1 if it is not traced
+        """
+        self.frames_queued += 1
+        now = time.monotonic_ns() if self.latency is not None else 0
+        axis = frame_axis(frame)
+        if axis is not None:
+            slot = self._axis_slots.get(axis)
+            if slot is not None:
+                self._pending[slot] = frame
+                self._tokens[slot] = token
+                if now:
+                    self._times[slot] = now
+                self.frames_coalesced += 1
+                return
+        if len(self._pending) >= self.max_frames:
+            self.frames_dropped += 1
+            if self.policy != DROP_OLDEST:
+                return
+            self._drop_oldest()
+        if axis is not None:
+            self._axis_slots[axis] = len(self._pending)
+        else:
+            # nothing queued before a button edge is replaced, a newer position must not overtake the edge
+            self._axis_slots.clear()
+        self._pending.append(frame)
+        self._tokens.append(token)
+        if now:
+            self._times.append(now)
+
+    def _drop_oldest(self):
+        self._pending.pop(0)
+        self._tokens.pop(0)
+        if self._times:
+            self._times.pop(0)
+        for axis, slot in list(self._axis_slots.items()):
+            if slot == 0:
+                del self._axis_slots[axis]
+            else:
+                self._axis_slots[axis] = slot - 1
+
+    def clear(self):
+        self.frames_dropped += len(self._pending)
+        self._pending = []
+        self._tokens = []
+        self._times = []
+        self._axis_slots.clear()
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def flush(self):
+        if not self._pending:
+            return
+        if not self._is_ready():
+            if self.policy == DISCARD:
+                self.clear()
+            return
+        frames = self._pending
+        tokens = self._tokens
+        times = self._times
+        self._pending = []
+        self._tokens = []
+        self._times = []
+        self._axis_slots.clear()
+
+        limit = self._payload_size()
+        payload = bytearray()
+        first = 0
+        for index, frame in enumerate(frames):
+            if payload and len(payload) + len(frame) > limit:
+                await self._send(payload, tokens[first:index], times[first:index])
+                payload = bytearray()
+                first = index
+            payload += frame
+        await self._send(payload, tokens[first:], times[first:])
+
+    async def _send(self, payload, tokens, times):
+        count = len(tokens)
+        try:
+            written = await self._write(bytes(payload))
+        except Exception as e:
+            print("write failed: {}".format(e))
+            self.write_errors += 1
+            written = False
+        if not written:
+            self.frames_dropped += count
+            return
+        self.writes += 1
+        self.frames_sent += count
+        self.bytes_sent += len(payload)
+        if count > 1:
+            self.frames_packed += count
+        if self.tracer is not None or times:
+            now = time.monotonic_ns()
+            if self.tracer is not None:
+                for token in tokens:
+                    self.tracer.stamp(token, WRITE_DONE, now)
+            for put_time in times:
+                self.latency.record((now - put_time) // 1000)
+
+    async def run(self):
+        """Flush on a fixed tick, deadlines are absolute so the tick does not drift with write time"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            deadline += self.interval
+            now = loop.time()
+            if deadline < now:
+                deadline = now
+            await asyncio.sleep(deadline - now)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "queued": self.frames_queued,
+            "coalesced": self.frames_coalesced,
+            "packed": self.frames_packed,
+            "sent": self.frames_sent,
+            "dropped": self.frames_dropped,
+            "writes": self.writes,
+            "bytes": self.bytes_sent,
+            "write_errors": self.write_errors,
+        }
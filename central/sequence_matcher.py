@@ -0,0 +1,48 @@
+class SequenceMatcher:
+    """
+    Aho-Corasick automaton over the controller's event history entries ("up", "circle", "left_joystick" ...).
+    All registered sequences are compiled into one transition table, feeding an entry is a single lookup
+    no matter how many sequences there are, and the history itself does not need to be kept.
+    """
+    def __init__(self, sequences):
+        """
+        :param sequences: list, e.g [{"inputs": ['up', 'up', 'down', 'down'], "callback": () -> None}]
+        """
+        goto = [{}]
+        outputs = [[]]
+        for sequence in sequences:
+            if not sequence["inputs"]:
+                continue
+            state = 0
+            for entry in sequence["inputs"]:
+                if entry not in goto[state]:
+                    goto.append({})
+                    outputs.append([])
+                    goto[state][entry] = len(goto) - 1
+                state = goto[state][entry]
+            outputs[state].append(sequence["callback"])
+
+        # breadth first: complete every state's transitions with the ones of its failure state
+        transitions = [dict(goto[0])]
+        transitions.extend({} for _ in range(len(goto) - 1))
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for state in queue:
+            transitions[state] = dict(transitions[fail[state]])
+            transitions[state].update(goto[state])
+            outputs[state] = outputs[fail[state]] + outputs[state]
+            for entry, child in goto[state].items():
+                fail[child] = transitions[fail[state]].get(entry, 0)
+                queue.append(child)
+        self._transitions = transitions
+        self._outputs = [tuple(callbacks) for callbacks in outputs]
+        self._state = 0
+
+    def reset(self):
+        self._state = 0
+
+    def advance(self, entry):
+        """Feed one history entry, callbacks of every sequence ending with it are called"""
+        self._state = state = self._transitions[self._state].get(entry, 0)
+        for callback in self._outputs[state]:
+            callback()
@@ -0,0 +1,172 @@
+import asyncio
+import struct
+import time
+from array import array
+
+from ds4_protocol import (AXIS_COUNT, AXIS_OF_CODE, BUTTONS_OF_CODE, FLAG_STATE, STATE_DELTA, STATE_KEYFRAME,
+                          VERSION)
+
+STATE_HEADER = (VERSION << 4) | FLAG_STATE
+_KEYFRAME = struct.Struct("<BBBI{}h".format(AXIS_COUNT))
+KEYFRAME_SIZE = _KEYFRAME.size
+_DELTA_HEAD = struct.Struct("<BBBBB")
+_BUTTONS = struct.Struct("<I")
+_AXIS = struct.Struct("<h")
+# (buttons pressed, buttons released, axis) per event code
+_STATE_OF_CODE = tuple(buttons + (axis,) for buttons, axis in zip(BUTTONS_OF_CODE, AXIS_OF_CODE))
+
+
+class ControllerState:
+    """
+    Snapshot of the whole controller, kept up to date from the dispatched events:
+    a bit mask of the pressed buttons (bit n is ds4_protocol.BUTTON_NAMES[n]) and the latest value of every
+    analog axis (indexed by ds4_protocol.AXIS_*).
+    """
+    def __init__(self):
+        self.buttons = 0
+        self.axes = array("h", bytes(2 * AXIS_COUNT))
+
+    def apply(self, code, value):
+        """
+        :param code: INT, event code as in ds4_protocol
+        :param value: INT, int16 value of the event
+        :return: INT, the button mask before the event
+        """
+        (pressed, released, axis) = _STATE_OF_CODE[code]
+        if axis is not None:
+            self.axes[axis] = value
+        buttons = self.buttons
+        if pressed or released:
+            self.buttons = (buttons | pressed) & ~released
+        return buttons
+
+
+class SnapshotSync:
+    """
+    Snapshot sync mode: instead of one frame per event, the ControllerState is sent every interval,
+    so the bandwidth is bounded however bursty the input is.
+    Every keyframe_interval a keyframe carries the full state, in between delta frames carry what differs from
+    the last keyframe (buttons XOR, changed axes). A lost frame is healed by the next frame that reaches the
+    peripheral if it still has the keyframe, by the next keyframe otherwise. Nothing is sent while the state
+    stays as it was last sent, except the keyframes.
+    peripheral/ds4_protocol.py StateDecoder rebuilds the state.
+    """
+    def __init__(self, state, send, interval=0.02, keyframe_interval=0.5):
+        """
+        :param state: ControllerState, the snapshot to send
+        :param send: coroutine function(bytes), sends one frame, e.g. Controller.send
+        :param interval: FLOAT, seconds between snapshots
+        :param keyframe_interval: FLOAT, seconds between keyframes
+        """
+        self.state = state
+        self._send = send
+        self.interval = interval
+        self.keyframe_interval = keyframe_interval
+        self.sequence = 0
+        self._key_sequence = 0
+        self._key_buttons = 0
+        self._key_axes = array("h", bytes(2 * AXIS_COUNT))
+        self._next_keyframe = None
+        self._sent_buttons = 0
+        self._sent_axes = array("h", bytes(2 * AXIS_COUNT))
+        self._delta = bytearray(_DELTA_HEAD.size + _BUTTONS.size + _AXIS.size * AXIS_COUNT)
+        self._task = None
+
+        self.keyframes = 0
+        self.deltas = 0
+        self.unchanged = 0
+        self.bytes = 0
+        self.send_errors = 0
+
+    def _next_sequence(self):
+        sequence = self.sequence
+        self.sequence = (sequence + 1) & 0xFF
+        return sequence
+
+    def _keyframe(self, now):
+        state = self.state
+        self._key_sequence = self._next_sequence()
+        self._key_buttons = state.buttons
+        self._key_axes[:] = state.axes
+        self._next_keyframe = now + self.keyframe_interval
+        self.keyframes += 1
+        return _KEYFRAME.pack(STATE_HEADER, STATE_KEYFRAME, self._key_sequence, state.buttons, *state.axes)
+
+    def frame(self, now):
+        """:return: BYTES, the frame to send at monotonic time now, None if there is nothing to send"""
+        state = self.state
+        if self._next_keyframe is None or now >= self._next_keyframe:
+            frame = self._keyframe(now)
+        elif state.buttons == self._sent_buttons and state.axes == self._sent_axes:
+            self.unchanged += 1
+            return None
+        else:
+            delta = self._delta
+            size = _DELTA_HEAD.size
+            changed = 0
+            buttons = state.buttons ^ self._key_buttons
+            if buttons:
+                changed = 1
+                _BUTTONS.pack_into(delta, size, buttons)
+                size += _BUTTONS.size
+            for axis in range(AXIS_COUNT):
+                if state.axes[axis] != self._key_axes[axis]:
+                    changed |= 2 << axis
+                    _AXIS.pack_into(delta, size, state.axes[axis])
+                    size += _AXIS.size
+            if size >= KEYFRAME_SIZE:
+                # as large as the full state, renew the keyframe instead
+                frame = self._keyframe(now)
+            else:
+                _DELTA_HEAD.pack_into(delta, 0, STATE_HEADER, STATE_DELTA, self._next_sequence(),
+                                      self._key_sequence, changed)
+                frame = bytes(delta[:size])
+                self.deltas += 1
+        self._sent_buttons = state.buttons
+        self._sent_axes[:] = state.axes
+        self.bytes += len(frame)
+        return frame
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            frame = self.frame(time.monotonic())
+            if frame is not None:
+                try:
+                    await self._send(frame)
+                except Exception as e:
+                    # e.g. a write failing while the link flaps, the next tick sends a keyframe to resync
+                    print("state send failed: {}".format(e))
+                    self.send_errors += 1
+                    self._next_keyframe = None
+            next_tick += self.interval
+            delay = next_tick - loop.time()
+            if delay < 0:
+                # fell behind, e.g. the link pushed back, skip the missed ticks
+                next_tick = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self):
+        return {
+            "keyframes": self.keyframes,
+            "deltas": self.deltas,
+            "unchanged": self.unchanged,
+            "state bytes": self.bytes,
+            "state send errors": self.send_errors,
+        }
@@ -0,0 +1,37 @@
+"""
+Tests of ack_tracker.AckTracker, run with python3 -m pytest in central/
+"""
+
+import struct
+
+from ack_tracker import AckTracker
+from ds4_protocol import (FLAG_STATE, MOTION_FRAME_SIZE, STATE_DELTA, STATE_KEYFRAME, STATE_MOTION, VERSION,
+                          FrameEncoder, state_frame_size)
+
+STATE_HEADER = (VERSION << 4) | FLAG_STATE
+
+
+def motion_frame():
+    return struct.pack("<BB9h", STATE_HEADER, STATE_MOTION, *range(9))
+
+
+def test_state_frame_sizes():
+    assert state_frame_size(motion_frame()) == MOTION_FRAME_SIZE
+    keyframe = struct.pack("<BBBI6h", STATE_HEADER, STATE_KEYFRAME, 0, 0, *range(6))
+    assert state_frame_size(keyframe) == len(keyframe)
+    # buttons and two axes changed
+    delta = struct.pack("<BBBBBI2h", STATE_HEADER, STATE_DELTA, 1, 0, 0b1011, 0, 1, 2)
+    assert state_frame_size(delta) == len(delta)
+    assert state_frame_size(delta[:-1]) == 0
+
+
+def test_frames_after_a_motion_frame_are_recorded():
+    encoder = FrameEncoder(sequence=True)
+    tracker = AckTracker()
+    tracker.on_write(motion_frame() + encoder.encode(1, 0) + encoder.encode(2, 0))
+    tracker.on_write(encoder.encode(3, 0) + motion_frame())
+    # frame 0 is the baseline, frame 1 never arrived
+    tracker.on_ack(1, 0)
+    tracker.on_ack(2, 2)
+    assert tracker.delivered == 1
+    assert tracker.lost == 1
@@ -0,0 +1,41 @@
+"""
+Tests of send_queue.SendQueue, run with python3 -m pytest in central/
+"""
+
+import asyncio
+
+from ds4_protocol import EVENT_CODES, FrameEncoder
+from send_queue import SendQueue
+
+
+def flushed(frames):
+    """:return: list of (code, value) of the frames, in the order a flush writes them"""
+    written = []
+
+    async def write(payload):
+        written.append(payload)
+        return True
+
+    queue = SendQueue(write, payload_size=512)
+    for frame in frames:
+        queue.put(frame)
+    asyncio.run(queue.flush())
+    data = b"".join(written)
+    return [(data[i + 1], int.from_bytes(data[i + 2:i + 4], "little", signed=True)) for i in range(0, len(data), 4)]
+
+
+def test_trigger_release_survives_a_burst_of_axis_frames():
+    encoder = FrameEncoder()
+    (press, release, right) = (EVENT_CODES["on_L2_press"], EVENT_CODES["on_L2_release"], EVENT_CODES["on_L3_right"])
+    frames = [encoder.encode(press, 100), encoder.encode(press, 200), encoder.encode(release, 0)]
+    frames += [encoder.encode(right, value) for value in range(1, 20)]
+    frames.append(encoder.encode(press, 300))
+    assert flushed(frames) == [(press, 100), (press, 200), (release, 0), (right, 19), (press, 300)]
+
+
+def test_axis_frames_do_not_overtake_a_button_edge():
+    encoder = FrameEncoder()
+    (x_press, right) = (EVENT_CODES["on_x_press"], EVENT_CODES["on_L3_right"])
+    frames = [encoder.encode(right, 1), encoder.encode(right, 2), encoder.encode(x_press, 0),
+              encoder.encode(right, 3), encoder.encode(right, 4)]
+    assert flushed(frames) == [(right, 2), (x_press, 0), (right, 4)]
@@ -0,0 +1,176 @@
+from bleak import uuids
+
+from ack_tracker import AckTracker
+from ble_link import LinkSupervisor
+from ds4_protocol import parse_ack
+from link_params import acquire_mtu, connection_interval
+from latency_trace import LatencyHistogram
+from send_queue import DROP_OLDEST, SendQueue
+
+
+class UartLink:
+    """
+    One peripheral of a Controller: the supervised connection, its UART characteristics and its own send queue.
+    Every link is flushed by its own writer task, a slow or flaky peripheral backs up (coalesces, then drops)
+    in its own queue and never holds back the writes to the others.
+    """
+    _MODEL_NUMBER_UUID = "00002a00-0000-1000-8000-00805f9b34fb"
+    _UART_UUID = "6E400001-B5A3-F393-E0A9-E50E24DCCA9E"
+
+    def __init__(self, address, gatt_cache, notification_handler, send_interval=0.015, send_buffer=256,
+                 outage_policy=DROP_OLDEST, tracer=None, read_model_number=False, transport=None, track_acks=False):
+        """
+        :param address: STRING, address of the peripheral
+        :param gatt_cache: GattCache, resolved UART characteristics per address
+        :param notification_handler: function object(sender, data), receives the notifications of the peripheral
+        :param send_interval: FLOAT, seconds between flushes of the send queue, None writes every frame right away
+        :param send_buffer: INT, frames the send queue keeps
+        :param outage_policy: STRING, what the send queue drops when it is full or the link is down
+        :param tracer: LatencyTracer, stamped with the writes of this link
+        :param read_model_number: BOOLEAN, read and print the model number characteristic on every connection
+        :param transport: function object creating the client, see ble_transport.Transport
+        :param track_acks: BOOLEAN, consume the acks of the peripheral and track delivery, loss and round trip
+        """
+        self.address = address
+        self.gatt_cache = gatt_cache
+        self.notification_handler = notification_handler
+        self.read_model_number = read_model_number
+        self.client = None
+        self.tx = ""
+        self.rx = ""
+        self.mtu = None                  # ATT MTU of the connection, once negotiated
+        self.connection_interval = None  # seconds, if the transport tells
+        self.latency = LatencyHistogram()  # us from send() to the completion of the write
+        self.acks = AckTracker() if track_acks else None
+        # writes of the link, reported when there is no send queue counting them
+        self.writes = 0
+        self.bytes_written = 0
+        self.write_errors = 0
+        self.frames_dropped = 0  # written while the link was not ready
+        self.supervisor = LinkSupervisor(address, self._on_connected, transport=transport)
+        self.send_queue = None
+        if send_interval is not None:
+            self.send_queue = SendQueue(self.write, payload_size=self.payload_size, interval=send_interval,
+                                        max_frames=send_buffer, is_ready=self.is_ready, policy=outage_policy,
+                                        tracer=tracer, latency=self.latency)
+
+    def discover_uart_uuid(self) -> bool:
+        if self.client is None:
+            return False
+        self.tx = ""
+        self.rx = ""
+        for s in self.client.services:
+                print(s)
+                if s.description.__eq__(uuids.uuidstr_to_str(self._UART_UUID)):
+                    for c in s.characteristics:
+                        for p in c.properties:
+                            if p.__eq__('notify'):
+                                self.tx = c
+                            elif p.__eq__('write'):
+                                self.rx = c
+        return self.tx != "" and self.rx != ""
+
+    def resolve_uart(self) -> bool:
+        """
+        Resolve the UART characteristics from the gatt cache, walk the services only if the cache does not validate
+        """
+        if self.client is None:
+            return False
+        cached = self.gatt_cache.resolve(self.client.address, self.client.services)
+        if cached is not None:
+            (self.tx, self.rx) = cached
+            return True
+        if not self.discover_uart_uuid():
+            return False
+        self.gatt_cache.put(self.client.address, self.tx, self.rx)
+        return True
+
+    async def start_notify(self):
+        if self.client is None:
+            return
+        if self.read_model_number:
+            model_number = await self.client.read_gatt_char(self._MODEL_NUMBER_UUID)
+            print("Model Number: {0}".format("".join(map(chr, model_number))))
+        if self.resolve_uart():
+            await self.client.start_notify(self.tx, self._on_notify)
+            await self.read_link_params()
+            await self.client.write_gatt_char(self.rx, data=b"Central is Rady\r\n")
+        else:
+            # the supervisor disconnects and retries, like a dropped link
+            raise ConnectionError("not found service: {0}".format(uuids.uuidstr_to_str(self._UART_UUID)))
+
+    async def read_link_params(self):
+        """read the negotiated MTU, payload_size() and the send queue adapt to it"""
+        self.mtu = await acquire_mtu(self.client)
+        self.connection_interval = connection_interval(self.client)
+        print("MTU {}, {} bytes per write{}".format(
+            self.mtu, self.mtu - 3, "" if self.connection_interval is None else
+            ", connection interval {:.2f} ms".format(self.connection_interval * 1000)))
+
+    def _on_notify(self, sender, data):
+        if self.acks is not None:
+            ack = parse_ack(data)
+            if ack is not None:
+                self.acks.on_ack(*ack)
+                return
+        self.notification_handler(sender, data)
+
+    async def _on_connected(self, client):
+        self.client = client
+        self.rx = ""
+        self.mtu = None
+        if self.acks is not None:
+            self.acks.reset()
+        await self.start_notify()
+
+    def payload_size(self) -> int:
+        if self.mtu is not None:
+            return self.mtu - 3
+        if self.client is None:
+            return 20
+        return self.client.mtu_size - 3
+
+    def is_ready(self) -> bool:
+        return self.client is not None and self.client.is_connected and self.rx != ""
+
+    async def write(self, data) -> bool:
+        if not self.is_ready():
+            self.frames_dropped += 1
+            return False
+        if self.acks is not None:
+            self.acks.on_write(data)
+        try:
+            await self.client.write_gatt_char(self.rx, data=data, response=False)
+        except Exception:
+            self.write_errors += 1
+            raise
+        self.writes += 1
+        self.bytes_written += len(data)
+        return True
+
+    def start(self):
+        self.supervisor.start()
+        if self.send_queue is not None:
+            self.send_queue.start()
+
+    async def close(self):
+        if self.send_queue is not None:
+            await self.send_queue.close()
+        await self.supervisor.close()
+
+    def stats(self):
+        stats = self.supervisor.stats()
+        stats["address"] = self.address
+        stats["mtu"] = self.mtu
+        if self.connection_interval is not None:
+            stats["interval ms"] = round(self.connection_interval * 1000, 2)
+        if self.send_queue is not None:
+            stats.update(self.send_queue.stats())
+        else:
+            # every frame is one write
+            stats.update({"sent": self.writes, "dropped": self.frames_dropped, "writes": self.writes,
+                          "bytes": self.bytes_written, "write_errors": self.write_errors})
+        stats["latency us"] = (self.latency.percentile(50), self.latency.percentile(99), self.latency.max)
+        if self.acks is not None:
+            stats.update(self.acks.stats())
+        return stats
@@ -16,6 +16,7 @@ _ADV_TYPE_UUID16_MORE = const(0x2)
 _ADV_TYPE_UUID32_MORE = const(0x4)
 _ADV_TYPE_UUID128_MORE = const(0x6)
 _ADV_TYPE_APPEARANCE = const(0x19)
+_ADV_TYPE_CONN_INTERVAL = const(0x12)
 
 
 # gap_advertise(adv_data=...) に渡すpayloadを生成
@@ -51,6 +52,13 @@ def advertising_payload(limited_disc=False, br_edr=False, name=None, services=No
     return payload
 
 
+# 希望する接続間隔 (Peripheral Connection Interval Range) の payload を生成。
+# アドバタイズの 31 バイトに収まらない場合があるため、スキャン応答 (resp_data) に入れる。
+def connection_interval_payload(min_ms, max_ms):
+    # 単位は 1.25ms
+    return struct.pack("<BBHH", 5, _ADV_TYPE_CONN_INTERVAL, int(min_ms * 4 / 5), int(max_ms * 4 / 5))
+
+
 def decode_field(payload, adv_type):
     i = 0
     result = []
@@ -1,15 +1,20 @@
 import bluetooth
+import micropython
 import random
 import struct
 import time
 import ubinascii
-from ble_advertising import advertising_payload
+from ble_advertising import advertising_payload, connection_interval_payload
 
 from micropython import const
 
 _IRQ_CENTRAL_CONNECT = const(1)
 _IRQ_CENTRAL_DISCONNECT = const(2)
 _IRQ_GATTS_WRITE = const(3)
+_IRQ_MTU_EXCHANGED = const(21)
+_IRQ_CONNECTION_UPDATE = const(27)
+
+_DEFAULT_MTU = const(23)
 
 _FLAG_READ = const(0x0002)
 _FLAG_WRITE_NO_RESPONSE = const(0x0004)
@@ -31,17 +36,46 @@ _UART_SERVICE = (
 )
 
 class BLESimplePeripheral:
-    def __init__(self, ble, name=''):
+    # rx_slots: IRQ から処理までの間に保持できる書き込みの数
+    # rx_slot_size: 1回の書き込みの最大バイト数 (これを超える書き込みは破棄される)。省略時は mtu - 3
+    # mtu: 希望する ATT MTU。接続後の MTU 交換で、セントラルの値と小さい方に決まる。
+    # interval_ms: 希望する接続間隔 (最小, 最大) ms。スキャン応答で通知し、決めるのはセントラル。
+    def __init__(self, ble, name='', rx_slots=16, rx_slot_size=None, mtu=185, interval_ms=(7.5, 15)):
         self._ble = ble
         self._ble.active(True)
+        self._ble.config(mtu=mtu)
         self._ble.irq(self._irq)
         ((self._handle_tx, self._handle_rx),) = self._ble.gatts_register_services((_UART_SERVICE,))
+        # キャラクタリスティックの値のバッファは既定で 20 バイトのため、MTU に合わせて拡張する。
+        # 拡張しないと 20 バイトを超える書き込みは切り捨てられる。
+        self._ble.gatts_set_buffer(self._handle_rx, mtu - 3)
         self._connections = set()
         self._write_callback = None
+        self.preferred_mtu = mtu
+        self._mtus = {}              # 接続ごとに交換した MTU
+        self.conn_interval_us = 0    # セントラルが決めた接続間隔 (不明の間は 0)
+        if rx_slot_size is None:
+            rx_slot_size = mtu - 3
+        # 受信リングバッファ。起動時に確保し、IRQ では書き込みをここへコピーするだけにする。
+        # コールバックは micropython.schedule で IRQ の外から呼ぶ。
+        # 1スロットは満杯と空を区別するために使わないため、rx_slots + 1 個確保する。
+        self._rx_slot_size = rx_slot_size
+        self._rx_buf = memoryview(bytearray((rx_slots + 1) * rx_slot_size))
+        self._rx_len = [0] * (rx_slots + 1)
+        self._rx_head = 0   # 次に書き込むスロット (IRQ 側のみ更新)
+        self._rx_tail = 0   # 次に処理するスロット (処理側のみ更新)
+        self._rx_scheduled = False
+        # IRQ 内でバウンドメソッドを生成しないよう、あらかじめ参照を保持する
+        self._process_rx_ref = self._process_rx
+        # 計測値
+        self.rx_writes = 0     # 受信した書き込みの数
+        self.rx_overflow = 0   # バッファが満杯で破棄した数
+        self.rx_oversize = 0   # rx_slot_size を超えて破棄した数
         if len(name) == 0:
             #name = 'Pico %s' % ubinascii.hexlify(self._ble.config('mac')[1],':').decode().upper()
             name = 'Pico Terminal'
         self._payload = advertising_payload(name=name, services=[_UART_UUID])
+        self._resp_payload = connection_interval_payload(*interval_ms) if interval_ms else None
         self._advertise()
 
     def _irq(self, event, data):
@@ -50,28 +84,122 @@ class BLESimplePeripheral:
             conn_handle, _, _ = data
             print("New connection", conn_handle)
             self._connections.add(conn_handle)
+            self._mtus[conn_handle] = _DEFAULT_MTU
+            # MTU の交換を要求する。セントラルから要求された場合も _IRQ_MTU_EXCHANGED で通知される。
+            try:
+                self._ble.gattc_exchange_mtu(conn_handle)
+            except OSError:
+                pass
         elif event == _IRQ_CENTRAL_DISCONNECT:
             conn_handle, _, _ = data
             print("Disconnected", conn_handle)
             self._connections.remove(conn_handle)
+            self._mtus.pop(conn_handle, None)
             # 新しい接続を許可するために、アドバタイズを再度開始。
             self._advertise()
         elif event == _IRQ_GATTS_WRITE:
             conn_handle, value_handle = data
-            value = self._ble.gatts_read(value_handle)
             if value_handle == self._handle_rx and self._write_callback:
-                self._write_callback(value)
+                self._rx_push(self._ble.gatts_read(value_handle))
+        elif event == _IRQ_MTU_EXCHANGED:
+            conn_handle, mtu = data
+            print("MTU", conn_handle, mtu)
+            self._mtus[conn_handle] = mtu
+        elif event == _IRQ_CONNECTION_UPDATE:
+            conn_handle, conn_interval, conn_latency, supervision_timeout, status = data
+            if status == 0:
+                # 単位は 1.25ms
+                self.conn_interval_us = conn_interval * 1250
 
-    def send(self, data):
+    # IRQ から呼ばれる。受信データをリングバッファにコピーし、処理を schedule する。
+    def _rx_push(self, value):
+        self.rx_writes += 1
+        n = len(value)
+        if n > self._rx_slot_size:
+            self.rx_oversize += 1
+            return
+        head = self._rx_head
+        next_head = head + 1
+        if next_head == len(self._rx_len):
+            next_head = 0
+        if next_head == self._rx_tail:
+            self.rx_overflow += 1
+        else:
+            start = head * self._rx_slot_size
+            self._rx_buf[start:start + n] = value
+            self._rx_len[head] = n
+            self._rx_head = next_head
+        if not self._rx_scheduled:
+            try:
+                micropython.schedule(self._process_rx_ref, None)
+                self._rx_scheduled = True
+            except RuntimeError:
+                # schedule のキューが満杯。メインループの poll_rx() で処理される。
+                pass
+
+    # バッファに溜まった書き込みを順にコールバックへ渡す。
+    # コールバックにはバッファの memoryview を渡すため、内容はコールバック内でのみ有効。
+    def _process_rx(self, _):
+        self._rx_scheduled = False
+        tail = self._rx_tail
+        while tail != self._rx_head:
+            start = tail * self._rx_slot_size
+            next_tail = tail + 1
+            if next_tail == len(self._rx_len):
+                next_tail = 0
+            try:
+                self._write_callback(self._rx_buf[start:start + self._rx_len[tail]])
+            finally:
+                self._rx_tail = tail = next_tail
+
+    # schedule できなかった書き込みを処理する。メインループから定期的に呼ぶ。
+    def poll_rx(self):
+        if self._rx_tail != self._rx_head and not self._rx_scheduled:
+            self._process_rx(None)
+
+    def rx_pending(self):
+        pending = self._rx_head - self._rx_tail
+        if pending < 0:
+            pending += len(self._rx_len)
+        return pending
+
+    def stats(self):
+        return {
+            "rx": self.rx_writes,
+            "rx_overflow": self.rx_overflow,
+            "rx_oversize": self.rx_oversize,
+            "rx_pending": self.rx_pending(),
+            "mtu": self.payload_size() + 3,
+            "interval_us": self.conn_interval_us,
+        }
+
+    # 1回の通知で送れる最大バイト数 (接続中の最小の MTU - 3)
+    def payload_size(self):
+        size = 0
         for conn_handle in self._connections:
-            self._ble.gatts_notify(conn_handle, self._handle_tx, data)
+            mtu = self._mtus.get(conn_handle, _DEFAULT_MTU)
+            if size == 0 or mtu - 3 < size:
+                size = mtu - 3
+        return size if size else _DEFAULT_MTU - 3
+
+    def send(self, data):
+        size = self.payload_size()
+        if len(data) <= size:
+            for conn_handle in self._connections:
+                self._ble.gatts_notify(conn_handle, self._handle_tx, data)
+            return
+        # MTU に収まらないデータは分割して通知する (そのままでは切り捨てられる)
+        for offset in range(0, len(data), size):
+            chunk = data[offset:offset + size]
+            for conn_handle in self._connections:
+                self._ble.gatts_notify(conn_handle, self._handle_tx, chunk)
 
     def is_connected(self):
         return len(self._connections) > 0
 
     def _advertise(self, interval_us=500000):
         print("Starting advertising")
-        self._ble.gap_advertise(interval_us, adv_data=self._payload)
+        self._ble.gap_advertise(interval_us, adv_data=self._payload, resp_data=self._resp_payload)
 
     def on_write(self, callback):
         self._write_callback = callback
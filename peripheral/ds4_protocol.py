@@ -0,0 +1,274 @@
+try:
+    from micropython import const
+except ImportError:
+    # CPython (テスト用)
+    def const(x):
+        return x
+
+# central/ds4_protocol.py で送信されるバイナリフレームのデコーダ。両ファイルは同期して更新すること。
+#    byte 0      header: version (上位4bit) | flags (下位4bit)
+#    byte 1      イベントコード (EVENT_NAMES を参照)
+#    byte 2-3    値, int16 little endian
+#    [byte]      シーケンス番号, uint8        (FLAG_SEQUENCE)
+#    [2 bytes]   タイムスタンプ(ms), uint16 LE  (FLAG_TIMESTAMP)
+# スナップショット同期モードでは、コントローラー全体の状態を FLAG_STATE の状態フレームで送信する。
+#    byte 0      header: version | FLAG_STATE
+#    byte 1      STATE_KEYFRAME / STATE_DELTA
+#    byte 2      シーケンス番号, uint8
+#    キーフレーム:
+#    byte 3-6    ボタン, uint32 LE (bit n が BUTTON_NAMES[n])
+#    byte 7-18   軸, AXIS_COUNT x int16 LE
+#    差分フレーム (指定したキーフレームに対する差分):
+#    byte 3      キーフレームのシーケンス番号
+#    byte 4      変化したフィールド: bit 0 ボタン, bit 1 + n 軸 n
+#    [4 bytes]   ボタン (キーフレームとの XOR), uint32 LE
+#    [2 bytes]   変化した軸の値, int16 LE (軸の順)
+#    モーションフレーム (central/motion_sensor.py, シーケンス番号なし・最新の値のみ有効):
+#    byte 1      STATE_MOTION
+#    byte 2-7    姿勢 pitch / roll / yaw, int16 LE (0.01 度)
+#    byte 8-13   角速度 x / y / z, int16 LE (0.1 度/秒)
+#    byte 14-19  加速度 x / y / z, int16 LE (mg)
+# ペリフェラルからの ACK も同じ形式で通知する (FLAG_SEQUENCE, コードは CODE_ACK)。
+# 値は受信したフレームの総数 (uint16, 折り返す)、シーケンス番号は最後に受信したフレームのもの。
+
+VERSION = const(1)
+FLAG_SEQUENCE = const(0x01)
+FLAG_TIMESTAMP = const(0x02)
+FLAG_STATE = const(0x08)
+STATE_KEYFRAME = const(0)
+STATE_DELTA = const(1)
+STATE_MOTION = const(2)
+MOTION_FRAME_SIZE = const(20)
+CODE_ACK = const(0xFF)
+AXIS_COUNT = const(6)
+
+# イベントコード。EVENT_NAMES のインデックスが送信されるコード。
+EVENT_NAMES = (
+    "",
+    "on_x_press", "on_x_release",
+    "on_triangle_press", "on_triangle_release",
+    "on_circle_press", "on_circle_release",
+    "on_square_press", "on_square_release",
+    "on_L1_press", "on_L1_release",
+    "on_L2_press", "on_L2_release",
+    "on_R1_press", "on_R1_release",
+    "on_R2_press", "on_R2_release",
+    "on_up_arrow_press", "on_up_down_arrow_release", "on_down_arrow_press",
+    "on_left_arrow_press", "on_left_right_arrow_release", "on_right_arrow_press",
+    "on_L3_up", "on_L3_down", "on_L3_left", "on_L3_right",
+    "on_L3_y_at_rest", "on_L3_x_at_rest", "on_L3_press", "on_L3_release",
+    "on_R3_up", "on_R3_down", "on_R3_left", "on_R3_right",
+    "on_R3_y_at_rest", "on_R3_x_at_rest", "on_R3_press", "on_R3_release",
+    "on_options_press", "on_options_release",
+    "on_share_press", "on_share_release",
+    "on_playstation_button_press", "on_playstation_button_release",
+)
+
+# 状態フレームのボタン。インデックスがボタンのビット
+BUTTON_NAMES = (
+    "x", "triangle", "circle", "square", "L1", "L2", "R1", "R2",
+    "up", "down", "left", "right", "L3", "R3", "options", "share", "playstation",
+)
+
+# flags ごとのフレーム長
+_FRAME_SIZES = (4, 5, 6, 7)
+
+
+def event_name(code):
+    if 0 < code < len(EVENT_NAMES):
+        return EVENT_NAMES[code]
+    return ""
+
+
+class FrameDecoder:
+    # 受信バッファから直接フィールドを読み出すため、デコード時にヒープを確保しない。
+    # 最後にデコードしたフレームの内容は code / value / sequence / timestamp に保持される。
+    def __init__(self):
+        self.code = 0
+        self.value = 0
+        self.sequence = -1
+        self.timestamp = -1
+
+    # buf の offset から1フレームをデコードし、次のフレームの offset を返す。
+    # フレームでない場合(バージョン不一致・長さ不足)は -1 を返す。
+    def decode(self, buf, offset=0):
+        if offset + 4 > len(buf):
+            return -1
+        header = buf[offset]
+        if header >> 4 != VERSION or header & FLAG_STATE:
+            return -1
+        end = offset + _FRAME_SIZES[header & 0x03]
+        if end > len(buf):
+            return -1
+        self.code = buf[offset + 1]
+        value = buf[offset + 2] | (buf[offset + 3] << 8)
+        self.value = value - 0x10000 if value & 0x8000 else value
+        offset += 4
+        if header & FLAG_SEQUENCE:
+            self.sequence = buf[offset]
+            offset += 1
+        else:
+            self.sequence = -1
+        if header & FLAG_TIMESTAMP:
+            self.timestamp = buf[offset] | (buf[offset + 1] << 8)
+        else:
+            self.timestamp = -1
+        return end
+
+
+class Acknowledger:
+    # 受信したフレームをまとめて確認応答する累積 ACK。
+    # フレームは every 個ごとに ACK し、それ以外はタイマーで flush する。ACK フレームは使い回すためヒープを確保しない。
+    def __init__(self, every=16):
+        self.every = every
+        self.total = 0        # 受信したフレームの総数 (16bit で折り返す)
+        self.sequence = 0     # 最後に受信したシーケンス番号
+        self._pending = 0     # 最後の ACK 以降に受信した数
+        self._frame = bytearray(5)
+        self._frame[0] = (VERSION << 4) | FLAG_SEQUENCE
+        self._frame[1] = CODE_ACK
+
+    # フレームを1つ受信した。ACK を送る時は True を返す。
+    def received(self, sequence):
+        self.total = (self.total + 1) & 0xFFFF
+        if sequence >= 0:
+            self.sequence = sequence
+        self._pending += 1
+        return self._pending >= self.every
+
+    def pending(self):
+        return self._pending > 0
+
+    # ACK フレームを返す。内容は次の呼び出しで上書きされる。
+    def frame(self):
+        self._pending = 0
+        frame = self._frame
+        frame[2] = self.total & 0xFF
+        frame[3] = self.total >> 8
+        frame[4] = self.sequence
+        return frame
+
+
+def _int16(buf, offset):
+    value = buf[offset] | (buf[offset + 1] << 8)
+    return value - 0x10000 if value & 0x8000 else value
+
+
+# ボタンは 17bit のため、上位バイトは常に 0 (small int のまま扱える)
+def _uint32(buf, offset):
+    return buf[offset] | (buf[offset + 1] << 8) | (buf[offset + 2] << 16) | (buf[offset + 3] << 24)
+
+
+def is_state_frame(buf, offset=0):
+    return offset < len(buf) and buf[offset] == (VERSION << 4) | FLAG_STATE
+
+
+def is_motion_frame(buf, offset=0):
+    return offset + 1 < len(buf) and is_state_frame(buf, offset) and buf[offset + 1] == STATE_MOTION
+
+
+class StateDecoder:
+    # スナップショット同期の状態フレームから、コントローラーの状態 (buttons / axes) を復元する。
+    # 差分フレームはキーフレームに対する差分のため、途中のフレームが失われても次に届いたフレームで復元できる。
+    # 基準のキーフレームを受信していない差分フレームは破棄し、次のキーフレームを待つ。
+    def __init__(self):
+        self.buttons = 0
+        self.axes = [0] * AXIS_COUNT
+        self.valid = False      # キーフレームを受信し、状態が確定しているか
+        self.changed = False    # 最後のフレームで状態が変化したか
+        self.sequence = -1
+        # 計測値
+        self.frames = 0
+        self.lost = 0           # シーケンス番号の欠番の数
+        self.stale = 0          # キーフレームが無く破棄した差分フレームの数
+        self._key_sequence = -1
+        self._key_buttons = 0
+        self._key_axes = [0] * AXIS_COUNT
+
+    # buf の offset から状態フレームを1つデコードし、次のフレームの offset を返す。
+    # 状態フレームでない場合・長さが足りない場合は -1 を返す。
+    def decode(self, buf, offset=0):
+        if offset + 5 > len(buf) or not is_state_frame(buf, offset):
+            return -1
+        kind = buf[offset + 1]
+        sequence = buf[offset + 2]
+        if kind == STATE_KEYFRAME:
+            end = offset + 7 + 2 * AXIS_COUNT
+        elif kind == STATE_DELTA:
+            changed = buf[offset + 4]
+            end = offset + 5
+            if changed & 1:
+                end += 4
+            for axis in range(AXIS_COUNT):
+                if changed & (2 << axis):
+                    end += 2
+        else:
+            return -1
+        if end > len(buf):
+            return -1
+
+        self.frames += 1
+        if self.sequence >= 0:
+            self.lost += (sequence - self.sequence - 1) & 0xFF
+        self.sequence = sequence
+        buttons = self.buttons
+        self.changed = False
+
+        if kind == STATE_KEYFRAME:
+            self._key_sequence = sequence
+            self._key_buttons = _uint32(buf, offset + 3)
+            self.buttons = self._key_buttons
+            for axis in range(AXIS_COUNT):
+                value = _int16(buf, offset + 7 + 2 * axis)
+                self._key_axes[axis] = value
+                if self.axes[axis] != value:
+                    self.axes[axis] = value
+                    self.changed = True
+            self.valid = True
+        else:
+            if not self.valid or buf[offset + 3] != self._key_sequence:
+                self.stale += 1
+                return end
+            position = offset + 5
+            self.buttons = self._key_buttons
+            if changed & 1:
+                self.buttons ^= _uint32(buf, position)
+                position += 4
+            for axis in range(AXIS_COUNT):
+                value = self._key_axes[axis]
+                if changed & (2 << axis):
+                    value = _int16(buf, position)
+                    position += 2
+                if self.axes[axis] != value:
+                    self.axes[axis] = value
+                    self.changed = True
+        if self.buttons != buttons:
+            self.changed = True
+        return end
+
+    def pressed(self, button):
+        # button: BUTTON_NAMES のインデックス
+        return (self.buttons >> button) & 1 == 1
+
+
+class MotionDecoder:
+    # モーションフレームから、コントローラーの姿勢・角速度・加速度を取り出す。
+    # 常に最新の値を送るため、失われたフレームは次のフレームで置き換わる。
+    def __init__(self):
+        self.orientation = [0] * 3  # pitch / roll / yaw, 0.01 度
+        self.gyro = [0] * 3         # 0.1 度/秒
+        self.accel = [0] * 3        # mg
+        self.frames = 0
+
+    # buf の offset からモーションフレームを1つデコードし、次のフレームの offset を返す。
+    # モーションフレームでない場合・長さが足りない場合は -1 を返す。
+    def decode(self, buf, offset=0):
+        end = offset + MOTION_FRAME_SIZE
+        if end > len(buf) or not is_motion_frame(buf, offset):
+            return -1
+        for i in range(3):
+            self.orientation[i] = _int16(buf, offset + 2 + 2 * i)
+            self.gyro[i] = _int16(buf, offset + 8 + 2 * i)
+            self.accel[i] = _int16(buf, offset + 14 + 2 * i)
+        self.frames += 1
+        return end
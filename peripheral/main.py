@@ -1,6 +1,19 @@
-from machine import Pin 
 import bluetooth
 from ble_simple_peripheral import BLESimplePeripheral
+from ds4_protocol import (Acknowledger, FrameDecoder, MotionDecoder, StateDecoder, event_name, is_motion_frame,
+                          is_state_frame)
+from runtime import Runtime
+
+try:
+    from machine import Pin
+except ImportError:
+    # unix ポートには Pin が無い
+    Pin = None
+
+try:
+    from machine import WDT
+except ImportError:
+    WDT = None
 
 # Bluetooth Low Energy (BLE) オブジェクトを作成する。
 ble = bluetooth.BLE()
@@ -9,21 +22,95 @@ ble = bluetooth.BLE()
 sp = BLESimplePeripheral(ble)
 
 # オンボード LED の Pin オブジェクトを作成し、出力として設定。
-led = Pin("LED", Pin.OUT)
+led = Pin("LED", Pin.OUT) if Pin is not None else None
 
 # LED の状態を 0 (オフ) に初期化します。
 led_state = 0
-led.value(led_state)
+if led is not None:
+    led.value(led_state)
+
+# 受信したフレームのデコーダ
+decoder = FrameDecoder()
+# スナップショット同期モードの状態フレームから復元したコントローラーの状態
+state = StateDecoder()
+# モーションフレームの姿勢・角速度・加速度
+motion = MotionDecoder()
+
+# 受信したフレームへの応答
+#   ACK_NONE       応答しない
+#   ACK_CUMULATIVE ACK_EVERY フレームごと、または ACK_INTERVAL_MS ごとに累積 ACK を通知する (central/ack_tracker.py)
+#   ACK_ECHO       書き込みごとに受信内容をテキストで返す。デバッグ用で、通信量が倍になる。
+ACK_NONE = 0
+ACK_CUMULATIVE = 1
+ACK_ECHO = 2
+ACK_MODE = ACK_CUMULATIVE
+ACK_EVERY = 16
+ACK_INTERVAL_MS = 100
+acknowledger = Acknowledger(ACK_EVERY)
 
 # 受信したデータを処理するコールバック関数
+# BLE の IRQ の外 (schedule された処理) から呼ばれる。data は受信バッファの memoryview で、この関数内でのみ有効。
 def on_rx(data):
-    # Bluetoothで受信したデータをコンソールに表示。
-    print("Recive by central {}".format(data))
-    sp.send("Responce by peripheral {} : {}".format(data,"any value"))
-
-# メインループ
-while True:
-    # BLE 接続が確立されているかどうかを確認。
-    if sp.is_connected():
-        # データ受信用のコールバック関数を設定。
-        sp.on_write(on_rx)
\ No newline at end of file
+    # 1回の書き込みに複数のフレームが含まれる場合があるため、順にデコードする。
+    offset = 0
+    while offset < len(data):
+        if is_motion_frame(data, offset):
+            # 高頻度で届くため表示せず、telemetry で最新の値を表示する
+            offset = motion.decode(data, offset)
+            if offset < 0:
+                print("Recive by central {}".format(bytes(data)))
+                break
+            continue
+        if is_state_frame(data, offset):
+            offset = state.decode(data, offset)
+            if offset < 0:
+                print("Recive by central {}".format(bytes(data)))
+                break
+            # 状態フレームは ACK しない。失われても次のフレーム (遅くとも次のキーフレーム) で復元される。
+            if state.changed:
+                print("State by central {:05x} {}".format(state.buttons, state.axes))
+            continue
+        offset = decoder.decode(data, offset)
+        if offset < 0:
+            # フレーム以外のデータ(テキスト等)はそのままコンソールに表示。
+            print("Recive by central {}".format(bytes(data)))
+            break
+        # Bluetoothで受信したイベントをコンソールに表示。
+        print("Recive by central {} : {}".format(event_name(decoder.code), decoder.value))
+        if ACK_MODE == ACK_CUMULATIVE and acknowledger.received(decoder.sequence):
+            sp.send(acknowledger.frame())
+    if ACK_MODE == ACK_ECHO:
+        sp.send("Responce by peripheral {} : {}".format(bytes(data),"any value"))
+
+# ACK_EVERY に満たないまま残ったフレームを ACK する
+def flush_ack():
+    if acknowledger.pending() and sp.is_connected():
+        sp.send(acknowledger.frame())
+
+# データ受信用のコールバック関数は一度だけ登録する。以降の受信は BLE の IRQ を契機に呼ばれる。
+sp.on_write(on_rx)
+
+# メインループ: 周期タスクの合間は割り込みが来るまで待機する。
+runtime = Runtime()
+
+# schedule のキューが満杯で処理されなかった受信データを拾う
+runtime.every(100, sp.poll_rx)
+
+if ACK_MODE == ACK_CUMULATIVE:
+    runtime.every(ACK_INTERVAL_MS, flush_ack)
+
+# ループと受信バッファの状態を定期的に表示する
+def telemetry():
+    print("runtime {} {} state lost {} stale {}".format(runtime.stats(), sp.stats(), state.lost, state.stale))
+    if motion.frames:
+        print("motion {} orientation {} gyro {} accel {}".format(motion.frames, motion.orientation, motion.gyro,
+                                                                 motion.accel))
+
+runtime.every(10000, telemetry)
+
+if __name__ == "__main__":
+    if WDT is not None:
+        # ループが止まった場合はウォッチドッグでリセットする
+        wdt = WDT(timeout=8000)
+        runtime.every(1000, wdt.feed)
+    runtime.run()
@@ -0,0 +1,127 @@
+try:
+    from time import sleep_ms, ticks_add, ticks_diff, ticks_ms, ticks_us
+except ImportError:
+    # CPython (テスト用)
+    import time
+
+    def ticks_ms():
+        return time.monotonic_ns() // 1000000
+
+    def ticks_us():
+        return time.monotonic_ns() // 1000
+
+    def ticks_add(ticks, delta):
+        return ticks + delta
+
+    def ticks_diff(end, start):
+        return end - start
+
+    def sleep_ms(ms):
+        time.sleep(ms / 1000)
+
+try:
+    from machine import idle
+except ImportError:
+    idle = None
+
+
+# 割り込み駆動のイベントループ。
+# BLE の受信などは IRQ (とそこから schedule された処理) で行われるため、メインループは周期タスクを実行した後、
+# 次のタスクの期限まで machine.idle() (WFI) で待機する。CPU は割り込みが来るまで停止し、IRQ の処理を妨げない。
+# machine.lightsleep() はクロックを止めて BLE の接続が維持できないため使わない。
+class Runtime:
+    def __init__(self, max_idle_ms=1000):
+        # max_idle_ms: タスクが無い場合でも、この間隔でループに戻る
+        self.max_idle_ms = max_idle_ms
+        self._tasks = []
+        self.running = False
+        # 計測値
+        self.iterations = 0   # タスクの期限を確認したループの回数
+        self.wakeups = 0      # idle() から戻った回数 (割り込みの回数の目安)
+        self.idle_us = 0
+        self.elapsed_us = 0   # 終了した run() の合計
+        self._start = 0
+
+    # period_ms ごとに callback() を呼ぶ。戻り値は cancel() に渡す。
+    def every(self, period_ms, callback):
+        task = [period_ms, ticks_add(ticks_ms(), period_ms), callback]
+        self._tasks.append(task)
+        return task
+
+    def cancel(self, task):
+        if task in self._tasks:
+            self._tasks.remove(task)
+
+    def stop(self):
+        self.running = False
+
+    # 実行中の run() を含めた経過時間
+    def elapsed(self):
+        if self.running:
+            return self.elapsed_us + ticks_diff(ticks_us(), self._start)
+        return self.elapsed_us
+
+    def idle_fraction(self):
+        elapsed = self.elapsed()
+        if elapsed <= 0:
+            return 0.0
+        return self.idle_us / elapsed
+
+    def stats(self):
+        return {
+            "iterations": self.iterations,
+            "wakeups": self.wakeups,
+            "idle": self.idle_fraction(),
+            "elapsed_ms": self.elapsed() // 1000,
+        }
+
+    # 期限を過ぎたタスクを実行し、次の期限までの ms を返す。
+    def _run_due(self, now):
+        wait = self.max_idle_ms
+        for task in self._tasks:
+            late = ticks_diff(now, task[1])
+            if late >= 0:
+                # 大きく遅れた場合は追いつこうとせず、現在時刻から周期を数え直す
+                if late >= task[0]:
+                    task[1] = ticks_add(now, task[0])
+                else:
+                    task[1] = ticks_add(task[1], task[0])
+                task[2]()
+            remaining = ticks_diff(task[1], now)
+            if remaining < wait:
+                wait = remaining
+        return wait
+
+    def _idle(self, ms):
+        if ms <= 0:
+            return
+        if idle is None:
+            sleep_ms(ms)
+            self.wakeups += 1
+            return
+        deadline = ticks_add(ticks_ms(), ms)
+        while self.running and ticks_diff(deadline, ticks_ms()) > 0:
+            idle()
+            self.wakeups += 1
+
+    # stop() が呼ばれるまで (duration_ms を指定した場合はその時間だけ) ループを実行する。
+    def run(self, duration_ms=None):
+        self.running = True
+        self._start = ticks_us()
+        end = None if duration_ms is None else ticks_add(ticks_ms(), duration_ms)
+        try:
+            while self.running:
+                now = ticks_ms()
+                if end is not None:
+                    if ticks_diff(end, now) <= 0:
+                        break
+                wait = self._run_due(now)
+                if end is not None:
+                    wait = min(wait, ticks_diff(end, now))
+                self.iterations += 1
+                t = ticks_us()
+                self._idle(wait)
+                self.idle_us += ticks_diff(ticks_us(), t)
+        finally:
+            self.elapsed_us += ticks_diff(ticks_us(), self._start)
+            self.running = False
@@ -0,0 +1,146 @@
+# MicroPython unix ポートで main.py を動かすための bluetooth モジュールの代用品。
+# 無線は使わず、simulate_* でセントラルの動作を模擬して IRQ ハンドラを呼び出す。
+# 使い方は unix/run.py を参照。
+
+_IRQ_CENTRAL_CONNECT = 1
+_IRQ_CENTRAL_DISCONNECT = 2
+_IRQ_GATTS_WRITE = 3
+_IRQ_MTU_EXCHANGED = 21
+_IRQ_CONNECTION_UPDATE = 27
+
+FLAG_READ = 0x0002
+FLAG_WRITE_NO_RESPONSE = 0x0004
+FLAG_WRITE = 0x0008
+FLAG_NOTIFY = 0x0010
+
+
+class UUID:
+    def __init__(self, value):
+        if isinstance(value, int):
+            self._bytes = bytes((value & 0xFF, (value >> 8) & 0xFF))
+        elif isinstance(value, str):
+            digits = value.replace("-", "")
+            # 128bit UUID はリトルエンディアンで保持する (本物の bluetooth.UUID と同じ)
+            self._bytes = bytes(int(digits[i:i + 2], 16) for i in range(len(digits) - 2, -2, -2))
+        else:
+            self._bytes = bytes(value)
+
+    # MicroPython の bytes() は __bytes__ を使わないため、反復可能にもしておく
+    def __bytes__(self):
+        return self._bytes
+
+    def __iter__(self):
+        return iter(self._bytes)
+
+    def __len__(self):
+        return len(self._bytes)
+
+    def __eq__(self, other):
+        return isinstance(other, UUID) and self._bytes == other._bytes
+
+    def __hash__(self):
+        return hash(self._bytes)
+
+    def __str__(self):
+        return "UUID({})".format(self._bytes)
+
+
+class BLE:
+    # central_mtu: 模擬するセントラルの MTU (BlueZ は 517 を提示する)
+    def __init__(self, central_mtu=517):
+        self._active = False
+        self._handler = None
+        self._values = {}
+        self._buffer_sizes = {}
+        self.central_mtu = central_mtu
+        self._next_handle = 1
+        self.advertising = False
+        self.mtu = 23
+        self._exchanged = {}
+        self.resp_data = None
+        # 計測値
+        self.notifications = 0
+        self.notified_bytes = 0
+        self.last_notification = None
+        self.truncated = 0   # MTU やバッファに収まらず切り捨てられた書き込み・通知の数
+
+    def active(self, *args):
+        if args:
+            self._active = bool(args[0])
+        return self._active
+
+    def config(self, *args, **kwargs):
+        if "mtu" in kwargs:
+            self.mtu = kwargs["mtu"]
+        if args == ("mac",):
+            return (0, b"\x00\x00\x00\x00\x00\x00")
+        if args == ("mtu",):
+            return self.mtu
+        return None
+
+    def irq(self, handler):
+        self._handler = handler
+
+    def gatts_register_services(self, services):
+        handles = []
+        for (_, characteristics) in services:
+            service_handles = []
+            self._next_handle += 1  # サービス宣言
+            for _ in characteristics:
+                self._next_handle += 1  # キャラクタリスティック宣言
+                service_handles.append(self._next_handle)
+                self._values[self._next_handle] = b""
+                self._next_handle += 1
+            handles.append(tuple(service_handles))
+        return tuple(handles)
+
+    def gatts_set_buffer(self, value_handle, length, append=False):
+        self._buffer_sizes[value_handle] = length
+
+    def gattc_exchange_mtu(self, conn_handle):
+        self._exchanged[conn_handle] = min(self.mtu, self.central_mtu)
+        self._handler(_IRQ_MTU_EXCHANGED, (conn_handle, self._exchanged[conn_handle]))
+
+    def gatts_read(self, value_handle):
+        return self._values.get(value_handle, b"")
+
+    def gatts_write(self, value_handle, data, send_update=False):
+        self._values[value_handle] = bytes(data)
+
+    def gatts_notify(self, conn_handle, value_handle, data=None):
+        if data is None:
+            data = self._values.get(value_handle, b"")
+        size = self._exchanged.get(conn_handle, 23) - 3
+        if len(data) > size:
+            self.truncated += 1
+            data = data[:size]
+        self.notifications += 1
+        self.notified_bytes += len(data)
+        self.last_notification = data
+
+    def gap_advertise(self, interval_us, adv_data=None, resp_data=None, connectable=True):
+        self.advertising = interval_us is not None
+        if resp_data is not None:
+            self.resp_data = resp_data
+
+    # 以下はテスト用。セントラルの操作を IRQ として通知する。
+    def simulate_connect(self, conn_handle=0):
+        self.advertising = False
+        self._handler(_IRQ_CENTRAL_CONNECT, (conn_handle, 0, b"\x00\x00\x00\x00\x00\x00"))
+
+    def simulate_disconnect(self, conn_handle=0):
+        self._exchanged.pop(conn_handle, None)
+        self._handler(_IRQ_CENTRAL_DISCONNECT, (conn_handle, 0, b"\x00\x00\x00\x00\x00\x00"))
+
+    def simulate_write(self, value_handle, data, conn_handle=0):
+        # 値のバッファ (既定 20 バイト, gatts_set_buffer で変更) を超えた分は切り捨てられる
+        size = self._buffer_sizes.get(value_handle, 20)
+        if len(data) > size:
+            self.truncated += 1
+            data = data[:size]
+        self._values[value_handle] = bytes(data)
+        self._handler(_IRQ_GATTS_WRITE, (conn_handle, value_handle))
+
+    # interval_ms: セントラルが決めた接続間隔
+    def simulate_connection_update(self, interval_ms, conn_handle=0):
+        self._handler(_IRQ_CONNECTION_UPDATE, (conn_handle, int(interval_ms * 4 / 5), 0, 500, 0))
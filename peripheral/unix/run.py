@@ -0,0 +1,38 @@
+# MicroPython unix ポートで main.py のメインループを動かし、アイドル時間と起床回数を計測する。
+# 無線の代わりに unix/bluetooth.py を使い、セントラルからの書き込みを一定の間隔で模擬する。
+# 使い方: cd peripheral && micropython unix/run.py [秒] [書き込み/秒] [1回に連続して書き込む数]
+import struct
+import sys
+
+sys.path.insert(0, "unix")
+
+import main
+from ds4_protocol import EVENT_NAMES, FLAG_SEQUENCE, VERSION
+
+seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+rate = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+burst = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+
+ble = main.ble
+sp = main.sp
+ble.simulate_connect()
+ble.simulate_connection_update(7.5)
+
+# セントラルが送信するフレーム (ヘッダ, コード, 値, シーケンス番号)
+sent = [0]
+
+
+def write_frame():
+    for _ in range(burst):
+        code = sent[0] % (len(EVENT_NAMES) - 1) + 1
+        frame = struct.pack("<BBhB", (VERSION << 4) | FLAG_SEQUENCE, code, sent[0] & 0x7FFF, sent[0] & 0xFF)
+        ble.simulate_write(sp._handle_rx, frame)
+        sent[0] += 1
+
+
+main.runtime.every(max(1, 1000 // rate), write_frame)
+main.runtime.run(int(seconds * 1000))
+
+print("runtime {} {}".format(main.runtime.stats(), sp.stats()))
+print("frames sent {}, notifications {} ({} bytes), truncated {}".format(
+    sent[0], ble.notifications, ble.notified_bytes, ble.truncated))